@@ -7,7 +7,16 @@ import atexit # atexitをインポート
 from controller import Robot, Lidar, GPS, Display
 from vehicle import Driver
 # 分割したファイルからクラスをインポート
-from utils.log_manager import LogManager
+from utils.log_manager import LogManager, RequestLog
+from utils.perception_cache import PerceptionCache
+from utils.scheduler import MultiRateScheduler
+from utils.artifact_writer import ArtifactWriter
+from utils.frame_recorder import FrameRecorder, frames_dir_for_log
+from utils.response_cache import ResponseCache
+from utils.gemini_payload import PayloadEncoder
+from utils.model_backends import create_backend
+from utils.distilled_policy import DistilledPolicy, DistillationRecorder, distill_path_for_log
+from utils.run_registry import RunRegistry, REGISTRY_FILENAME
 from modes.mode_line_follow import LineFollowMode
 from modes.mode_cv_lane_follow import CVLaneFollowMode
 from modes.mode_gemini import GeminiMode
@@ -27,6 +36,39 @@ TIME_STEP = 50
 #初期（最高）速度
 INITIAL_SPEED = 30.0
 GEMINI_API_KEY_FILENAME = ".env"; API_CALL_INTERVAL_SEC = 2.0
+GEMINI_MAX_COMMAND_AGE_SEC = 1.0 #元フレームからこれ以上経過したGemini指令は使わない（シミュレーション時間）
+GEMINI_REQUEST_DEADLINE_SEC = 5.0; GEMINI_MAX_CONCURRENT_REQUESTS = 2
+#モデルバックエンド（gemini: 本体 / local: ローカル代替モデル。LATENCYは instant,fast,typical,slow,spiky,flaky）
+GEMINI_BACKEND = os.environ.get("GEMINI_BACKEND", "gemini"); GEMINI_LOCAL_LATENCY = os.environ.get("GEMINI_LOCAL_LATENCY", "typical")
+GEMINI_TRIGGER_MODE = 'event' #event: レーン信頼度の低下・見失い時のみ問い合わせ（API_CALL_INTERVAL_SECは最小間隔）, timer: 一定間隔
+#Gemini応答キャッシュ（知覚ハッシュ＋速度区分。PATHをNoneにすると実行ごとに破棄）
+GEMINI_CACHE = True; GEMINI_CACHE_TTL_SEC = 3600.0; GEMINI_CACHE_MAX_ENTRIES = 256
+GEMINI_CACHE_PATH = os.path.join("cache", "gemini_responses.json")
+#Geminiへ送る画像（CROP_TOP: 上側を捨てる割合 / MAX_PIXELS: 縮小後の画素数上限、Noneで原寸 / FORMAT: jpeg,png,pil）
+GEMINI_PAYLOAD_CROP_TOP = 0.25; GEMINI_PAYLOAD_MAX_PIXELS = None; GEMINI_PAYLOAD_FORMAT = 'jpeg'; GEMINI_JPEG_QUALITY = 85
+#Geminiの判断の蒸留（RECORDING: ログと同名の *_distill.bin へ追記 / POLICY_PATH: train_policy.py の出力。あれば先に使い、信頼度が低いときだけGeminiを呼ぶ）
+DISTILL_RECORDING = True; LOCAL_POLICY_PATH = os.path.join("cache", "distilled_policy.npz"); LOCAL_POLICY_CONFIDENCE = 0.7
+#黄線セグメンテーションのバックエンド（'auto'は起動時ベンチマークで選択）
+LINE_SEGMENTATION_BACKEND = 'auto' #auto,numba_serial,numba_prange,lut,opencv
+LINE_TRACKING = True #直前の重心周辺のみを走査する追跡窓
+DEBUG_BUFFER_POOL = False #Trueで定常ステップの配列確保を検出（AssertionError）
+#タスクごとの実行周期（ms、basicTimeStepの倍数に切り上げ）。カメラは知覚周期でサンプリングする
+PERCEPTION_PERIOD_MS = TIME_STEP #画像取得＋レーン/黄線検出
+CONTROL_PERIOD_MS = 10 #知覚の間は直前の検出結果から指令を予測して更新
+LOG_PERIOD_MS = 10 #ログ（従来どおり毎ステップ）
+#走行ログの形式（csv: 従来のCSV / columnar: 列形式バイナリ log_..runlog。EXPORT_CSVで終了時に従来形式の log_..csv も書き出す。CSVを読むツールのため既定で有効）
+LOG_FORMAT = 'columnar'; LOG_EXPORT_CSV = True
+#ログの書き込みを別スレッドでまとめて行う（FLUSH_INTERVAL秒またはFLUSH_ROWS行ごとにファイルへ反映。ゴール・タイムアウト時は即座に反映）
+LOG_ASYNC = True; LOG_FLUSH_INTERVAL_SEC = 1.0; LOG_FLUSH_ROWS = 1024
+#走行台帳（logs/runs.sqlite）に開始・終了を記録する。既存ログは import_runs.py で取り込む
+RUN_REGISTRY = True
+DISPLAY_PERIOD_MS = 100 #スピードメーター描画
+SAVE_IMAGES = False #デバッグ画像（カメラ・鳥瞰画像など）を保存する
+FRAME_RECORDING = True #Trueならログと同名の *_frames ディレクトリへチャンク記録、FalseならPNGを1枚ずつ保存
+#デバッグ画像の非同期保存（codec: png,jpg,webp / level: pngは圧縮0-9、jpg・webpは品質 / policy: drop_oldest,sample_every_n）
+ARTIFACT_CODEC = 'png'; ARTIFACT_LEVEL = 1; ARTIFACT_WORKERS = 2; ARTIFACT_QUEUE_SIZE = 64
+ARTIFACT_POLICY = 'drop_oldest'; ARTIFACT_SAMPLE_EVERY = 1
+PIPELINED_PERCEPTION = False #Trueで知覚処理を別スレッドで実行（1知覚周期の遅延と引き換えにステップ時間を短縮）
 
 gemini_mode_instance = None 
 
@@ -38,18 +80,37 @@ class VehicleController:
         print(f"✅ 運転モード '{self.mode_name}' で起動します。")
         self.steering_angle, self.speed, self.last_speed_kmh, self.last_pos_y = 0.0, 0.0, 0.0, -9999.0
         self.is_logging_active = False; self.lap_start_time = 0.0; self.has_finished = False; self.was_in_finish_zone = False
+        self.scheduler = MultiRateScheduler(self.driver.getBasicTimeStep())
+        self.scheduler.add('perception', PERCEPTION_PERIOD_MS); self.scheduler.add('control', CONTROL_PERIOD_MS)
+        self.scheduler.add('log', LOG_PERIOD_MS); self.scheduler.add('display', DISPLAY_PERIOD_MS)
+        self.last_command = None
         self._init_sensors()
         self.final_log_done = False
-        self.log_manager = LogManager(mode=self.mode_name, run_id=RUN_ID)
-
-        if self.mode_name == 'LINE_FOLLOW': self.driving_logic = LineFollowMode(INITIAL_SPEED,False)
+        self.log_manager = LogManager(mode=self.mode_name, run_id=RUN_ID, format=LOG_FORMAT, export_csv=LOG_EXPORT_CSV, async_flush=LOG_ASYNC, flush_interval=LOG_FLUSH_INTERVAL_SEC, flush_rows=LOG_FLUSH_ROWS)
+        # ステップ内の知覚結果（デコード画像・エッジ・レーン検出結果など）を各処理で共有
+        self.perception_cache = PerceptionCache()
+        self.request_log = None
+        self.distill_recorder = None
+        # デバッグ画像の保存は制御ステップの外で行う（保存しない場合はスレッドも起動しない）
+        self.artifact_writer = ArtifactWriter(ARTIFACT_CODEC, ARTIFACT_LEVEL, ARTIFACT_WORKERS, ARTIFACT_QUEUE_SIZE, ARTIFACT_POLICY, ARTIFACT_SAMPLE_EVERY)
+        # フレームはログCSVと同じ名前のディレクトリへ記録し、timestamp列で突き合わせられるようにする
+        self.frame_recorder = FrameRecorder(frames_dir_for_log(self.log_manager.log_file_path)) if SAVE_IMAGES and FRAME_RECORDING else None
+
+        if self.mode_name == 'LINE_FOLLOW': self.driving_logic = LineFollowMode(INITIAL_SPEED,SAVE_IMAGES,segmentation_backend=LINE_SEGMENTATION_BACKEND,tracking=LINE_TRACKING,camera=self.camera,debug_buffers=DEBUG_BUFFER_POOL,perception_cache=self.perception_cache,pipelined=PIPELINED_PERCEPTION,artifact_writer=self.artifact_writer,frame_recorder=self.frame_recorder)
         elif self.mode_name == 'CV_LANE_FOLLOW':
-            self.driving_logic = CVLaneFollowMode(self.camera, INITIAL_SPEED, False, './images/cv_lane')
+            self.driving_logic = CVLaneFollowMode(self.camera, INITIAL_SPEED, SAVE_IMAGES, './images/cv_lane', debug_buffers=DEBUG_BUFFER_POOL, perception_cache=self.perception_cache, pipelined=PIPELINED_PERCEPTION, artifact_writer=self.artifact_writer, frame_recorder=self.frame_recorder)
         elif self.mode_name == 'GEMINI':
             os.makedirs('./images/hybrid', exist_ok=True)
             #gemini_mode_instance = GeminiMode(self.camera, GEMINI_API_KEY_FILENAME, INITIAL_SPEED, API_CALL_INTERVAL_SEC, True, './images/gemini') 
             #driving_logic = CVGeminiHybridMode(self.camera, gemini_mode_instance, INITIAL_SPEED)
-            self.driving_logic = CVGeminiHybridMode(self.camera,GEMINI_API_KEY_FILENAME,INITIAL_SPEED, API_CALL_INTERVAL_SEC,save_artifacts=False)
+            payload_encoder = PayloadEncoder(GEMINI_PAYLOAD_CROP_TOP, GEMINI_PAYLOAD_MAX_PIXELS, GEMINI_PAYLOAD_FORMAT, GEMINI_JPEG_QUALITY)
+            self.request_log = RequestLog(self.log_manager.log_file_path)
+            model_backend = create_backend(GEMINI_BACKEND, GEMINI_API_KEY_FILENAME, GEMINI_LOCAL_LATENCY, INITIAL_SPEED, seed=RUN_ID)
+            response_cache = ResponseCache(GEMINI_CACHE_MAX_ENTRIES, GEMINI_CACHE_TTL_SEC, path=GEMINI_CACHE_PATH) if GEMINI_CACHE else None
+            self.distill_recorder = DistillationRecorder(distill_path_for_log(self.log_manager.log_file_path)) if DISTILL_RECORDING else None
+            local_policy = DistilledPolicy.load(LOCAL_POLICY_PATH) if LOCAL_POLICY_PATH and os.path.isfile(LOCAL_POLICY_PATH) else None
+            if local_policy: print(f"✅ 代替ポリシーを読み込みました: {LOCAL_POLICY_PATH}（学習 {local_policy.n_samples}件）")
+            self.driving_logic = CVGeminiHybridMode(self.camera,GEMINI_API_KEY_FILENAME,INITIAL_SPEED, API_CALL_INTERVAL_SEC,save_artifacts=SAVE_IMAGES,debug_buffers=DEBUG_BUFFER_POOL,perception_cache=self.perception_cache,pipelined=PIPELINED_PERCEPTION,artifact_writer=self.artifact_writer,frame_recorder=self.frame_recorder,response_cache=response_cache,payload_encoder=payload_encoder,request_log=self.request_log,trigger_mode=GEMINI_TRIGGER_MODE,max_command_age=GEMINI_MAX_COMMAND_AGE_SEC,request_deadline=GEMINI_REQUEST_DEADLINE_SEC,max_concurrent_requests=GEMINI_MAX_CONCURRENT_REQUESTS,model_backend=model_backend,local_policy=local_policy,policy_confidence=LOCAL_POLICY_CONFIDENCE,distill_recorder=self.distill_recorder)
         else: raise ValueError("無効な運転モードです。")
 
         # ✅ 実験環境ログの書き込み
@@ -79,13 +140,24 @@ class VehicleController:
                 getattr(self.log_manager, 'log_file_path', '')
             ])
 
+        # ✅ 走行台帳に開始を記録（結果は終了時に書く）
+        self.registry, self.registry_row, self.outcome, self.result_lap_time = None, None, None, None
+        if RUN_REGISTRY:
+            try:
+                self.registry = RunRegistry(os.path.join("logs", REGISTRY_FILENAME))
+                self.registry_row = self.registry.start_run(
+                    self.log_manager.log_file_path, self.mode_name, RUN_ID, INITIAL_SPEED, TIME_STEP,
+                    getattr(self.driving_logic, 'base_initial_speed', None), getattr(self.driving_logic, 'initial_steering', None))
+            except Exception as e:
+                print(f"⚠️ 走行台帳に記録できませんでした: {e}"); self.registry = None
+
         # ✅ 初期速度は「ランダム後」の速度で set
         self.set_speed(getattr(self.driving_logic, 'base_initial_speed', INITIAL_SPEED))
         #self.set_speed(INITIAL_SPEED)
 
 
     def _init_sensors(self):
-        self.camera = self.driver.getDevice("camera"); self.camera.enable(TIME_STEP)
+        self.camera = self.driver.getDevice("camera"); self.camera.enable(self.scheduler.periods['perception'])
         self.gps = self.driver.getDevice("gps"); self.gps.enable(TIME_STEP)
         self.display = self.driver.getDevice("display")
         if self.display:
@@ -103,30 +175,49 @@ class VehicleController:
             self.driver.setBrakeIntensity(1.0); 
             self.set_speed(0); 
             if not self.final_log_done:
-                self._log_and_display()
+                # 最終行はログ周期に関係なく必ず書き、バッチ実行のタイムアウトで強制終了されても残るようファイルへ反映する
+                self._log(); self._display()
+                self.log_manager.drain()
+                self._finish_registry(self.outcome)
                 self.final_log_done = True
             
             return False
 
+        now_ms = int(round(self.driver.getTime() * 1000))
+        self.perception_cache.begin_frame(self.driver.getTime())
         self._update_lap_status()
-        if self.mode_name == 'GEMINI': 
-            #image_bytes = self.camera.getImage()
-            #with self.driving_logic.lock:
-            #    self.driving_logic.shared_image_bytes = image_bytes
-
-            current_speed_kmh = self.driver.getCurrentSpeed() 
-            proposed_steer, proposed_speed, brake = self.driving_logic.get_command(self.camera, current_speed_kmh)
-
-            #proposed_steer, proposed_speed, brake = self.driving_logic.get_command(self.camera)
-
-        else: 
-            proposed_steer, proposed_speed, brake = self.driving_logic.get_command(self.camera)
-        
-        final_steer, final_speed = proposed_steer, proposed_speed
-        if brake: self.driver.setBrakeIntensity(0.8)
-        else: self.driver.setBrakeIntensity(0.0)
-        self.set_speed(final_speed); self.set_steering_angle(final_steer)
-        self._log_and_display()
+        perceive = self.scheduler.due('perception', now_ms) or self.last_command is None
+        control = self.scheduler.due('control', now_ms)
+        command = None
+        if perceive:
+            if self.mode_name == 'GEMINI': 
+                #image_bytes = self.camera.getImage()
+                #with self.driving_logic.lock:
+                #    self.driving_logic.shared_image_bytes = image_bytes
+
+                current_speed_kmh = self.driver.getCurrentSpeed() 
+                command = self.driving_logic.get_command(self.camera, current_speed_kmh)
+
+                #proposed_steer, proposed_speed, brake = self.driving_logic.get_command(self.camera)
+
+            else: 
+                command = self.driving_logic.get_command(self.camera)
+        if command is not None:
+            self.last_command = command
+        elif control or perceive:
+            # 新しい画像がないステップ（またはパイプラインの最初のフレームでまだ知覚結果が
+            # ないステップ）: 直前の検出結果から指令を予測する
+            dt = self.scheduler.periods['control'] / 1000.0
+            self.last_command = self.driving_logic.predict_command(self.last_command, dt, self.driver.getCurrentSpeed())
+
+        if perceive or control:
+            proposed_steer, proposed_speed, brake = self.last_command
+            final_steer, final_speed = proposed_steer, proposed_speed
+            if brake: self.driver.setBrakeIntensity(0.8)
+            else: self.driver.setBrakeIntensity(0.0)
+            self.set_speed(final_speed); self.set_steering_angle(final_steer)
+        if self.scheduler.due('log', now_ms): self._log()
+        if self.scheduler.due('display', now_ms): self._display()
 
         return True
 
@@ -137,12 +228,21 @@ class VehicleController:
                 self.is_logging_active, self.lap_start_time = True, current_time; self.log_manager.start_logging(); print(f"🏁 スタート！")
         else:
             lap_time = current_time - self.lap_start_time
-            if lap_time > TIMEOUT_SECONDS: print(f"⏰ タイムアウト"); self.has_finished = True
+            if lap_time > TIMEOUT_SECONDS: print(f"⏰ タイムアウト"); self.has_finished = True; self.outcome = 'timeout'
             if lap_time > LAP_FINISH_MIN_TIME and (self.last_pos_y <= GOAL_Y_THRESHOLD and pos_y > GOAL_Y_THRESHOLD and GOAL_X_MIN < pos_x < GOAL_X_MAX):
-                print(f"🎉 ゴール！ラップタイム: {lap_time:.2f} 秒"); self.has_finished = True
+                print(f"🎉 ゴール！ラップタイム: {lap_time:.2f} 秒"); self.has_finished = True; self.outcome, self.result_lap_time = 'goal', lap_time
         self.last_pos_y = pos_y
 
-    def _log_and_display(self):
+    def _finish_registry(self, status):
+        if self.registry is None or self.registry_row is None:
+            return
+        try:
+            self.registry.finish_run(self.registry_row, status, self.result_lap_time)
+        except Exception as e:
+            print(f"⚠️ 走行台帳に結果を記録できませんでした: {e}")
+        self.registry_row = None
+
+    def _log(self):
         if self.is_logging_active:
             # === 各種値の取得 ===
             current_time = self.driver.getTime()
@@ -161,6 +261,9 @@ class VehicleController:
             actual_steering = self.driver.getSteeringAngle()
             error_angle = actual_steering - self.steering_angle
 
+            worker = self.driving_logic.perception_worker
+            response_cache = getattr(self.driving_logic, 'response_cache', None)
+
             # === ログ記録 ===
             log_data = {
                 "timestamp": current_time,
@@ -172,18 +275,24 @@ class VehicleController:
                 "steering_angle": actual_steering,
                 "target_steering_angle": self.steering_angle,
                 "acceleration": acceleration,
-                "mode_name": self.mode_name,
-                "run_id": RUN_ID,
                 "is_goal": int(self.has_finished),
                 "is_logging_active": int(self.is_logging_active),
                 "error_angle": error_angle,
+                # 値のない指標は NaN（CSVでは空欄、列形式では NaN として記録）
+                "pixels_scanned": getattr(self.driving_logic, 'pixels_scanned', math.nan),
+                "perception_seq": worker.last_seq if worker and worker.last_seq is not None else math.nan,
+                "perception_saved_ms": worker.last_saved_ms if worker else math.nan,
+                "perception_latency_ms": worker.last_latency_ms if worker else math.nan,
+                "gemini_cache_hits": response_cache.hits if response_cache else math.nan,
+                "gemini_cache_misses": response_cache.misses if response_cache else math.nan,
+                "gemini_api_calls": getattr(self.driving_logic, 'api_calls', math.nan),
                 # "control_latency": self.latest_latency  # ← run_step内で記録が必要（今後対応）
             }
             self.log_manager.log_step(log_data)
 
         self.last_speed_kmh = self.driver.getCurrentSpeed()
 
-        # === 表示処理 ===
+    def _display(self):
         if self.display and self.speedometer_image:
             self.display.imagePaste(self.speedometer_image, 0, 0, False)
             speed = self.driver.getCurrentSpeed()
@@ -213,7 +322,21 @@ class VehicleController:
     atexit.register(perform_cleanup)
 
     def close(self):
+         print(f"⏱️ スケジューラ: {self.scheduler.summary()}")
+         if self.driving_logic.perception_worker:
+             self.driving_logic.perception_worker.stop(); print(f"⏱️ {self.driving_logic.perception_worker.summary()}")
+         if getattr(self.driving_logic, 'response_cache', None):
+             self.driving_logic.response_cache.close(); print(f"🗂️ {self.driving_logic.response_cache.summary()}")
+         if self.mode_name == 'GEMINI': self.driving_logic.cleanup()
+         if self.request_log: self.request_log.close()
+         if self.distill_recorder: self.distill_recorder.close()
+         if self.frame_recorder:
+             self.frame_recorder.close(); print(f"🎞️ フレーム記録: {self.frame_recorder.summary()} → {self.frame_recorder.root_dir}")
+         if self.artifact_writer.submitted:
+             self.artifact_writer.close(); print(f"🖼️ {self.artifact_writer.summary()}")
          self.log_manager.close()
+         # ゴール・タイムアウト前に終了した走行は中断として記録する
+         self._finish_registry(self.outcome or 'aborted')
 
 if __name__ == "__main__":
 
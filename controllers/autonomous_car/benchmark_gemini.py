@@ -0,0 +1,89 @@
+# benchmark_gemini.py
+# ローカル代替モデルの遅延プロファイルを掃引し、ハイブリッドモードの劣化をオフラインで測る
+#
+# 範囲: 代替モデルは別プロセスのサーバーではなく、GenerativeModel 互換のインプロセスの
+# オブジェクト（utils/model_backends.LocalStandInModel）。記録した画像を再生するだけで車両は
+# 動かないため、周回の成否は測らない。代わりに、切り替え中に新しい指令を使えた割合（served）・
+# 停止指令のフレーム数（brake）・ステップ時間を出す。周回の成否は GEMINI_BACKEND=local で
+# Webots を実行して確認する。
+import argparse
+import random
+import time
+import numpy as np
+
+from utils.replay import ReplayCamera, load_recording, CAMERA_FOV
+from utils.perception_cache import PerceptionCache
+from utils.model_backends import LocalBackend, LatencyProfile, LATENCY_PRESETS
+from modes.mode_cv_lane_gemini import CVGeminiHybridMode
+
+# --- 設定 ---
+INITIAL_SPEED = 30.0
+PERIOD_SEC = 0.05          # 1フレームの実時間（TIME_STEP）。Geminiの応答遅延と同じ時間軸で再生する
+API_CALL_INTERVAL_SEC = 2.0
+
+
+def run_profile(frames, preset, trigger_mode='event', seed=0):
+    """1つの遅延プロファイルで記録を実時間で再生し、集計を返す。"""
+    random.seed(seed)
+    height, width = frames[0].image.shape[:2]
+    camera = ReplayCamera(width, height, CAMERA_FOV)
+    cache = PerceptionCache()
+    backend = LocalBackend(LatencyProfile(seed=seed, **LATENCY_PRESETS[preset]), INITIAL_SPEED)
+    logic = CVGeminiHybridMode(camera, None, INITIAL_SPEED, API_CALL_INTERVAL_SEC, perception_cache=cache,
+                               trigger_mode=trigger_mode, model_backend=backend)
+
+    step_ms, brakes = [], 0
+    next_tick = time.perf_counter()
+    for frame in frames:
+        camera.set_frame(frame.image)
+        cache.begin_frame(frame.sim_time)
+        t0 = time.perf_counter()
+        _, _, brake = logic.get_command(camera, INITIAL_SPEED)
+        step_ms.append((time.perf_counter() - t0) * 1000.0)
+        brakes += int(bool(brake))
+        next_tick += PERIOD_SEC
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+    logic.cleanup()
+
+    steps = np.array(step_ms[2:] or [0.0])  # 初期指令とJITの初回呼び出しを除く
+    counts = logic.gemini_client.counts
+    return {
+        'profile': backend.describe(),
+        'frames': len(frames),
+        'api_calls': logic.api_calls,
+        'ok': counts['ok'], 'timeout': counts['timeout'], 'cancelled': counts['cancelled'],
+        'stale': counts['stale'] + logic.stale_commands, 'error': counts['error'],
+        'handoff_frames': logic.handoff_frames,
+        'served': logic.gemini_commands_used / logic.handoff_frames if logic.handoff_frames else float('nan'),
+        'brake_frames': brakes,
+        'step_mean_ms': float(steps.mean()),
+        'step_p99_ms': float(np.percentile(steps, 99)),
+        'jitter_ms': float(steps.std()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカル代替モデルによるハイブリッドモードの遅延ベンチマーク")
+    parser.add_argument('recordings', nargs='+', help="*_frames ディレクトリ、画像ディレクトリ、またはglobパターン")
+    parser.add_argument('--profile', action='append', choices=list(LATENCY_PRESETS), help="掃引する遅延プロファイル（既定は全て）")
+    parser.add_argument('--trigger', default='event', choices=['event', 'timer'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    header = (f"{'profile':<44} {'calls':>5} {'ok':>4} {'t/o':>4} {'canc':>4} {'stale':>5} {'err':>4} "
+              f"{'handoff':>7} {'served':>7} {'brake':>5} {'step':>7} {'p99':>7} {'jitter':>7}")
+    for recording in args.recordings:
+        frames = load_recording(recording, PERIOD_SEC)
+        print(f"\n=== {recording}（{len(frames)}フレーム、トリガー: {args.trigger}）===")
+        print(header)
+        for preset in args.profile or list(LATENCY_PRESETS):
+            r = run_profile(frames, preset, args.trigger, args.seed)
+            print(f"{r['profile']:<44} {r['api_calls']:>5} {r['ok']:>4} {r['timeout']:>4} {r['cancelled']:>4} "
+                  f"{r['stale']:>5} {r['error']:>4} {r['handoff_frames']:>7} {r['served']:>7.1%} {r['brake_frames']:>5} "
+                  f"{r['step_mean_ms']:>6.2f}ms {r['step_p99_ms']:>6.2f}ms {r['jitter_ms']:>6.2f}ms")
+    print("\nserved: Geminiへの切り替え中に新しい指令を使えたフレームの割合"
+          "（実際の周回成否は GEMINI_BACKEND=local で Webots を実行して確認する）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# import_runs.py
+# 既存の走行ログと experiment_config_log.csv から走行台帳（logs/runs.sqlite）を作る
+import argparse
+import os
+
+from utils.run_registry import RunRegistry, REGISTRY_FILENAME
+
+# 台帳ができる前のログは TIME_STEP を記録していないので、当時の既定値を入れる
+DEFAULT_TIME_STEP_MS = 50
+
+
+def main():
+    parser = argparse.ArgumentParser(description="既存の走行ログを走行台帳に取り込む")
+    parser.add_argument('--logs', default="logs", help="ログのディレクトリ（サブディレクトリも探す）")
+    parser.add_argument('--db', default=None, help=f"台帳のパス（既定は <logs>/{REGISTRY_FILENAME}）")
+    parser.add_argument('--config-log', default=None, help="設定ログ（既定は <logs>/experiment_config_log.csv）")
+    parser.add_argument('--time-step', type=int, default=DEFAULT_TIME_STEP_MS)
+    args = parser.parse_args()
+
+    registry = RunRegistry(args.db or os.path.join(args.logs, REGISTRY_FILENAME))
+    config_log = args.config_log or os.path.join(args.logs, "experiment_config_log.csv")
+    count = registry.import_logs(args.logs, config_log, args.time_step)
+    print(f"✅ {count}件のログを取り込みました（台帳の合計 {registry.count()}件）: {registry.path}")
+
+    runs = registry.select_runs()
+    summary = {}
+    for r in runs:
+        key = (r['mode_name'], r['target_speed_kmh'])
+        total, goals = summary.get(key, (0, 0))
+        summary[key] = (total + 1, goals + r['is_goal'])
+    for (mode, speed), (total, goals) in sorted(summary.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+        print(f"  {mode:<16} {speed if speed is not None else '-':>6} km/h: {total:>3}件（ゴール {goals}件）")
+
+
+if __name__ == '__main__':
+    main()
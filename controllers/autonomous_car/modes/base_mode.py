@@ -5,6 +5,7 @@ class BaseMode:
         self.base_initial_speed = self._randomize_speed(base_speed_kmh)
         self.initial_steering = self._randomize_steering()
         self.starting = True
+        self.perception_worker = None  # パイプライン実行時の PerceptionWorker
         print(f"✅ BaseMode初期化: 初期速度={self.base_initial_speed:.2f} km/h, 初期ステアリング={self.initial_steering:.3f}")
 
 
@@ -19,3 +20,15 @@ class BaseMode:
             self.starting = False
             return self.initial_steering, self.base_initial_speed, False
         return None  # 初期ステップ以外
+
+    def perceive(self, frame, key, compute):
+        # 知覚結果を (元フレーム, 結果) で返す。パイプライン実行時は1フレーム前の結果になり、
+        # 最初のフレームでは (None, None)。そのとき get_command は None を返し、呼び出し側が
+        # predict_command で直前の指令を保持する
+        if self.perception_worker is None:
+            return frame, frame.get(key, compute)
+        return self.perception_worker.exchange(frame, key, compute)
+
+    def predict_command(self, last_command, dt, current_speed_kmh):
+        # 知覚更新の間の制御ステップ用の安価な予測（既定では直前の指令を保持する）
+        return last_command
@@ -0,0 +1,63 @@
+# modes/lane_mode.py
+# CVレーン検出を使うモード（CVレーン追従・CV+Geminiハイブリッド）の共通部分
+import math
+from .base_mode import BaseMode
+from utils.lane_pipeline import LanePipeline
+from utils.buffer_pool import FrameBufferPool
+from utils.lane_tracker import SlidingWindowLaneTracker
+from utils.perception_cache import PerceptionCache
+from utils.perception_worker import PerceptionWorker
+
+LANE_WIDTH_M = 3.5  # 実際の車線幅の目安（画素↔メートル換算用）
+LANE_WIDTH_PIXELS = 350  # 鳥瞰画像でのレーン幅の初期値（トラッカーが学習する）
+
+
+class LaneModeBase(BaseMode):
+    """ROI切り出し + remap の前処理とスライディングウィンドウのトラッカーでレーンを検出する。
+
+    _detect_lanes をレーン検出の知覚処理として perceive に渡し、知覚更新の間は
+    predict_command で直前のレーンオフセットから指令を予測する。
+    """
+
+    def __init__(self, camera, initial_speed, debug_buffers=False, heading_gain=0.0, perception_cache=None, pipelined=False):
+        super().__init__(initial_speed)
+        self.camera_height = camera.getHeight()
+        self.camera_width = camera.getWidth()
+        # ROI切り出し + remapによる前処理（マップは解像度ごとにディスクへキャッシュ）
+        self.buffers = FrameBufferPool(self.camera_width, self.camera_height, debug=debug_buffers)
+        self.pipeline = LanePipeline(self.camera_width, self.camera_height, pool=self.buffers)
+        self.M, self.invM = self.pipeline.M, self.pipeline.invM
+        # 同一ステップの知覚結果を他の利用者（画像保存・Geminiワーカーなど）と共有する
+        self.perception_cache = perception_cache if perception_cache is not None else PerceptionCache()
+        self.LANE_WIDTH_PIXELS = LANE_WIDTH_PIXELS
+        # 前フレームのレーン多項式の周辺だけを探索するトラッカー（レーン幅は初期値から学習）
+        self.tracker = SlidingWindowLaneTracker(self.camera_width, self.pipeline.warped.shape[0], self.LANE_WIDTH_PIXELS)
+        self.heading_gain = heading_gain
+        if pipelined:
+            self.perception_worker = PerceptionWorker()
+        self.lane_heading, self.lane_curvature = 0.0, 0.0
+        self.last_offset = None  # 直前のレーン中心オフセット（画素）。知覚更新の間の予測に使う
+        # 状態を記憶するための変数
+        self.last_left_base = None
+        self.last_right_base = None
+        self.lost_line_counter = 0
+
+    def predict_command(self, last_command, dt, current_speed_kmh):
+        # 直前のレーンオフセットを保持し、現在の速度と操舵角で横ずれを積分して更新する
+        if self.last_offset is None:
+            return last_command
+        steer, speed, brake = last_command
+        lateral_m = current_speed_kmh / 3.6 * dt * math.sin(steer)
+        self.last_offset -= lateral_m * self.tracker.lane_width / LANE_WIDTH_M
+        return self.last_offset * 0.006 + self.heading_gain * self.lane_heading, speed, brake
+
+    def _detect_lanes(self, frame):
+        # 同じフレームでは PerceptionCache により一度だけ実行される
+        self.buffers.begin_step()
+        warped = self.pipeline.process(frame.bgra())
+        frame.put_buffer('gray', self.pipeline.gray)
+        frame.put_buffer('edges', self.pipeline.edges)
+        frame.put_buffer('warped', warped)
+        lanes = self.tracker.update(warped, self.pipeline.compute_histogram)
+        self.buffers.end_step()
+        return lanes
@@ -1,63 +1,43 @@
 # modes/mode_cv_lane_follow.py (交差点対応版)
-import numpy as np
 import cv2
 import os
 import datetime
-from .base_mode import BaseMode
+from .lane_mode import LaneModeBase
+from utils.artifact_writer import ArtifactWriter
 
-class CVLaneFollowMode(BaseMode):
-    def __init__(self, camera, initial_speed, save_images=False, save_dir='./images/cv_lane'):
+class CVLaneFollowMode(LaneModeBase):
+    def __init__(self, camera, initial_speed, save_images=False, save_dir='./images/cv_lane', debug_buffers=False, heading_gain=0.0, perception_cache=None, pipelined=False, artifact_writer=None, frame_recorder=None):
 
-        super().__init__(initial_speed)
+        super().__init__(camera, initial_speed, debug_buffers, heading_gain, perception_cache, pipelined)
 
         self.initial_speed = initial_speed
-        self.camera_height = camera.getHeight()
-        self.camera_width = camera.getWidth()
-        self.M, self.invM = self._calculate_perspective_transform()
         self.save_images = save_images
+        # 画像のエンコードと書き込みは ArtifactWriter のスレッドで行う
+        self.artifact_writer = artifact_writer if artifact_writer is not None else ArtifactWriter()
+        # frame_recorder があればPNGの代わりにチャンクファイルへ生のまま追記する
+        self.frame_recorder = frame_recorder
         self.save_dir = save_dir
         
-        # 状態を記憶するための変数
-        self.last_left_base = None
-        self.last_right_base = None
-        self.LANE_WIDTH_PIXELS = 350
-        
-        # ✅ --- 線を見失った時間をカウントする変数を追加 ---
-        self.lost_line_counter = 0
-        
         print("✅ CVレーン検出モードの準備完了。画像保存:", "有効" if save_images else "無効")
 
-    def _calculate_perspective_transform(self):
-        h, w = self.camera_height, self.camera_width
-        src = np.float32([[w * 0.15, h * 0.7], [w * 0.85, h * 0.7], [w, h], [0, h]])
-        dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
-        return cv2.getPerspectiveTransform(src, dst), cv2.getPerspectiveTransform(dst, src)
-    
     def get_command(self, camera):
 
         initial = self.get_initial_command()
         if initial:
             return initial
 
-        image_bytes = camera.getImage()
-        if not image_bytes: return 0.0, 0.0, True
+        frame = self.perception_cache.frame(camera)
+        if not frame.image_bytes: return 0.0, 0.0, True
 
-        h, w = self.camera_height, self.camera_width
-        img = np.frombuffer(image_bytes, np.uint8).reshape((h, w, 4))
-        bgr_img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        
-        gray_img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
-        blur_img = cv2.GaussianBlur(gray_img, (5, 5), 0)
-        edges_img = cv2.Canny(blur_img, 50, 150)
-        warped_img = cv2.warpPerspective(edges_img, self.M, (w, h), flags=cv2.INTER_LINEAR)
-        
-        histogram = np.sum(warped_img[h//2:, :], axis=0)
-        midpoint = np.int32(histogram.shape[0]/2)
-        left_base = np.argmax(histogram[:midpoint])
-        right_base = np.argmax(histogram[midpoint:]) + midpoint
-        
-        left_detected = histogram[left_base] > 300
-        right_detected = histogram[right_base] > 300
+        w = self.camera_width
+        frame, lanes = self.perceive(frame, 'lane', self._detect_lanes)
+        if frame is None:
+            return None  # パイプラインの最初のフレーム（まだ結果がない）
+        self.last_offset = None
+        midpoint = w // 2
+        left_base, right_base = lanes.left_base, lanes.right_base
+        left_detected, right_detected = lanes.left_detected, lanes.right_detected
+        self.lane_heading, self.lane_curvature = lanes.heading, lanes.curvature
         
         lane_center = 0
 
@@ -71,12 +51,12 @@ class CVLaneFollowMode(BaseMode):
             # ケース2: 左側のみ検出
             self.lost_line_counter = 0
             self.last_left_base = left_base
-            lane_center = (left_base + (left_base + self.LANE_WIDTH_PIXELS)) / 2
+            lane_center = (left_base + (left_base + lanes.lane_width)) / 2
         elif right_detected and self.last_left_base is not None:
             # ケース3: 右側のみ検出
             self.lost_line_counter = 0
             self.last_right_base = right_base
-            lane_center = ((right_base - self.LANE_WIDTH_PIXELS) + right_base) / 2
+            lane_center = ((right_base - lanes.lane_width) + right_base) / 2
         else:
             # ケース4: 両方見えない場合 (交差点と判断)
             self.lost_line_counter += 1
@@ -88,16 +68,20 @@ class CVLaneFollowMode(BaseMode):
                 return 0.0, 0.0, True
 
         offset = lane_center - midpoint
-        steering_angle = offset * 0.006
+        self.last_offset = offset
+        steering_angle = offset * 0.006 + self.heading_gain * lanes.heading
 
-        if self.save_images:
+        if self.save_images and self.frame_recorder is not None:
+            self.frame_recorder.record_frame('original', frame, frame.bgra())
+            self.frame_recorder.record_frame('warped', frame, frame.peek('warped'))
+        elif self.save_images:
             os.makedirs(self.save_dir, exist_ok=True)
             timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
             
-            original_path = os.path.join(self.save_dir, f"{timestamp}_original.png")
-            warped_path = os.path.join(self.save_dir, f"{timestamp}_warped.png")
+            original_path = os.path.join(self.save_dir, f"{timestamp}_original")
+            warped_path = os.path.join(self.save_dir, f"{timestamp}_warped")
             
-            cv2.imwrite(original_path, bgr_img)
-            cv2.imwrite(warped_path, warped_img)
+            self.artifact_writer.submit(original_path, frame.bgra(), cv2.COLOR_BGRA2BGR)
+            self.artifact_writer.submit(warped_path, frame.peek('warped'))  # 鳥瞰画像の下半分
 
         return steering_angle, self.initial_speed, False
\ No newline at end of file
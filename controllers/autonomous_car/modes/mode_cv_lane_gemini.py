@@ -4,96 +4,209 @@ import cv2
 import os
 import datetime
 import threading
-from PIL import Image
 import json
 import time
-import google.generativeai as genai
-from .base_mode import BaseMode
+from .lane_mode import LaneModeBase
+from utils.artifact_writer import ArtifactWriter
+from utils.response_cache import dhash
+from utils.gemini_payload import PayloadEncoder
+from utils.gemini_client import AsyncGeminiClient
+from utils.model_backends import GeminiBackend
+from utils.frame_handoff import FrameHandoff
+from utils.distilled_policy import policy_features
 
-class CVGeminiHybridMode(BaseMode):
-    def __init__(self, camera, api_key_filename, initial_speed, api_call_interval, save_artifacts=False, save_dir='./images/hybrid'):
-        super().__init__(initial_speed)
+GEMINI_HANDOFF_FRAMES = 50    # 両側を見失ってからGeminiの指令に切り替えるまでのフレーム数
+PREFETCH_FRAMES = 10          # 切り替えの何フレーム前から先読みリクエストを出すか
+CONFIDENCE_TRIGGER = 0.6      # レーン信頼度がこれを下回り、かつ低下中ならリクエストする
+TRIGGER_MODES = ('event', 'timer')
+
+DRIVING_PROMPT = """
+        あなたは自動運転AIです。以下の画像は前方カメラの映像です。
+        もし横断歩道付近に動物や人がいて、今から横断する可能性がある場合は、
+        必ず速度を下げるか停止してください。
+        現在の速度{speed}
+        ステアリング角度 (-0.5〜0.5)、速度 (0〜{max_speed}) をJSONで返してください。
+        {{
+          "steering_angle": [float],
+          "speed_kmh": [float]
+        }}
+        """
+
+class CVGeminiHybridMode(LaneModeBase):
+    def __init__(self, camera, api_key_filename, initial_speed, api_call_interval, save_artifacts=False, save_dir='./images/hybrid', debug_buffers=False, heading_gain=0.0, perception_cache=None, pipelined=False, artifact_writer=None, frame_recorder=None, response_cache=None, payload_encoder=None, request_log=None, trigger_mode='event',
+                 max_command_age=1.0, request_deadline=5.0, max_concurrent_requests=2, model_backend=None,
+                 local_policy=None, policy_confidence=None, distill_recorder=None):
+        super().__init__(camera, initial_speed, debug_buffers, heading_gain, perception_cache, pipelined)
 
         self.camera = camera
         self.initial_speed = initial_speed
         self.api_call_interval = api_call_interval
         self.save_artifacts = save_artifacts
         self.save_dir = save_dir
-        self.camera_height = camera.getHeight()
-        self.camera_width = camera.getWidth()
-        self.M, self.invM = self._calculate_perspective_transform()
-        self.LANE_WIDTH_PIXELS = 350
-        self.last_left_base = None
-        self.last_right_base = None
-        self.lost_line_counter = 0
+        self.artifact_writer = artifact_writer if artifact_writer is not None else ArtifactWriter()
+        # frame_recorder があればPNGの代わりにチャンクファイルへ生のまま追記する
+        self.frame_recorder = frame_recorder
         
         # Gemini関連
-        self.shared_data = {"steering": 0.0, "speed": self.initial_speed, "new_command_ready": False}
-        self.shared_image_bytes = None
+        # sim_time は指令の元になったフレームの時刻（古すぎる指令は get_command で使わない）
+        self.shared_data = {"steering": 0.0, "speed": self.initial_speed, "new_command_ready": False, "sim_time": None}
+        self.max_command_age = max_command_age
+        self.request_deadline = request_deadline
+        self.max_concurrent_requests = max_concurrent_requests
+        self.gemini_client = None
+        self.stale_commands = 0
+        self.handoff_frames = 0         # Geminiの指令を必要としたフレーム数
+        self.gemini_commands_used = 0   # そのうち新しい指令を使えたフレーム数
+        # ワーカーが要求したときだけ最新フレームをダブルバッファへ公開する
+        self.frame_handoff = FrameHandoff(self.camera_width, self.camera_height)
         self.lock = threading.Lock()
         self.stop_worker_flag = False
-        self.current_speed_kmh = 0.0
+        # ほぼ同じ画像・速度区分への応答を再利用する（None ならキャッシュしない）
+        self.response_cache = response_cache
+        # 送信画像の切り出し・縮小・エンコードと、リクエストごとの記録
+        self.payload_encoder = payload_encoder if payload_encoder is not None else PayloadEncoder(format='pil')
+        self.request_log = request_log
+        # リクエストのきっかけ: 'event' はトラッカーの状態から、'timer' は従来どおり一定間隔
+        if trigger_mode not in TRIGGER_MODES:
+            raise ValueError(f"未対応のトリガー方式です: {trigger_mode}")
+        self.trigger_mode = trigger_mode
+        self.trigger_event = threading.Event()
+        self.trigger_reason = None
+        self.last_confidence = 1.0
+        self.last_request_time = 0.0
+        self.trigger_counts = {}
+        self.api_calls = 0
+        # Geminiの判断を学習した代替ポリシー（先に試し、信頼度が低いときだけGeminiを呼ぶ）と学習データの記録。
+        # 信頼度の閾値は設定（autonomous_car.py の LOCAL_POLICY_CONFIDENCE）から渡す
+        if local_policy is not None and policy_confidence is None:
+            raise ValueError("代替ポリシーを使うときは policy_confidence を指定してください")
+        self.local_policy = local_policy
+        self.policy_confidence = policy_confidence
+        self.distill_recorder = distill_recorder
+        self.local_policy_used = 0
 
         os.makedirs(self.save_dir, exist_ok=True)
-        self._init_gemini(api_key_filename)
+        self._init_gemini(api_key_filename, model_backend)
         print("✅ ハイブリッドモード（CV+Gemini）準備完了")
 
-    def _calculate_perspective_transform(self):
-        h, w = self.camera_height, self.camera_width
-        src = np.float32([[w * 0.15, h * 0.7], [w * 0.85, h * 0.7], [w, h], [0, h]])
-        dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
-        return cv2.getPerspectiveTransform(src, dst), cv2.getPerspectiveTransform(dst, src)
-
-    def _init_gemini(self, api_key_filename):
+    def _init_gemini(self, api_key_filename, model_backend=None):
+        # model_backend を渡すとGemini本体の代わりに使う（ローカル代替モデルなど）
+        if model_backend is None:
+            if api_key_filename is None:
+                # リプレイなどでGeminiを使わない場合（CVのみで動作し、Gemini指令は届かない）
+                print("⚠️ APIキーが指定されていないため、Geminiワーカーを起動しません。")
+                return
+            model_backend = GeminiBackend(api_key_filename)
         try:
-            key_file_path = os.path.join(os.path.dirname(__file__), "..", api_key_filename)
-            with open(key_file_path, 'r') as f:
-                api_key = f.read().strip()
-            genai.configure(api_key=api_key)
-            self.gemini_model = genai.GenerativeModel('gemini-2.5-flash')
+            self.gemini_model = model_backend.create_model()
+            print(f"✅ モデルバックエンド: {model_backend.describe()}")
+            self.gemini_client = AsyncGeminiClient(self.gemini_model, self.max_concurrent_requests,
+                                                   self.request_deadline, self._on_gemini_result)
             threading.Thread(target=self._api_worker, daemon=True).start()
         except Exception as e:
             raise RuntimeError(f"Gemini初期化に失敗: {e}")
 
     def _api_worker(self):
-        DRIVING_PROMPT = """
-        あなたは自動運転AIです。以下の画像は前方カメラの映像です。
-        もし横断歩道付近に動物や人がいて、今から横断する可能性がある場合は、
-        必ず速度を下げるか停止してください。
-        現在の速度{speed}
-        ステアリング角度 (-0.5〜0.5)、速度 (0〜{max_speed}) をJSONで返してください。
-        {{
-          "steering_angle": [float],
-          "speed_kmh": [float]
-        }}
-        """.format(speed=self.current_speed_kmh,max_speed=self.initial_speed)
-
+        # きっかけを待ち、キャッシュ確認・画像のエンコードをしてクライアントへ投げる（応答は待たない）
         while not self.stop_worker_flag:
-            with self.lock:
-                image_bytes = self.shared_image_bytes
-            if not image_bytes or len(image_bytes) != self.camera_width * self.camera_height * 4:
-                time.sleep(self.api_call_interval)
+            reason = self._wait_for_trigger()
+            if reason is None:
+                continue
+            frame = self.frame_handoff.request(timeout=0.5)
+            if frame is None:
                 continue
+            speed_kmh = frame.speed_kmh
+            self.last_request_time = time.monotonic()
+            self.trigger_counts[reason] = self.trigger_counts.get(reason, 0) + 1
 
-            pil_image_rgb = Image.frombytes('RGBA', (self.camera_width, self.camera_height), image_bytes).convert('RGB')
-            if self.save_artifacts:
+            image_hash = None
+            if self.response_cache is not None:
+                image_hash = frame.get('dhash', lambda f: dhash(f.bgra()))
+                cached = self.response_cache.lookup(image_hash, speed_kmh)
+                if cached is not None:
+                    # ほぼ同じ場面の応答が残っていればAPIを呼ばずに使う
+                    self._set_gemini_command(cached, frame.sim_time)
+                    self._log_request(frame, 'cache', reason, {}, 0.0, 'ok')
+                    continue
+
+            # カメラ画像（BGRA）を設定に応じて切り出し・縮小・エンコードする
+            image_part, payload_stats = self.payload_encoder.encode(frame.bgra())
+            if self.save_artifacts and self.frame_recorder is not None:
+                self.frame_recorder.record_frame('gemini_input', frame, frame.bgra())
+            elif self.save_artifacts:
                 timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
-                cv2.imwrite(os.path.join(self.save_dir, f'{timestamp}_input.png'),
-                            np.array(pil_image_rgb)[:, :, ::-1])
+                # バッファの面は次の公開で上書きされるため、非同期に書き出す分はコピーして渡す
+                self.artifact_writer.submit(os.path.join(self.save_dir, f'{timestamp}_input'), frame.bgra().copy(), cv2.COLOR_BGRA2BGR)
 
-            response = self.gemini_model.generate_content([pil_image_rgb, DRIVING_PROMPT])
-            print(f"🚨 Geminiレスポンス解析: {response}")
+            # プロンプトはリクエストごとに現在の速度で作る
+            prompt = DRIVING_PROMPT.format(speed=f"{speed_kmh:.1f}km/h", max_speed=self.initial_speed)
+            self.api_calls += 1
+            self.gemini_client.submit([image_part, prompt], frame.sim_time, context={
+                'frame': frame, 'reason': reason, 'payload_stats': payload_stats,
+                'image_hash': image_hash, 'speed_kmh': speed_kmh,
+                'features': frame.get('policy_features', lambda f: policy_features(f.bgra()))
+                if self.distill_recorder is not None else None})
 
+    def _on_gemini_result(self, result):
+        # AsyncGeminiClient のスレッドから呼ばれる
+        ctx = result.context
+        status = result.status
+        if status == 'ok':
+            print(f"🚨 Geminiレスポンス解析: {result.text}")
             try:
-                command = json.loads(response.text.strip().replace("```json", "").replace("```", ""))
-                with self.lock:
-                    self.shared_data["steering"] = float(command.get("steering_angle", 0.0))
-                    self.shared_data["speed"] = float(command.get("speed_kmh", 0.0))
-                    self.shared_data["new_command_ready"] = True
+                command = json.loads(result.text.strip().replace("```json", "").replace("```", ""))
+                command = {"steering_angle": float(command.get("steering_angle", 0.0)),
+                           "speed_kmh": float(command.get("speed_kmh", 0.0))}
+                self._set_gemini_command(command, result.sim_time)
+                if self.response_cache is not None:
+                    self.response_cache.put(ctx['image_hash'], ctx['speed_kmh'], command)
+                if self.distill_recorder is not None:
+                    self.distill_recorder.add(ctx['features'], ctx['speed_kmh'], command, result.sim_time)
             except Exception as e:
                 print(f"🚨 Geminiレスポンス解析失敗: {e}")
+                status = 'parse_error'
+        elif status == 'error':
+            print(f"🚨 Gemini呼び出し失敗: {result.error}")
+        self._log_request(ctx['frame'], 'api', ctx['reason'], ctx['payload_stats'], result.round_trip_ms, status)
+
+    def _wait_for_trigger(self):
+        """次のリクエストのきっかけ（理由の文字列）を待つ。停止時や待機中は None。"""
+        # 直前のリクエストから api_call_interval 秒は間隔を空ける
+        remaining = self.last_request_time + self.api_call_interval - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        if self.trigger_mode == 'timer':
+            self.last_request_time = time.monotonic()
+            return 'timer'
+        if not self.trigger_event.wait(timeout=0.1):
+            return None
+        with self.lock:
+            self.trigger_event.clear()
+            reason, self.trigger_reason = self.trigger_reason, None
+        return reason
 
-            time.sleep(self.api_call_interval)
+    def _request_gemini(self, reason):
+        # 制御スレッドから呼ぶ。待機中のワーカーを起こす（すでに要求済みなら理由だけ更新）
+        with self.lock:
+            self.trigger_reason = reason
+            self.trigger_event.set()
+
+    def _log_request(self, frame, source, trigger, payload_stats, round_trip_ms, status):
+        if self.request_log is None:
+            return
+        self.request_log.log_request(dict(payload_stats, sim_time=frame.sim_time, wall_time=time.time(),
+                                          source=source, trigger=trigger, round_trip_ms=round_trip_ms,
+                                          status=status, ok=int(status == 'ok')))
+
+    def _set_gemini_command(self, command, sim_time):
+        with self.lock:
+            current = self.shared_data["sim_time"]
+            if sim_time is not None and current is not None and sim_time < current:
+                return  # より新しいフレームの指令がすでにある
+            self.shared_data["steering"] = float(command.get("steering_angle", 0.0))
+            self.shared_data["speed"] = float(command.get("speed_kmh", 0.0))
+            self.shared_data["sim_time"] = sim_time
+            self.shared_data["new_command_ready"] = True
 
     def get_command(self, camera,current_speed_kmh):
 
@@ -102,29 +215,27 @@ class CVGeminiHybridMode(BaseMode):
             return initial
 
 
-        image_bytes = camera.getImage()
-        if not image_bytes:
+        frame = self.perception_cache.frame(camera)
+        if not frame.image_bytes:
             return 0.0, 0.0, True
 
-        # Gemini用に画像保存
-        with self.lock:
-            self.shared_image_bytes = image_bytes
-            self.current_speed_kmh = current_speed_kmh
-
-        h, w = self.camera_height, self.camera_width
-        img = np.frombuffer(image_bytes, np.uint8).reshape((h, w, 4))
-        bgr_img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        gray = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edges = cv2.Canny(blurred, 50, 150)
-        warped = cv2.warpPerspective(edges, self.M, (w, h))
-
-        histogram = np.sum(warped[h//2:, :], axis=0)
-        midpoint = np.int32(histogram.shape[0]/2)
-        left_base = np.argmax(histogram[:midpoint])
-        right_base = np.argmax(histogram[midpoint:]) + midpoint
-        left_detected = histogram[left_base] > 300
-        right_detected = histogram[right_base] > 300
+        # ワーカーが待っていればフレームを渡す（待っていなければコピーもロックもしない）
+        self.frame_handoff.offer(frame, current_speed_kmh)
+
+        w = self.camera_width
+        frame, lanes = self.perceive(frame, 'lane', self._detect_lanes)
+        if frame is None:
+            return None  # パイプラインの最初のフレーム（まだ結果がない）
+        self.last_offset = None
+        midpoint = w // 2
+        left_base, right_base = lanes.left_base, lanes.right_base
+        left_detected, right_detected = lanes.left_detected, lanes.right_detected
+        self.lane_heading, self.lane_curvature = lanes.heading, lanes.curvature
+
+        # 信頼度が閾値を下回って低下し始めたら、見失う前にGeminiへ問い合わせておく
+        if lanes.confidence < CONFIDENCE_TRIGGER and lanes.confidence < self.last_confidence:
+            self._request_gemini('confidence')
+        self.last_confidence = lanes.confidence
 
         if left_detected and right_detected:
             self.lost_line_counter = 0
@@ -134,31 +245,67 @@ class CVGeminiHybridMode(BaseMode):
         elif left_detected and self.last_right_base:
             self.lost_line_counter = 0
             self.last_left_base = left_base
-            lane_center = (left_base + left_base + self.LANE_WIDTH_PIXELS) / 2
+            lane_center = (left_base + left_base + lanes.lane_width) / 2
         elif right_detected and self.last_left_base:
             self.lost_line_counter = 0
             self.last_right_base = right_base
-            lane_center = (right_base + right_base - self.LANE_WIDTH_PIXELS) / 2
+            lane_center = (right_base + right_base - lanes.lane_width) / 2
         else:
             # 両方検出できなければGeminiに任せる
             self.lost_line_counter += 1
-            if self.lost_line_counter < 50:
+            local = None
+            if self.local_policy is not None and self.lost_line_counter >= GEMINI_HANDOFF_FRAMES - PREFETCH_FRAMES:
+                local = self._local_command(frame, current_speed_kmh)
+            if local is not None:
+                pass  # 代替ポリシーで足りるのでGeminiは呼ばない
+            elif self.lost_line_counter >= GEMINI_HANDOFF_FRAMES:
+                self._request_gemini('handoff')
+            elif self.lost_line_counter >= GEMINI_HANDOFF_FRAMES - PREFETCH_FRAMES:
+                # 切り替え時点で新しい応答が届いているよう先読みする
+                self._request_gemini('prefetch')
+            if self.lost_line_counter < GEMINI_HANDOFF_FRAMES:
                 return 0.0, self.initial_speed * 0.6, False
             else:
                 #print(f"🚨 Gemini利用開始")
+                self.handoff_frames += 1
+                if local is not None:
+                    self.local_policy_used += 1
+                    return local
                 with self.lock:
+                    command_time = self.shared_data["sim_time"]
+                    if (self.shared_data["new_command_ready"] and frame.sim_time is not None and command_time is not None
+                            and frame.sim_time - command_time > self.max_command_age):
+                        # 元フレームが古すぎる指令は捨てる
+                        self.shared_data["new_command_ready"] = False
+                        self.stale_commands += 1
                     if self.shared_data["new_command_ready"]:
                         steer = self.shared_data["steering"]
                         speed = self.shared_data["speed"]
                         self.shared_data["new_command_ready"] = False
+                        self.gemini_commands_used += 1
                         print(f"🚨 Gemini利用開始:steer={steer},speed={speed}")
                         return steer, speed, speed <= 0
                 return 0.0, self.initial_speed * 0.6, True
 
         offset = lane_center - midpoint
-        steering_angle = offset * 0.006
+        self.last_offset = offset
+        steering_angle = offset * 0.006 + self.heading_gain * lanes.heading
         return steering_angle, self.initial_speed, False
 
+    def _local_command(self, frame, current_speed_kmh):
+        # 代替ポリシーの指令。信頼度が閾値未満なら None（Geminiに任せる）
+        features = frame.get('policy_features', lambda f: policy_features(f.bgra()))
+        steer, speed, confidence = self.local_policy.predict(features, current_speed_kmh)
+        if confidence < self.policy_confidence:
+            return None
+        return steer, speed, speed <= 0
+
     def cleanup(self):
         print("🔴 Geminiワーカースレッド停止中...")
         self.stop_worker_flag = True
+        if self.gemini_client is not None:
+            self.gemini_client.close()
+            print(f"📡 {self.gemini_client.summary()}, 古すぎて破棄した指令 {self.stale_commands}")
+            print(f"📡 {self.frame_handoff.summary()}")
+        if self.local_policy is not None:
+            print(f"📡 代替ポリシー: 切り替え {self.handoff_frames}フレーム中 {self.local_policy_used}フレームで使用")
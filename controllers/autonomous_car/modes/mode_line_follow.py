@@ -1,41 +1,25 @@
 # modes/mode_line_follow.py (復帰ロジック追加版)
 import numpy as np
-from numba import njit
 import os
 import cv2
 import datetime
 from .base_mode import BaseMode
+from utils.line_segmentation import LineSegmenter, UNKNOWN, centroid_to_angle
+from utils.buffer_pool import FrameBufferPool
+from utils.perception_cache import PerceptionCache
+from utils.perception_worker import PerceptionWorker
+from utils.artifact_writer import ArtifactWriter
 
 
 # --- モード固有の定数 ---
-UNKNOWN = 99999.99
 PID_KP, PID_KI, PID_KD = 0.25, 0.006, 2
 FILTER_SIZE = 3
-
-# (Numbaで高速化されたヘルパー関数は変更なし)
-@njit(fastmath=True)
-def _color_diff(pixel_rgb, ref_rgb):
-    return abs(pixel_rgb[0]-ref_rgb[0]) + abs(pixel_rgb[1]-ref_rgb[1]) + abs(pixel_rgb[2]-ref_rgb[2])
-@njit(fastmath=True)
-def _process_image(image_array, width, height, fov):
-    REF_RGB = (95, 187, 203)
-    sum_x, pixel_count = 0, 0
-    start_y = int(height * 0.6)  # 下40%に限定
-
-
-    for y in range(start_y, height):
-        for x in range(width):
-            pixel_color = (image_array[y, x, 0], image_array[y, x, 1], image_array[y, x, 2])
-            if _color_diff(pixel_color, REF_RGB) < 30:
-                sum_x += x
-                pixel_count += 1
-    if pixel_count == 0:
-        return UNKNOWN
-    return (float(sum_x) / pixel_count / width - 0.5) * fov
+TRACKING_BAND_RATIO = 0.05   # 追跡窓の片側幅（画像幅に対する比率）
+TRACKING_WIDEN_FACTOR = 2    # 検出失敗時に窓を広げる倍率
 
 class LineFollowMode(BaseMode):
     #def __init__(self, initial_speed):
-    def __init__(self, initial_speed, save_images=False, save_dir='./images/line_follow'):
+    def __init__(self, initial_speed, save_images=False, save_dir='./images/line_follow', segmentation_backend='auto', tracking=True, camera=None, debug_buffers=False, perception_cache=None, pipelined=False, artifact_writer=None, frame_recorder=None):
         super().__init__(initial_speed)
 
         self.initial_speed = initial_speed
@@ -44,12 +28,34 @@ class LineFollowMode(BaseMode):
         self.pid_need_reset = True
         self.pid_old_value = 0.0
         self.pid_integral = 0.0
-        self.lost_count = 0  # 線を見失ったフレームの連続回数
+        self.lost_count = 0  # 線を見失った制御ステップの連続回数
+        self.last_raw_angle = None  # 直近の検出角（知覚の間の制御ステップで使う）
+
+        # セグメンテーションエンジンと作業バッファはカメラ解像度から生成する
+        # （camera が渡されない場合は最初のフレームで生成）
+        self.segmentation_backend = segmentation_backend
+        self.debug_buffers = debug_buffers
+        self.segmenter = None
+        self.buffers = None
+        if camera is not None:
+            self._init_segmenter(camera.getWidth(), camera.getHeight(), camera.getFov())
+
+        # 追跡窓: 直前の重心の周辺だけを走査する
+        self.tracking = tracking
+        self.track_center_x = None
+        self.pixels_scanned = 0  # 直近ステップで走査した画素数
+        self.perception_cache = perception_cache if perception_cache is not None else PerceptionCache()
+        if pipelined:
+            self.perception_worker = PerceptionWorker()
 
         self.save_images = save_images
         self.save_dir = save_dir
         if self.save_images:
             os.makedirs(self.save_dir, exist_ok=True)
+        # 画像のエンコードと書き込みは ArtifactWriter のスレッドで行う
+        self.artifact_writer = artifact_writer if artifact_writer is not None else ArtifactWriter()
+        # frame_recorder があればPNGの代わりにチャンクファイルへ生のまま追記する
+        self.frame_recorder = frame_recorder
 
 
         # ✅ --- 最後に有効だった操舵角を記憶する変数を追加 ---
@@ -75,35 +81,89 @@ class LineFollowMode(BaseMode):
         self.pid_old_value = angle
         return (PID_KP * angle) + (PID_KI * self.pid_integral) + (PID_KD * diff)
 
+    def _init_segmenter(self, w, h, fov):
+        self.buffers = FrameBufferPool(w, h, debug=self.debug_buffers)
+        self.segmenter = LineSegmenter(w, h, fov, backend=self.segmentation_backend, pool=self.buffers)
+
+    def _scan_line(self, image_array):
+        seg = self.segmenter
+        w, rows = seg.width, seg.height - seg.start_y
+        pixels_scanned = 0
+
+        if not self.tracking or self.track_center_x is None:
+            sum_x, pixel_count = seg.scan(image_array)
+            pixels_scanned = rows * w
+        else:
+            # 直前の重心の周辺から探索し、見失うか線が窓の端にかかったら段階的に窓を広げる
+            center = int(self.track_center_x)
+            half = max(1, int(w * TRACKING_BAND_RATIO))
+            while True:
+                x0, x1 = max(0, center - half), min(w, center + half + 1)
+                sum_x, pixel_count = seg.scan(image_array, x0, x1)
+                pixels_scanned += rows * (x1 - x0)
+                if x0 == 0 and x1 == w:
+                    break
+                if pixel_count > 0:
+                    left_clipped = x0 > 0 and seg.scan(image_array, x0, x0 + 1)[1] > 0
+                    right_clipped = x1 < w and seg.scan(image_array, x1 - 1, x1)[1] > 0
+                    pixels_scanned += rows * 2
+                    if not (left_clipped or right_clipped):
+                        break
+                half *= TRACKING_WIDEN_FACTOR
+
+        self.track_center_x = sum_x / pixel_count if pixel_count > 0 else None
+        return centroid_to_angle(sum_x, pixel_count, w, seg.fov), pixels_scanned
+
+    def _measure_line(self, frame):
+        # 同じフレームでは PerceptionCache により一度だけ実行される。走査した画素数も
+        # 結果に含めて返す（パイプライン実行時はワーカースレッドで動くため）
+        self.buffers.begin_step()
+        result = self._scan_line(frame.bgra())
+        self.buffers.end_step()
+        return result
+
     def get_command(self, camera):
 
         initial = self.get_initial_command()
         if initial:
             return initial
 
-        image_bytes = camera.getImage()
-        if not image_bytes:
+        frame = self.perception_cache.frame(camera)
+        if not frame.image_bytes:
             return 0.0, 0.0, True
 
-        w, h, fov = camera.getWidth(), camera.getHeight(), camera.getFov()
-        image_array = np.frombuffer(image_bytes, dtype=np.uint8).reshape((h, w, 4))
-        
-        raw_angle = _process_image(image_array, w, h, fov)
-        yellow_line_angle = self._filter_angle(raw_angle)
+        w, h, fov = frame.width, frame.height, camera.getFov()
+        if self.segmenter is None or (self.segmenter.width, self.segmenter.height) != (w, h):
+            self._init_segmenter(w, h, fov)
+        frame, scan = self.perceive(frame, 'line_scan', self._measure_line)
+        if frame is None:
+            return None  # パイプラインの最初のフレーム（まだ結果がない）
+        raw_angle, self.pixels_scanned = scan
+        self.last_raw_angle = raw_angle
 
         if self.save_images:
-            # BGRA → BGR に変換
-            bgr_image = cv2.cvtColor(image_array, cv2.COLOR_BGRA2BGR)
-
-            # 下40% を切り出し
+            # 下40% を切り出し、BGRA → BGR 変換と保存はライターのスレッドで行う
             start_y = int(h * 0.6)
-            cropped = bgr_image[start_y:h, :]
+            cropped = frame.bgra()[start_y:h, :]
 
-            # 保存
-            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
-            filename = os.path.join(self.save_dir, f'{timestamp}_bottom40.png')
-            cv2.imwrite(filename, cropped)
-        
+            if self.frame_recorder is not None:
+                self.frame_recorder.record_frame('bottom40', frame, cropped)
+            else:
+                timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+                filename = os.path.join(self.save_dir, f'{timestamp}_bottom40')
+                self.artifact_writer.submit(filename, cropped, cv2.COLOR_BGRA2BGR)
+        return self._control(raw_angle)
+
+    def predict_command(self, last_command, dt, current_speed_kmh):
+        # 知覚の間の制御ステップでも直前の検出角でフィルタ・PID・復帰ロジックを進める。
+        # PID のゲイン・フィルタ長・見失い回数の閾値は制御周期（basicTimeStep = 10ms）ごとの
+        # 更新を前提に調整されているため、知覚周期（TIME_STEP）でだけ更新すると効きが変わる
+        if self.last_raw_angle is None:
+            return last_command
+        return self._control(self.last_raw_angle)
+
+    def _control(self, raw_angle):
+        yellow_line_angle = self._filter_angle(raw_angle)
         if yellow_line_angle != UNKNOWN:
             # --- 線を検出できた場合 ---
             steering_angle = self._apply_pid(yellow_line_angle)
@@ -0,0 +1,137 @@
+# replay.py
+# 記録済みフレームを Webots なしで各モードへ流し、操舵出力と処理時間を記録するリプレイ実行
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from utils.replay import ReplayCamera, load_recording, CAMERA_FOV
+from utils.perception_cache import PerceptionCache
+
+# --- 設定 ---
+MODES = ['LINE_FOLLOW', 'CV_LANE_FOLLOW', 'GEMINI']
+INITIAL_SPEED = 30.0
+OUTPUT_DIR = "replay_results"
+PERIOD_SEC = 0.05        # 時刻が記録されていないフレームの間隔（TIME_STEP）
+STEERING_TOLERANCE = 1e-6
+RESULT_HEADER = ["frame", "sim_time", "step", "steering", "speed", "brake", "latency_ms"]
+
+
+def build_mode(mode, camera, perception_cache, segmentation_backend='auto'):
+    # モジュールの読み込み（Numba・Gemini SDK）は必要なモードだけで行う
+    if mode == 'LINE_FOLLOW':
+        from modes.mode_line_follow import LineFollowMode
+        return LineFollowMode(INITIAL_SPEED, False, segmentation_backend=segmentation_backend,
+                              camera=camera, perception_cache=perception_cache)
+    if mode == 'CV_LANE_FOLLOW':
+        from modes.mode_cv_lane_follow import CVLaneFollowMode
+        return CVLaneFollowMode(camera, INITIAL_SPEED, False, perception_cache=perception_cache)
+    if mode == 'GEMINI':
+        # Gemini は呼び出さず、ハイブリッドモードのCV部分だけを再生する
+        from modes.mode_cv_lane_gemini import CVGeminiHybridMode
+        return CVGeminiHybridMode(camera, None, INITIAL_SPEED, 2.0, perception_cache=perception_cache)
+    raise ValueError(f"無効な運転モードです: {mode}")
+
+
+def replay_recording(recording, mode, output_dir=OUTPUT_DIR, seed=0, segmentation_backend='auto'):
+    """1つの記録を1モードで再生し、結果CSVのパスと集計を返す。"""
+    random.seed(seed)  # BaseMode の初期速度・初期操舵のランダム化を固定
+    frames = load_recording(recording, PERIOD_SEC)
+    height, width = frames[0].image.shape[:2]
+    camera = ReplayCamera(width, height, CAMERA_FOV)
+    cache = PerceptionCache()
+    logic = build_mode(mode, camera, cache, segmentation_backend)
+
+    rows = []
+    for i, frame in enumerate(frames):
+        camera.set_frame(frame.image)
+        cache.begin_frame(frame.sim_time)
+        t0 = time.perf_counter()
+        if mode == 'GEMINI':
+            steer, speed, brake = logic.get_command(camera, INITIAL_SPEED)
+        else:
+            steer, speed, brake = logic.get_command(camera)
+        latency_ms = (time.perf_counter() - t0) * 1000.0
+        rows.append([i, frame.sim_time, frame.step, float(steer), float(speed), int(bool(brake)), latency_ms])
+    if getattr(logic, 'perception_worker', None):
+        logic.perception_worker.stop()
+
+    name = os.path.basename(os.path.normpath(recording)).replace('*', '_')
+    os.makedirs(output_dir, exist_ok=True)
+    out_path = os.path.join(output_dir, f"replay_{mode}_{name}.csv")
+    with open(out_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_HEADER)
+        writer.writerows(rows)
+
+    # 1フレーム目は初期指令（画像処理なし）、2フレーム目はJITの初回呼び出しを含むため除外
+    latencies = np.array([r[-1] for r in rows[2:]] or [0.0])
+    return out_path, {
+        'frames': len(rows),
+        'mean_ms': float(latencies.mean()),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def compare_with_baseline(result_path, baseline_dir, tolerance=STEERING_TOLERANCE):
+    """ベースラインの同名CSVと操舵出力・平均処理時間を比較する。"""
+    baseline_path = os.path.join(baseline_dir, os.path.basename(result_path))
+    if not os.path.isfile(baseline_path):
+        return None
+    load = lambda p: np.genfromtxt(p, delimiter=',', names=True)
+    new, old = load(result_path), load(baseline_path)
+    if len(new) != len(old):
+        return {'equal': False, 'max_diff': float('inf'), 'speedup': float('nan')}
+    diff = float(np.max(np.abs(new['steering'] - old['steering']))) if len(new) else 0.0
+    equal = diff <= tolerance and np.array_equal(new['speed'], old['speed']) and np.array_equal(new['brake'], old['brake'])
+    speedup = float(old['latency_ms'][2:].mean() / max(new['latency_ms'][2:].mean(), 1e-9)) if len(new) > 2 else float('nan')
+    return {'equal': bool(equal), 'max_diff': diff, 'speedup': speedup}
+
+
+def _run_job(job):
+    recording, mode, output_dir, seed, backend = job
+    return recording, mode, replay_recording(recording, mode, output_dir, seed, backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録済みフレームのオフライン再生")
+    parser.add_argument('recordings', nargs='+', help="*_frames ディレクトリ、画像ディレクトリ、またはglobパターン")
+    parser.add_argument('--mode', action='append', choices=MODES, help="再生するモード（複数指定可、既定は全モード）")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="結果CSVの出力先")
+    parser.add_argument('--baseline', help="比較するベースラインの結果ディレクトリ")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="並列プロセス数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default='auto', help="黄線セグメンテーションのバックエンド")
+    args = parser.parse_args()
+
+    jobs = [(rec, mode, args.output, args.seed, args.backend) for rec in args.recordings for mode in (args.mode or MODES)]
+    failed = False
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs)))) as pool:
+        futures = [pool.submit(_run_job, job) for job in jobs]
+        for future, job in zip(futures, jobs):
+            try:
+                recording, mode, (path, stats) = future.result()
+            except Exception as e:
+                print(f"❌ {job[1]} {job[0]}: {e}", file=sys.stderr)
+                failed = True
+                continue
+            print(f"▶️ {mode:<15} {recording}: {stats['frames']}フレーム, 平均 {stats['mean_ms']:.3f}ms, "
+                  f"p95 {stats['p95_ms']:.3f}ms, 最大 {stats['max_ms']:.3f}ms → {path}")
+            if args.baseline:
+                result = compare_with_baseline(path, args.baseline)
+                if result is None:
+                    print("   ベースラインなし")
+                else:
+                    mark = "✅ 一致" if result['equal'] else "❌ 不一致"
+                    print(f"   {mark}（操舵差 最大 {result['max_diff']:.2e}）, 速度比 x{result['speedup']:.2f}")
+                    failed |= not result['equal']
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+# コントローラーのディレクトリ（utils・modes のある場所）から import できるようにする
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+# tests/test_buffer_pool.py
+# FrameBufferPool の debug チェックが定常ステップの確保を検出することを確認する
+import cv2
+import numpy as np
+import pytest
+
+from utils.buffer_pool import FrameBufferPool
+from utils.lane_pipeline import LanePipeline
+from utils.lane_tracker import SlidingWindowLaneTracker
+from utils.line_segmentation import LineSegmenter
+from tests.test_lane_pipeline import synthetic_lane_image
+
+
+def _run_lane_steps(pool, pipeline, tracker, image, steps, extra=None):
+    for _ in range(steps):
+        pool.begin_step()
+        warped = pipeline.process(image)
+        tracker.update(warped, pipeline.compute_histogram)
+        if extra is not None:
+            extra(warped)
+        pool.end_step()
+
+
+def test_lane_pipeline_steps_do_not_allocate():
+    pool = FrameBufferPool(256, 128, debug=True)
+    pipeline = LanePipeline(256, 128, cache_dir=None, pool=pool)
+    tracker = SlidingWindowLaneTracker(256, pipeline.warped.shape[0], 350)
+    _run_lane_steps(pool, pipeline, tracker, synthetic_lane_image(), 20)
+    assert pool.allocated_bytes == 0
+
+
+def test_line_segmenter_steps_do_not_allocate():
+    pool = FrameBufferPool(256, 128, debug=True)
+    segmenter = LineSegmenter(256, 128, 1.0, backend='opencv', pool=pool, benchmark_repeats=1)
+    image = np.full((128, 256, 4), 80, np.uint8)
+    for _ in range(20):
+        pool.begin_step()
+        segmenter.scan(image)
+        segmenter.scan(image, 100, 150)
+        pool.end_step()
+    assert pool.allocated_bytes == 0
+
+
+def test_numpy_temporary_is_detected():
+    pool = FrameBufferPool(256, 128, debug=True)
+    pipeline = LanePipeline(256, 128, cache_dir=None, pool=pool)
+    tracker = SlidingWindowLaneTracker(256, pipeline.warped.shape[0], 350)
+    image = synthetic_lane_image()
+    _run_lane_steps(pool, pipeline, tracker, image, pool.warmup_steps)
+    with pytest.raises(AssertionError):
+        _run_lane_steps(pool, pipeline, tracker, image, 1, extra=lambda warped: warped.astype(np.float32) * 2)
+
+
+def test_replaced_cv2_destination_is_detected():
+    pool = FrameBufferPool(256, 128, debug=True)
+    dst = pool.allocate('gray', (128, 256))
+    wrong = pool.allocate('wrong_shape', (10, 10))   # cv2 はこの dst を使えず新しい配列を返す
+    image = synthetic_lane_image()
+    for _ in range(pool.warmup_steps):
+        pool.begin_step()
+        pool.track(cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY, dst=dst), dst)
+        pool.end_step()
+    pool.begin_step()
+    pool.track(cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY, dst=wrong), wrong)
+    with pytest.raises(AssertionError):
+        pool.end_step()
@@ -0,0 +1,92 @@
+# tests/test_columnar_log.py
+# 列形式ログの書き込み → 読み出し・CSV書き出しが従来のCSVログと同じ内容になることを確認する
+import math
+
+import numpy as np
+import pandas as pd
+
+from utils.columnar_log import (CSV_HEADER, ColumnarLogWriter, STEP_FIELDS, chunk_files, export_csv,
+                                find_run_logs, load_log, read_meta)
+from utils.log_manager import CsvLogWriter
+
+METADATA = {"mode_name": "CV_LANE_FOLLOW", "run_id": 3}
+
+
+def _rows(n):
+    rows = []
+    for i in range(n):
+        row = {name: (i % 2 if kind == 'i1' else i * 0.25 + j) for j, (name, kind) in enumerate(STEP_FIELDS)}
+        row["pixels_scanned"] = math.nan   # このモードにない指標
+        rows.append(row)
+    return rows
+
+
+def test_round_trip_across_chunks_and_partial_flushes(tmp_path):
+    path = str(tmp_path / "log_a.runlog")
+    writer = ColumnarLogWriter(path, METADATA, chunk_rows=4, format='npz')
+    rows = _rows(10)
+    for i, row in enumerate(rows):
+        writer.append(row)
+        if i == 5:
+            writer.flush()   # 書きかけのチャンクを書き直す
+    writer.append({"timestamp": 99.0, "speed_kmh": 1.0})   # 列が欠けた行
+    writer.close()
+
+    assert read_meta(path)["rows"] == 11
+    assert chunk_files(path) == ["chunk_00000.npz", "chunk_00001.npz", "chunk_00002.npz"]
+    df = load_log(path)
+    assert len(df) == 11
+    for name, kind in STEP_FIELDS:
+        expected = [row[name] for row in rows]
+        assert np.allclose(df[name][:10], expected, equal_nan=True), name
+    last = df.iloc[-1]
+    assert last["timestamp"] == 99.0 and last["is_goal"] == 0 and math.isnan(last["pos_x"])
+    assert (df["mode_name"] == "CV_LANE_FOLLOW").all() and (df["run_id"] == 3).all()
+
+    subset = load_log(path, columns=["speed_kmh", "run_id", "not_a_column"])
+    assert sorted(subset.columns) == ["run_id", "speed_kmh"]
+
+
+def test_flushes_write_only_new_rows_to_parts(tmp_path, monkeypatch):
+    path = str(tmp_path / "log_c.runlog")
+    writer = ColumnarLogWriter(path, METADATA, chunk_rows=8, format='npz')
+    written = []
+    write_file = writer._write_file
+    monkeypatch.setattr(writer, '_write_file', lambda name, rows: (written.append((name, len(rows))), write_file(name, rows)))
+    rows = _rows(11)
+    for i, row in enumerate(rows):
+        writer.append(row)
+        if i in (2, 5, 9):
+            writer.flush()   # BatchLogWriter の定期的な flush
+
+    # 実行が途中で止まった場合: 埋まったチャンクと、書きかけのチャンクのパートが読める
+    assert chunk_files(path) == ["chunk_00000.npz", "chunk_00001_part0000.npz"]
+    assert len(load_log(path)) == 10
+    assert read_meta(path)["rows"] == 0   # meta.json は flush では書き直さない
+    writer.close()
+
+    assert written == [("chunk_00000_part0000.npz", 3), ("chunk_00000_part0001.npz", 3),
+                       ("chunk_00000.npz", 8), ("chunk_00001_part0000.npz", 2), ("chunk_00001.npz", 3)]
+    assert chunk_files(path) == ["chunk_00000.npz", "chunk_00001.npz"]
+    df = load_log(path)
+    assert np.allclose(df["timestamp"], [row["timestamp"] for row in rows])
+    assert read_meta(path)["rows"] == 11
+
+
+def test_export_csv_matches_csv_log(tmp_path):
+    rows = _rows(7)
+    columnar_path = str(tmp_path / "log_b.runlog")
+    writer = ColumnarLogWriter(columnar_path, METADATA, chunk_rows=3, format='npz')
+    csv_writer = CsvLogWriter(str(tmp_path / "reference.csv"), CSV_HEADER, METADATA)
+    for row in rows:
+        writer.append(row)
+        csv_writer.append(row)
+    writer.close()
+    csv_writer.close()
+
+    exported = pd.read_csv(export_csv(columnar_path))
+    reference = pd.read_csv(tmp_path / "reference.csv")
+    assert list(exported.columns) == list(reference.columns) == CSV_HEADER
+    pd.testing.assert_frame_equal(exported, reference, check_dtype=False, atol=1e-3)
+    # 書き出し済みの列形式ログは列形式の方だけを走行ログとして数える
+    assert find_run_logs(str(tmp_path)) == [columnar_path]
@@ -0,0 +1,38 @@
+# tests/test_distilled_policy.py
+# DistillationRecorder の追記と load_samples での読み戻し（close されなかった記録も含む）を確認する
+import numpy as np
+
+from utils.distilled_policy import SAMPLE_DTYPE, DistillationRecorder, load_samples
+
+FEATURES = SAMPLE_DTYPE['features'].shape[0]
+
+
+def _add(recorder, n):
+    for i in range(n):
+        recorder.add(np.full(FEATURES, i / n, np.float32), 30.0 + i,
+                     {"steering_angle": 0.01 * i, "speed_kmh": 20.0}, sim_time=i * 0.05)
+
+
+def test_samples_round_trip(tmp_path):
+    recorder = DistillationRecorder(str(tmp_path / "log_a_distill.bin"), flush_rows=4)
+    _add(recorder, 10)
+    recorder.close()
+    X, speed, Y, files = load_samples([str(tmp_path)])
+    assert X.shape == (10, FEATURES)
+    assert np.allclose(speed, 30.0 + np.arange(10))
+    assert np.allclose(Y[:, 0], 0.01 * np.arange(10))
+    assert np.allclose(Y[:, 1], 20.0)
+    assert len(files) == 1
+
+
+def test_unclosed_recorder_keeps_flushed_samples(tmp_path):
+    recorder = DistillationRecorder(str(tmp_path / "log_b_distill.bin"), flush_rows=4)
+    _add(recorder, 10)   # 実行が途中で止まった場合
+    X, _, _, _ = load_samples([str(tmp_path)])
+    assert len(X) == 8
+    recorder.close()
+
+
+def test_recorder_without_samples_writes_nothing(tmp_path):
+    DistillationRecorder(str(tmp_path / "log_c_distill.bin")).close()
+    assert not list(tmp_path.iterdir())
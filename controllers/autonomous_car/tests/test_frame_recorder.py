@@ -0,0 +1,36 @@
+# tests/test_frame_recorder.py
+# FrameRecorder の記録を FrameArchive で読み戻せること（close されなかった記録も含む）を確認する
+import numpy as np
+
+from utils.frame_recorder import FrameArchive, FrameRecorder
+
+
+def _image(i):
+    return np.full((4, 6, 3), i, np.uint8)
+
+
+def _record(root, frames, close):
+    recorder = FrameRecorder(str(root), frames_per_chunk=32, index_flush_frames=16)
+    for i in range(frames):
+        recorder.record('original', i * 0.05, i, _image(i))
+    if close:
+        recorder.close()
+    return recorder
+
+
+def test_closed_recording_round_trip(tmp_path):
+    _record(tmp_path, 40, close=True)
+    stream = FrameArchive(str(tmp_path)).stream('original')
+    assert len(stream) == 40
+    for i in range(40):
+        assert np.array_equal(stream.at_step(i), _image(i))
+    assert np.array_equal(stream.at_time(1.95), _image(39))
+
+
+def test_unclosed_recording_keeps_flushed_frames(tmp_path):
+    recorder = _record(tmp_path, 40, close=False)   # 実行が途中で止まった場合
+    stream = FrameArchive(str(tmp_path)).stream('original')
+    assert len(stream) == 32   # 索引を書き足した分（16フレームごと）
+    assert np.array_equal(stream.at_step(31), _image(31))
+    assert stream.at_step(32) is None
+    recorder.close()
@@ -0,0 +1,65 @@
+# tests/test_lane_pipeline.py
+# ROI先行のレーン前処理が従来の全画面処理（warpPerspective）と一致することを確認する
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.lane_pipeline import LanePipeline
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+SAMPLES = sorted(glob.glob(os.path.join(IMAGE_DIR, "cv_lane", "*_original.png"))
+                 + glob.glob(os.path.join(IMAGE_DIR, "hybrid", "*_input.png")))
+
+# 許容差: 鳥瞰画像の下半分で値の違う画素は 0.1% 以下・差は 2 階調以下、
+# 列ヒストグラムの差は 1 列あたり 2 以下
+MAX_DIFF_RATIO = 0.001
+MAX_PIXEL_DIFF = 2
+MAX_HISTOGRAM_DIFF = 2
+
+
+def reference_warp(bgra, M):
+    """ベースラインの CVLaneFollowMode と同じ全画面の処理。"""
+    h, w = bgra.shape[:2]
+    gray = cv2.cvtColor(cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR), cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    return cv2.warpPerspective(edges, M, (w, h), flags=cv2.INTER_LINEAR)[h // 2:]
+
+
+def synthetic_lane_image(width=256, height=128, offset=0):
+    img = np.full((height, width, 4), 90, np.uint8)
+    for x_bottom, x_top in ((40 + offset, 100 + offset), (216 + offset, 156 + offset)):
+        cv2.line(img, (x_bottom, height - 1), (x_top, height // 2), (255, 255, 255, 255), 3)
+    return img
+
+
+def _cases():
+    for path in SAMPLES:
+        yield pytest.param(cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2BGRA), id=os.path.basename(path))
+    for offset in (-20, 0, 15):
+        yield pytest.param(synthetic_lane_image(offset=offset), id=f"synthetic{offset:+d}")
+
+
+@pytest.mark.parametrize("bgra", list(_cases()))
+def test_remap_matches_warp_perspective(bgra):
+    h, w = bgra.shape[:2]
+    pipeline = LanePipeline(w, h, cache_dir=None)
+    warped = pipeline.process(bgra).astype(np.int32)
+    expected = reference_warp(bgra, pipeline.M).astype(np.int32)
+
+    diff = np.abs(warped - expected)
+    assert (diff > 0).mean() <= MAX_DIFF_RATIO
+    assert diff.max() <= MAX_PIXEL_DIFF
+    histogram = pipeline.compute_histogram().astype(np.int64)
+    assert np.abs(histogram - expected.sum(axis=0)).max() <= MAX_HISTOGRAM_DIFF
+
+
+def test_cached_maps_are_reused(tmp_path):
+    first = LanePipeline(256, 128, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    second = LanePipeline(256, 128, cache_dir=str(tmp_path))
+    assert second.roi_start == first.roi_start
+    np.testing.assert_array_equal(second.map_x, first.map_x)
+    np.testing.assert_array_equal(second.map_y, first.map_y)
@@ -0,0 +1,64 @@
+# tests/test_line_follow.py
+# 黄線追従の制御（フィルタ・PID・見失い時の復帰）が、知覚を TIME_STEP ごとにしても
+# 従来どおり毎ステップ（10ms）更新されることを確認する
+import random
+
+import numpy as np
+
+from modes.mode_line_follow import LineFollowMode
+from utils.line_segmentation import REF_COLOR
+from utils.perception_cache import PerceptionCache
+from utils.replay import ReplayCamera
+from utils.scheduler import MultiRateScheduler
+
+WIDTH, HEIGHT = 128, 64
+BASE_STEP_MS, PERCEPTION_MS, CONTROL_MS = 10, 50, 10
+
+
+def line_image(x):
+    image = np.full((HEIGHT, WIDTH, 4), 90, np.uint8)
+    if x is not None:
+        image[:, x:x + 4, :3] = REF_COLOR
+    return image
+
+
+# カメラ画像の列（50msごと）。途中で線を見失い、また見つける
+LINE_POSITIONS = [64, 66, 70, 75, 80, 84, None, None, None, 60, 58, 55, 52, 50]
+
+
+def _run(scheduled):
+    random.seed(0)
+    camera = ReplayCamera(WIDTH, HEIGHT)
+    cache = PerceptionCache()
+    mode = LineFollowMode(30.0, segmentation_backend='opencv', camera=camera, perception_cache=cache)
+    scheduler = MultiRateScheduler(BASE_STEP_MS)
+    scheduler.add('perception', PERCEPTION_MS)
+    scheduler.add('control', CONTROL_MS)
+    commands, last = [], None
+    for step in range(len(LINE_POSITIONS) * PERCEPTION_MS // BASE_STEP_MS):
+        now_ms = step * BASE_STEP_MS
+        if now_ms >= PERCEPTION_MS:
+            # Webots と同じく最初の画像はカメラの周期（50ms）後に届き、以後50msごとに更新される
+            camera.set_frame(line_image(LINE_POSITIONS[now_ms // PERCEPTION_MS]))
+        cache.begin_frame(now_ms / 1000.0)
+        if not scheduled:
+            last = mode.get_command(camera)   # スケジューラ導入前: 毎ステップ get_command
+        else:
+            perceive = scheduler.due('perception', now_ms) or last is None
+            control = scheduler.due('control', now_ms)
+            if perceive:
+                last = mode.get_command(camera)
+            elif control:
+                last = mode.predict_command(last, CONTROL_MS / 1000.0, 30.0)
+        commands.append(tuple(float(v) for v in last))
+    return commands
+
+
+def test_scheduled_control_matches_per_step_control():
+    before, after = _run(scheduled=False), _run(scheduled=True)
+    assert len(after) == len(LINE_POSITIONS) * 5
+    # 最初の画像が届くまで（従来は停止指令、現在は初期指令の保持）以降は同じ指令になる
+    assert np.allclose(before[5:], after[5:])
+    # 見失っている間は毎ステップ復帰ロジックが進む（探索動作の操舵角が変わる）
+    lost = after[6 * 5:9 * 5]
+    assert len({c[0] for c in lost}) > 3
@@ -0,0 +1,41 @@
+# tests/test_log_manager.py
+# 値のない列（None・NaN）がCSVで空欄になることを確認する
+import math
+import threading
+
+from utils.log_manager import RequestLog
+
+
+def test_request_log_writes_missing_values_as_empty_fields(tmp_path):
+    log = RequestLog(str(tmp_path / "log_a.csv"))
+    log.log_request({"sim_time": None, "wall_time": 1.5, "source": "gemini", "encode_ms": math.nan, "ok": True})
+    log.close()
+    with open(log.log_file_path, encoding='utf-8') as f:
+        header, row = f.read().splitlines()
+    fields = dict(zip(header.split(","), row.split(",")))
+    assert fields["sim_time"] == ""
+    assert fields["encode_ms"] == ""
+    assert fields["trigger"] == ""
+    assert fields["wall_time"] == "1.5000"
+    assert fields["ok"] == "True"
+
+
+def test_request_log_from_several_threads_keeps_every_row(tmp_path):
+    log = RequestLog(str(tmp_path / "log_b.csv"))
+
+    def worker(source):
+        for i in range(200):
+            log.log_request({"sim_time": i * 0.05, "source": source, "ok": True})
+
+    threads = [threading.Thread(target=worker, args=(f"t{n}",)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    log.close()
+    log.log_request({"sim_time": 1.0, "source": "late"})   # 終了後の記録でファイルを消さない
+    with open(log.log_file_path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ",".join(RequestLog.HEADER)
+    assert len(lines) == 1 + 4 * 200
+    assert all(len(line.split(",")) == len(RequestLog.HEADER) for line in lines[1:])
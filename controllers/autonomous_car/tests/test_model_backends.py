@@ -0,0 +1,23 @@
+# tests/test_model_backends.py
+# ローカル代替モデルの同期呼び出しが、応答しない結果でも期限で打ち切られることを確認する
+import json
+import time
+
+import pytest
+
+from utils.model_backends import LatencyProfile, LocalBackend
+
+
+def test_sync_timeout_outcome_raises_after_deadline():
+    model = LocalBackend(LatencyProfile(ms=0.0, timeout_rate=1.0), timeout_sec=0.05).create_model()
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        model.generate_content(["prompt"])
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_sync_ok_outcome_returns_json_command():
+    model = LocalBackend(LatencyProfile(ms=0.0), max_speed=40.0).create_model()
+    text = model.generate_content(["prompt"]).text
+    command = json.loads(text.strip('`').removeprefix('json'))
+    assert command == {"steering_angle": 0.0, "speed_kmh": 24.0}
@@ -0,0 +1,45 @@
+# tests/test_perception_cache.py
+# FrameEntry に置いたバッファプールの配列の寿命（1制御ステップ）を確認する
+import threading
+
+import numpy as np
+import pytest
+
+from utils.perception_cache import PerceptionCache
+from utils.replay import ReplayCamera
+
+
+def _camera():
+    camera = ReplayCamera(8, 4)
+    camera.set_frame(np.zeros((4, 8, 4), np.uint8))
+    return camera
+
+
+def test_borrowed_buffer_is_released_with_the_next_frame():
+    cache, camera = PerceptionCache(), _camera()
+    buffer = np.zeros((4, 8), np.uint8)
+    cache.begin_frame(0.0)
+    first = cache.frame(camera)
+    first.put_buffer('warped', buffer)
+    first.put('lane', 'result')
+    assert first.peek('warped') is buffer
+
+    cache.begin_frame(0.05)
+    cache.frame(camera)
+    with pytest.raises(RuntimeError):
+        first.peek('warped')
+    assert first.peek('lane') == 'result'   # プール以外の結果は残る
+
+
+def test_buffer_put_from_another_thread_is_copied():
+    cache, camera = PerceptionCache(), _camera()
+    buffer = np.zeros((4, 8), np.uint8)
+    frame = cache.frame(camera)
+    worker = threading.Thread(target=frame.put_buffer, args=('warped', buffer))
+    worker.start()
+    worker.join()
+
+    buffer[:] = 255   # 次のフレームの処理でプールが上書きされる
+    cache.frame(camera)
+    assert frame.peek('warped') is not buffer
+    assert not frame.peek('warped').any()
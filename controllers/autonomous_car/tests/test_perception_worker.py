@@ -0,0 +1,48 @@
+# tests/test_perception_worker.py
+# パイプライン実行で各フレームの結果が一度だけ、1フレーム遅れて返ることを確認する
+import numpy as np
+
+from modes.mode_cv_lane_follow import CVLaneFollowMode
+from utils.perception_cache import PerceptionCache
+from utils.perception_worker import PerceptionWorker
+from utils.replay import ReplayCamera
+from tests.test_lane_pipeline import synthetic_lane_image
+
+
+def test_each_result_is_returned_once_one_frame_late():
+    cache = PerceptionCache()
+    camera = ReplayCamera(8, 4)
+    camera.set_frame(np.zeros((4, 8, 4), np.uint8))
+    worker = PerceptionWorker()
+    try:
+        results = []
+        for i in range(5):
+            cache.begin_frame(i * 0.05)
+            frame = cache.frame(camera)
+            results.append(worker.exchange(frame, 'step', lambda f: f.step))
+    finally:
+        worker.stop()
+    assert results[0] == (None, None)
+    assert [value for _, value in results[1:]] == [1, 2, 3, 4]
+    assert worker.frames == 4
+
+
+def test_pipelined_lane_mode_keeps_warped_images_of_past_frames(tmp_path):
+    cache = PerceptionCache()
+    camera = ReplayCamera(256, 128)
+    mode = CVLaneFollowMode(camera, 30.0, perception_cache=cache, pipelined=True, save_dir=str(tmp_path))
+    commands, frames = [], []
+    try:
+        for i, offset in enumerate([0, 0, 10, 20, 30]):
+            camera.set_frame(synthetic_lane_image(256, 128, offset))
+            cache.begin_frame(i * 0.05)
+            commands.append(mode.get_command(camera))
+            frames.append(cache.current)
+    finally:
+        mode.perception_worker.stop()
+    assert commands[1] is None   # 初期指令の次はパイプラインの最初のフレーム
+    assert all(c is not None for c in commands[2:])
+    # ワーカーが置いた鳥瞰画像はコピーなので、プールが上書きしても前のフレームの画像のまま
+    warped = [f.peek('warped') for f in frames[1:]]
+    assert all(w is not None and w is not mode.pipeline.warped for w in warped)
+    assert not all(np.array_equal(warped[0], w) for w in warped[1:])
@@ -0,0 +1,88 @@
+# tests/test_plot_pipeline.py
+# 入力が変わっていない図は、別プロセスでの再実行でも描き直さないことを確認する
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from utils.plot_pipeline import PlotJob, job_digest, render_plots
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+SEPARATOR = '\n'
+
+
+def format_title(title):
+    return title + SEPARATOR
+
+
+def write_table(data, params, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(format_title(params['title']) + data.to_csv(index=False))
+
+
+def setup_theme():
+    pass
+
+
+def setup_other_theme():
+    return 'dark'
+
+
+def make_jobs(scale=1.0):
+    data = pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y': [0.5 * scale, 1.5, 2.5]})
+    return [PlotJob('a.txt', write_table, data, {'title': 'A'}),
+            PlotJob('b.txt', write_table, data[['x']], {'title': 'B', 'colors': {'LINE': 'red'}})]
+
+
+def _render_in_new_process(output_dir, hash_seed):
+    # 解析スクリプトの再実行と同じく、新しいインタプリタで描く（描いた枚数を返す）
+    code = ("from tests.test_plot_pipeline import make_jobs; from utils.plot_pipeline import render_plots; "
+            f"print(render_plots(make_jobs(), {str(output_dir)!r}, workers=1))")
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return int(out.stdout.strip().splitlines()[-1])
+
+
+def test_digest_does_not_depend_on_reference_counts():
+    job = make_jobs()[0]
+    before = job_digest(job)
+    extra_refs = list(write_table.__code__.co_consts)   # 定数の参照数だけを変える
+    assert job_digest(job) == before
+    del extra_refs
+
+
+def test_digest_is_stable_across_processes(tmp_path):
+    assert _render_in_new_process(tmp_path, 1) == 2
+    assert _render_in_new_process(tmp_path, 2) == 0
+
+
+def test_unchanged_jobs_are_skipped_and_changed_ones_rerendered(tmp_path):
+    assert render_plots(make_jobs(), str(tmp_path), workers=1) == 2
+    assert render_plots(make_jobs(), str(tmp_path), workers=1) == 0
+
+    jobs = make_jobs(scale=2.0)   # a.txt のデータだけが変わる（b.txt は x 列のみ）
+    assert job_digest(jobs[0]) != job_digest(make_jobs()[0])
+    assert render_plots(jobs, str(tmp_path), workers=1) == 1
+    assert render_plots(jobs, str(tmp_path), workers=1, force=True) == 2
+
+    os.remove(tmp_path / 'b.txt')   # 画像が消えていれば描き直す
+    assert render_plots(jobs, str(tmp_path), workers=1) == 1
+
+
+def test_digest_covers_setup_helpers_and_style_variables(monkeypatch):
+    job = make_jobs()[0]
+    base = job_digest(job, setup_theme)
+    assert job_digest(job, setup_other_theme) != base   # テーマ設定が変わった
+
+    module = sys.modules[__name__]
+    monkeypatch.setattr(module, 'SEPARATOR', '\n\n')    # 描画関数が参照するモジュール変数
+    assert job_digest(job, setup_theme) != base
+    monkeypatch.undo()
+
+    monkeypatch.setattr(module, 'format_title', lambda title: title)   # 呼び出す共有ヘルパー
+    assert job_digest(job, setup_theme) != base
+    monkeypatch.undo()
+    assert job_digest(job, setup_theme) == base
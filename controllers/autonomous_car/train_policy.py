@@ -0,0 +1,48 @@
+# train_policy.py
+# 走行中に記録したGeminiの判断（*_distill.bin）から代替ポリシーを学習する
+import argparse
+import os
+import numpy as np
+
+from utils.distilled_policy import DistilledPolicy, load_samples
+
+DEFAULT_OUTPUT = os.path.join("cache", "distilled_policy.npz")
+
+
+def evaluate(policy, X, speed, Y):
+    pred = np.array([policy.predict(x, s) for x, s in zip(X, speed)])
+    rmse = np.sqrt(((pred[:, :2] - Y) ** 2).mean(axis=0))
+    return rmse, pred[:, 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geminiの判断から代替ポリシー（リッジ回帰）を学習する")
+    parser.add_argument('samples', nargs='+', help="*_distill.bin、それを含むディレクトリ、またはglobパターン")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--alpha', type=float, default=1.0, help="リッジ回帰の正則化の強さ")
+    parser.add_argument('--min-samples', type=int, default=20, help="これ未満の学習件数では信頼度0（常にGeminiを使う）")
+    parser.add_argument('--val-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    X, speed, Y, files = load_samples(args.samples)
+    print(f"✅ 学習データ: {len(X)}件（{len(files)}ファイル）、特徴量 {X.shape[1]}次元")
+
+    # 検証用に一部を取り分けて精度を確認してから、全データで学習し直す
+    order = np.random.default_rng(args.seed).permutation(len(X))
+    n_val = int(len(X) * args.val_fraction)
+    if n_val > 0:
+        val, train = order[:n_val], order[n_val:]
+        policy = DistilledPolicy(args.alpha, min_samples=1).fit(X[train], speed[train], Y[train])
+        rmse, confidence = evaluate(policy, X[val], speed[val], Y[val])
+        print(f"📊 検証 {n_val}件: 操舵角RMSE {rmse[0]:.4f}, 速度RMSE {rmse[1]:.2f} km/h, "
+              f"信頼度の中央値 {np.median(confidence):.2f}")
+
+    policy = DistilledPolicy(args.alpha, args.min_samples).fit(X, speed, Y)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    policy.save(args.output)
+    print(f"💾 代替ポリシーを保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
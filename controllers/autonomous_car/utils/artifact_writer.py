@@ -0,0 +1,121 @@
+# utils/artifact_writer.py
+# デバッグ画像を制御ステップの外でエンコード・保存する非同期ライター
+import collections
+import os
+import threading
+import numpy as np
+import cv2
+
+# コーデック名 → (拡張子, cv2 のパラメータID, 既定値)
+CODECS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 1),   # 0-9（大きいほど高圧縮・低速）
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 90),     # 0-100
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 90),   # 1-100
+}
+POLICIES = ('drop_oldest', 'sample_every_n')
+
+
+class ArtifactWriter:
+    """有界キューとエンコードスレッドで画像を保存する。
+
+    submit() は画像をコピーしてキューに積むだけで、エンコードと書き込みは
+    ワーカースレッドが行う。キューが満杯のとき 'drop_oldest' は最も古い画像を
+    捨て、'sample_every_n' は sample_every 枚に1枚だけ受け付けて満杯なら新しい
+    画像を捨てる。どちらの方針でも制御スレッドはブロックしない。
+    """
+
+    def __init__(self, codec='png', level=None, workers=2, max_queue=64,
+                 policy='drop_oldest', sample_every=1):
+        if codec not in CODECS:
+            raise ValueError(f"未対応のコーデックです: {codec}（{', '.join(CODECS)}）")
+        if policy not in POLICIES:
+            raise ValueError(f"未対応の方針です: {policy}（{', '.join(POLICIES)}）")
+        self.ext, param, default = CODECS[codec]
+        self.params = [param, int(default if level is None else level)]
+        self.codec = codec
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.sample_every = max(1, int(sample_every))
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closing = False
+        self._busy = 0
+
+    def _start(self):
+        # 画像保存を使わない実行ではスレッドを作らない
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f'artifact-writer-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, path, image, conversion=None):
+        """path（拡張子なし）へ image を保存するよう依頼する。受け付けたら True。
+
+        conversion（例: cv2.COLOR_BGRA2BGR）を渡すと色変換もワーカー側で行う。
+        """
+        with self._cond:
+            if self._closing:
+                return False
+            self.submitted += 1
+            if self.policy == 'sample_every_n' and (self.submitted - 1) % self.sample_every:
+                self.dropped += 1
+                return False
+            if len(self._queue) >= self.max_queue:
+                if self.policy == 'sample_every_n':
+                    self.dropped += 1
+                    return False
+                self._queue.popleft()
+                self.dropped += 1
+            if not self._threads:
+                self._start()
+            self._queue.append((path + self.ext, np.array(image, copy=True), conversion))
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                path, image, conversion = self._queue.popleft()
+                self._busy += 1
+            try:
+                if conversion is not None:
+                    image = cv2.cvtColor(image, conversion)
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                ok = cv2.imwrite(path, image, self.params)
+            except Exception as e:
+                print(f"⚠️ 画像の保存に失敗しました: {path}: {e}")
+                ok = False
+            with self._cond:
+                self._busy -= 1
+                if ok:
+                    self.written += 1
+                else:
+                    self.failed += 1
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """キューが空になり、書き込み中の画像がなくなるまで待つ。"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def summary(self):
+        return (f"画像保存({self.codec}): 書き込み {self.written}, 破棄 {self.dropped}, "
+                f"失敗 {self.failed}, 依頼 {self.submitted}")
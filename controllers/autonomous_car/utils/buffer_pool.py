@@ -0,0 +1,75 @@
+# utils/buffer_pool.py
+# 運転モードごとの作業バッファ（初期化時に確保し、毎ステップ使い回す）
+import tracemalloc
+import numpy as np
+
+# debug 時、1ステップの間にこれ以上のメモリが一時的に確保されたら配列の確保とみなす
+# （Python の小さなオブジェクトの出入りは数百バイト程度なので数えない）
+ALLOCATION_THRESHOLD_BYTES = 4096
+
+
+class FrameBufferPool:
+    """名前付きの事前確保バッファ。
+
+    cv2 の dst 引数や NumPy の out 引数にここで確保した配列を渡し、毎ステップの
+    中間配列の確保をなくす。debug=True の場合、ウォームアップ後のステップで
+    新たな確保が発生すると AssertionError を送出する。
+
+    確保は2通りで数える。cv2 の呼び出しは track() で戻り値が dst そのものかを確認し、
+    NumPy の一時配列（out を使わない演算・astype など）は debug 時に tracemalloc で
+    begin_step()〜end_step() の間の一時確保量のピークを見て検出する。tracemalloc は
+    プロセス全体を見るので、debug は知覚を制御ループと同じスレッドで動かすときに使う。
+    """
+
+    def __init__(self, width, height, debug=False, warmup_steps=3):
+        self.width, self.height = width, height
+        self.debug = debug
+        self.warmup_steps = warmup_steps
+        self.buffers = {}
+        self.allocations = 0   # 確保回数（dst が使われず新しい配列が返された回数を含む）
+        self.steps = 0
+        self.allocated_bytes = 0   # debug 時に tracemalloc で見つけた一時確保の合計
+        self._steady_allocations = None
+        self._step_base = None
+
+    def allocate(self, name, shape, dtype=np.uint8):
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != np.dtype(dtype):
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buf
+            self.allocations += 1
+        return buf
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def track(self, result, dst):
+        """cv2 の戻り値が渡した dst そのものか確認し、再確保されていれば計上する。"""
+        if result is not dst:
+            self.allocations += 1
+        return result
+
+    def begin_step(self):
+        if self.debug and self._steady_allocations is not None:
+            tracemalloc.reset_peak()
+            self._step_base = tracemalloc.get_traced_memory()[0]
+
+    def end_step(self):
+        if self._step_base is not None:
+            peak = tracemalloc.get_traced_memory()[1] - self._step_base
+            self._step_base = None
+            if peak >= ALLOCATION_THRESHOLD_BYTES:
+                self.allocations += 1
+                self.allocated_bytes += peak
+        self.steps += 1
+        if self.steps == self.warmup_steps:
+            self._steady_allocations = self.allocations
+            if self.debug and not tracemalloc.is_tracing():
+                tracemalloc.start()
+        elif self.debug and self._steady_allocations is not None:
+            assert self.allocations == self._steady_allocations, (
+                f"定常ステップで配列が確保されました: {self.allocations - self._steady_allocations}件 "
+                f"(step={self.steps})")
+
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers.values())
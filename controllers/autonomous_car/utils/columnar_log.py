@@ -0,0 +1,228 @@
+# utils/columnar_log.py
+# 走行ログを列ごとのバイナリ形式で記録する（事前確保した構造化配列 → チャンクごとに .npz / Parquet）
+import glob
+import json
+import operator
+import os
+import re
+import numpy as np
+
+COLUMNAR_SUFFIX = ".runlog"   # 列形式ログのディレクトリ名の拡張子（log_..._<時刻>.runlog）
+META_FILE = "meta.json"
+
+# 1ステップごとの列と型。mode_name・run_id などの定数は meta.json に1度だけ書く。
+# 値がないステップ（その運転モードにない指標など）は NaN で記録する。
+STEP_FIELDS = [
+    ("timestamp", "f8"), ("lap_time", "f8"),
+    ("pos_x", "f4"), ("pos_y", "f4"),
+    ("speed_kmh", "f4"), ("target_speed_kmh", "f4"),
+    ("steering_angle", "f4"), ("target_steering_angle", "f4"),
+    ("acceleration", "f4"),
+    ("is_goal", "i1"), ("is_logging_active", "i1"),
+    ("error_angle", "f4"), ("pixels_scanned", "f4"),
+    ("perception_seq", "f4"), ("perception_saved_ms", "f4"), ("perception_latency_ms", "f4"),
+    ("gemini_cache_hits", "f4"), ("gemini_cache_misses", "f4"), ("gemini_api_calls", "f4"),
+]
+STEP_DTYPE = np.dtype(STEP_FIELDS)
+# CSVに書き出すときの列順（従来のCSVログと同じ）
+CSV_HEADER = [name for name, _ in STEP_FIELDS[:9]] + ["mode_name", "run_id"] + [name for name, _ in STEP_FIELDS[9:]]
+
+
+def _have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# チャンクファイル（chunk_00000.npz）と、書きかけのチャンクの途中までを書いたパート
+# （chunk_00000_part0000.npz）
+_CHUNK_PATTERN = re.compile(r"chunk_(\d+)(?:_part(\d+))?\.(npz|parquet)$")
+
+
+def _chunk_name(chunk_id, format, part=None):
+    suffix = "" if part is None else f"_part{part:04d}"
+    return f"chunk_{chunk_id:05d}{suffix}.{format}"
+
+
+class ColumnarLogWriter:
+    """1ステップ1行を構造化配列へ追記し、chunk_rows 行ごとにファイルへ書き出す。
+
+    format は 'npz'（圧縮した .npz）、'parquet'（pyarrow が必要）、'auto'（pyarrow が
+    あれば parquet）。途中で flush() すると、前回の flush 以降の行だけを1つのパート
+    ファイルに書く（強制終了されてもそこまでのデータが残る）。チャンクが埋まるか close()
+    したときに、そのチャンクのパートを1つのチャンクファイルにまとめる。各行が書かれるのは
+    パートとチャンクの高々2回で、meta.json は作成時と close() のときだけ書く。
+    """
+
+    def __init__(self, path, metadata, chunk_rows=4096, format='auto'):
+        if format == 'auto':
+            format = 'parquet' if _have_pyarrow() else 'npz'
+        if format not in ('npz', 'parquet'):
+            raise ValueError(f"未対応のログ形式です: {format}")
+        self.path = path
+        self.format = format
+        self.metadata = dict(metadata)
+        self.chunk_rows = chunk_rows
+        self._buffer = np.zeros(chunk_rows, STEP_DTYPE)
+        self._fill = 0
+        self._written = 0   # 書きかけのチャンクのうち、すでにパートファイルにある行数
+        self._names = STEP_DTYPE.names
+        self._defaults = [(n, 0 if STEP_DTYPE[n].kind == 'i' else np.nan) for n in self._names]
+        self._getter = operator.itemgetter(*self._names)
+        self.rows = 0       # ファイルに書き出した行数
+        self.chunk_id = 0
+        self._parts = []    # 書きかけのチャンクのパートファイル名
+        os.makedirs(path, exist_ok=True)
+        self._write_meta()
+
+    def append(self, data):
+        """data（列名→値の dict）を1行追記する。ない列は NaN（フラグ列は 0）。"""
+        try:
+            row = self._getter(data)  # 全列がそろっている通常の場合
+        except KeyError:
+            row = tuple(data.get(name, default) for name, default in self._defaults)
+        self._buffer[self._fill] = row
+        self._fill += 1
+        if self._fill == self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """まだファイルにない行を書く。チャンクが埋まっていればチャンクファイルにまとめる。"""
+        if self._fill == self.chunk_rows:
+            self._write_chunk()
+            self._fill = self._written = 0
+            self.chunk_id += 1
+        elif self._written < self._fill:
+            name = _chunk_name(self.chunk_id, self.format, len(self._parts))
+            self._write_file(name, self._buffer[self._written:self._fill])
+            self._parts.append(name)
+            self.rows += self._fill - self._written
+            self._written = self._fill
+
+    def _write_chunk(self):
+        # チャンクファイルを書いてから同じチャンクのパートを消す（読み出し側はチャンクファイルが
+        # あればパートを無視するので、途中で止まっても行が重複・欠落しない）
+        self._write_file(_chunk_name(self.chunk_id, self.format), self._buffer[:self._fill])
+        self.rows += self._fill - self._written
+        for name in self._parts:
+            os.remove(os.path.join(self.path, name))
+        self._parts = []
+
+    def _write_file(self, name, rows):
+        tmp_path = os.path.join(self.path, "chunk.tmp")
+        if self.format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({n: rows[n] for n in self._names}), tmp_path, compression='zstd')
+        else:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **{n: rows[n] for n in self._names})
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _write_meta(self):
+        meta = {"format": self.format, "rows": self.rows,
+                "fields": [[n, t] for n, t in STEP_FIELDS], "metadata": self.metadata}
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def close(self):
+        # 最後の書きかけのチャンクも1ファイルにまとめる（パート1つだけなら名前を変えるだけ）
+        if len(self._parts) == 1 and self._written == self._fill:
+            os.replace(os.path.join(self.path, self._parts[0]),
+                       os.path.join(self.path, _chunk_name(self.chunk_id, self.format)))
+            self._parts = []
+        elif self._fill:
+            self._write_chunk()
+        self._fill = self._written = 0
+        self._write_meta()
+
+
+def chunk_files(path):
+    """列形式ログのデータファイルを行の順に返す（チャンクファイルがあればそのパートは除く）。"""
+    chunks, parts = {}, {}
+    for name in os.listdir(path):
+        m = _CHUNK_PATTERN.match(name)
+        if m is None:
+            continue
+        chunk_id = int(m.group(1))
+        if m.group(2) is None:
+            chunks[chunk_id] = name
+        else:
+            parts.setdefault(chunk_id, []).append((int(m.group(2)), name))
+    files = []
+    for chunk_id in sorted(set(chunks) | set(parts)):
+        if chunk_id in chunks:
+            files.append(chunks[chunk_id])
+        else:
+            files += [name for _, name in sorted(parts[chunk_id])]
+    return files
+
+
+def is_columnar_log(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, META_FILE))
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_columns(path, columns=None):
+    """列形式ログを {列名: ndarray} と定数メタデータとして読む。"""
+    meta = read_meta(path)
+    names = columns or [n for n, _ in meta["fields"]]
+    if meta["format"] == 'parquet':
+        import pyarrow.parquet as pq
+        tables = [pq.read_table(os.path.join(path, chunk), columns=list(names)) for chunk in chunk_files(path)]
+        parts = [{n: t.column(n).to_numpy() for n in names} for t in tables]
+    else:
+        parts = [np.load(os.path.join(path, chunk)) for chunk in chunk_files(path)]
+    dtypes = dict(meta["fields"])
+    data = {n: np.concatenate([p[n] for p in parts]) if parts else np.empty(0, dtypes[n]) for n in names}
+    return data, meta["metadata"]
+
+
+def load_log(path, columns=None):
+    """CSVログ・列形式ログのどちらも pandas.DataFrame として読む。
+
+    列形式ログの mode_name・run_id などはメタデータから定数列として復元する
+    （columns を指定した場合はその列だけ）。
+    """
+    import pandas as pd
+    if not is_columnar_log(path):
+        # 古いCSVにない列は指定されていても無視する
+        return pd.read_csv(path, usecols=None if columns is None else (lambda c: c in columns))
+    step_names = {n for n, _ in STEP_FIELDS}
+    wanted = None if columns is None else [c for c in columns if c in step_names]
+    data, metadata = read_columns(path, wanted)
+    df = pd.DataFrame(data)
+    for key, value in metadata.items():
+        if columns is None or key in columns:
+            df[key] = value
+    return df
+
+
+def export_csv(path, csv_path=None):
+    """列形式ログを従来の形式のCSVに書き出す（互換用）。書き出したパスを返す。"""
+    csv_path = csv_path or os.path.splitext(path)[0] + ".csv"
+    df = load_log(path)
+    df = df[[c for c in CSV_HEADER if c in df.columns]]
+    df.to_csv(csv_path, index=False, float_format="%.4f")
+    return csv_path
+
+
+# 走行ログと同じ名前で作られる付随ファイル（Geminiリクエストログなど）は走行ログとして扱わない
+SIDECAR_SUFFIXES = ("_gemini.csv",)
+
+
+def find_run_logs(logs_dir):
+    """logs_dir 直下の走行ログ（log_*.csv と log_*.runlog）を返す。"""
+    paths = [p for p in glob.glob(os.path.join(logs_dir, "log_*.csv")) if not p.endswith(SIDECAR_SUFFIXES)]
+    columnar = [p for p in glob.glob(os.path.join(logs_dir, "log_*" + COLUMNAR_SUFFIX)) if is_columnar_log(p)]
+    # CSVを書き出し済みの列形式ログは列形式の方だけ使う
+    exported = {os.path.splitext(p)[0] + ".csv" for p in columnar}
+    return [p for p in paths if p not in exported] + columnar
@@ -0,0 +1,165 @@
+# utils/distilled_policy.py
+# Geminiの判断を記録して学習する、NumPyだけで動く小さな代替ポリシー
+import glob
+import os
+import threading
+import numpy as np
+import cv2
+
+FEATURE_SIZE = (16, 8)     # 縮小後の (幅, 高さ)。128画素の輝度を特徴量にする
+FEATURE_CROP_TOP = 0.25    # 画像上側（空）を捨てる割合（送信画像の切り出しと同じ）
+SPEED_SCALE_KMH = 60.0     # 速度特徴量の正規化
+
+
+def policy_features(bgra, crop_top=FEATURE_CROP_TOP, size=FEATURE_SIZE):
+    """カメラ画像（BGRA）を縮小したグレー画像の画素ベクトル（float32, 0〜1）にする。"""
+    gray = cv2.cvtColor(bgra, cv2.COLOR_BGRA2GRAY)
+    gray = gray[int(gray.shape[0] * crop_top):]
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return small.ravel().astype(np.float32) / 255.0
+
+
+# DistillationRecorder が追記する1件分のレコード
+SAMPLE_DTYPE = np.dtype([('features', '<f4', (FEATURE_SIZE[0] * FEATURE_SIZE[1],)), ('speed_kmh', '<f4'),
+                         ('steering', '<f4'), ('speed_cmd', '<f4'), ('sim_time', '<f8')])
+FLUSH_ROWS = 16   # これだけたまるたびにファイルへ追記する（強制終了で失うのはこれ未満）
+
+
+def distill_path_for_log(log_path):
+    # 走行ログ（log_..csv）と同じ名前に _distill を付ける
+    return os.path.splitext(log_path)[0] + "_distill.bin"
+
+
+class DistillationRecorder:
+    """(縮小画像, 速度, Geminiの指令) の組を集め、flush_rows 件ごとにファイルへ追記する。
+
+    ファイルは SAMPLE_DTYPE のレコードを並べただけのもので、実行が途中で止まっても
+    追記済みの分は load_samples で読める。1件も記録しなければファイルは作らない。
+    """
+
+    def __init__(self, path, flush_rows=FLUSH_ROWS):
+        self.path = path
+        self.count = 0
+        self._pending = np.zeros(flush_rows, dtype=SAMPLE_DTYPE)
+        self._pending_count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def add(self, features, speed_kmh, command, sim_time=None):
+        with self._lock:
+            self._pending[self._pending_count] = (features, speed_kmh, command["steering_angle"], command["speed_kmh"],
+                                                  np.nan if sim_time is None else sim_time)
+            self._pending_count += 1
+            self.count += 1
+            if self._pending_count == len(self._pending):
+                self._flush()
+
+    def _flush(self):
+        if not self._pending_count:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(self._pending[:self._pending_count].tobytes())
+        self._file.flush()
+        self._pending_count = 0
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        print(f"💾 Gemini判断の学習データを保存しました: {self.count}件 ({self.path})")
+
+
+def _load_sample_file(path):
+    # 書きかけのレコードが末尾に残っていれば捨てる
+    return np.fromfile(path, dtype=SAMPLE_DTYPE, count=os.path.getsize(path) // SAMPLE_DTYPE.itemsize)
+
+
+def load_samples(paths):
+    """DistillationRecorder の記録（ファイル・ディレクトリ・globパターン）をまとめて読む。"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*_distill.bin')))
+        else:
+            files += sorted(glob.glob(path))
+    if not files:
+        raise ValueError(f"学習データがありません: {', '.join(paths)}")
+    parts = [_load_sample_file(f) for f in files]
+    X = np.concatenate([p['features'] for p in parts])
+    speed = np.concatenate([p['speed_kmh'] for p in parts])
+    Y = np.stack([np.concatenate([p['steering'] for p in parts]),
+                  np.concatenate([p['speed_cmd'] for p in parts])], axis=1)
+    return X, speed, Y, files
+
+
+class DistilledPolicy:
+    """リッジ回帰で (操舵角, 速度) を予測し、入力の新しさから信頼度を出す。
+
+    信頼度は正規化した入力のてこ比 h = x^T (X^T X + αI)^-1 x を、学習データの
+    h の95パーセンタイルと比べたもの（学習データに近ければ 1、離れるほど 0 に近づく）。
+    学習前や学習サンプルが min_samples 未満のときは信頼度 0 を返す。
+    """
+
+    def __init__(self, alpha=1.0, min_samples=20):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.weights = None      # (D+1, 2)。最後の行はバイアス
+        self.mean = None
+        self.std = None
+        self.precision = None    # (X^T X + αI)^-1
+        self.leverage_ref = None
+        self.n_samples = 0
+
+    def _design(self, features, speed_kmh):
+        x = np.column_stack([np.atleast_2d(features), np.atleast_1d(speed_kmh) / SPEED_SCALE_KMH])
+        return (x - self.mean) / self.std
+
+    def fit(self, features, speed_kmh, targets):
+        x = np.column_stack([features, np.asarray(speed_kmh) / SPEED_SCALE_KMH]).astype(np.float64)
+        self.mean = x.mean(axis=0)
+        std = x.std(axis=0)
+        self.std = np.where(std < 1e-3, 1.0, std)  # ほぼ一定の画素は拡大しない（わずかな差で信頼度が崩れないように）
+        z = (x - self.mean) / self.std
+        a = z.T @ z + self.alpha * np.eye(z.shape[1])
+        self.precision = np.linalg.inv(a)
+        y = np.asarray(targets, np.float64)
+        bias = y.mean(axis=0)
+        self.weights = np.vstack([self.precision @ z.T @ (y - bias), bias])
+        leverage = np.einsum('ij,jk,ik->i', z, self.precision, z)
+        # 同じような場面ばかりでも基準が 0 に潰れないよう、平均的なてこ比 1/n を下限にする
+        self.leverage_ref = max(float(np.percentile(leverage, 95)), 1.0 / len(z))
+        self.n_samples = len(z)
+        return self
+
+    def predict(self, features, speed_kmh):
+        """(操舵角, 速度, 信頼度) を返す。"""
+        if self.weights is None or self.n_samples < self.min_samples:
+            return 0.0, 0.0, 0.0
+        z = self._design(features, speed_kmh)[0]
+        steer, speed = z @ self.weights[:-1] + self.weights[-1]
+        leverage = float(z @ self.precision @ z)
+        confidence = min(1.0, self.leverage_ref / max(leverage, 1e-12))
+        return float(np.clip(steer, -0.5, 0.5)), float(max(0.0, speed)), confidence
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, mean=self.mean, std=self.std, precision=self.precision,
+                 leverage_ref=self.leverage_ref, n_samples=self.n_samples, alpha=self.alpha,
+                 min_samples=self.min_samples)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        policy = cls(float(data['alpha']), int(data['min_samples']))
+        policy.weights, policy.mean, policy.std = data['weights'], data['mean'], data['std']
+        policy.precision = data['precision']
+        policy.leverage_ref = float(data['leverage_ref'])
+        policy.n_samples = int(data['n_samples'])
+        return policy
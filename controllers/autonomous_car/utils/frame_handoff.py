@@ -0,0 +1,81 @@
+# utils/frame_handoff.py
+# 制御ループからGeminiワーカーへのフレーム受け渡し（事前確保したダブルバッファ）
+import threading
+import numpy as np
+
+
+class HandoffFrame:
+    """ワーカーに渡された1フレーム分のスナップショット。
+
+    FrameEntry と同じく sim_time / step / bgra() / get() を持つので、ハッシュ計算や
+    フレーム記録にそのまま渡せる。ワーカーのスレッドだけが使うのでロックはない。
+    """
+
+    __slots__ = ('seq', 'sim_time', 'step', 'width', 'height', 'speed_kmh', '_bgra', '_values')
+
+    def __init__(self, seq, sim_time, step, bgra, speed_kmh):
+        self.seq = seq
+        self.sim_time = sim_time
+        self.step = step
+        self.height, self.width = bgra.shape[:2]
+        self.speed_kmh = speed_kmh
+        self._bgra = bgra
+        self._values = {}
+
+    def bgra(self):
+        return self._bgra
+
+    def get(self, key, compute):
+        if key not in self._values:
+            self._values[key] = compute(self)
+        return self._values[key]
+
+
+class FrameHandoff:
+    """ワーカーが要求したときだけ、制御ループが最新フレームを公開する。
+
+    ワーカーは request() で要求を出して公開を待つ。制御ループは毎ステップ offer() を
+    呼ぶが、要求がなければフラグを1つ読むだけで戻る（コピーもロックもしない）。
+    要求があれば事前確保したバッファ（slots 面を交互に使う）へ画像をコピーし、
+    連番 seq を付けて公開する。直前に公開した面には書き込まないので、ワーカーは
+    制御ループのロックを取らずに読める。
+    """
+
+    def __init__(self, width, height, channels=4, slots=2):
+        self._buffers = np.empty((max(2, slots), height, width, channels), np.uint8)
+        self._write = 0
+        self._demand = threading.Event()
+        self._ready = threading.Event()
+        self._published = None
+        self.seq = 0
+        self.requests = 0
+        self.timeouts = 0
+
+    def offer(self, frame, speed_kmh=0.0):
+        """制御ループから毎ステップ呼ぶ。公開したら True。"""
+        if not self._demand.is_set():
+            return False
+        bgra = frame.bgra()
+        buffer = self._buffers[self._write]
+        if bgra.shape != buffer.shape:
+            return False
+        np.copyto(buffer, bgra)
+        self.seq += 1
+        self._published = HandoffFrame(self.seq, frame.sim_time, frame.step, buffer, speed_kmh)
+        self._write = (self._write + 1) % len(self._buffers)
+        self._demand.clear()
+        self._ready.set()
+        return True
+
+    def request(self, timeout=None):
+        """ワーカーから呼ぶ。次に公開されたフレーム（HandoffFrame）を返す。期限切れなら None。"""
+        self.requests += 1
+        self._ready.clear()
+        self._demand.set()
+        if not self._ready.wait(timeout):
+            self.timeouts += 1
+            return None
+        return self._published
+
+    def summary(self):
+        return f"フレーム受け渡し: 要求 {self.requests}, 公開 {self.seq}, 待ち切れ {self.timeouts}"
@@ -0,0 +1,185 @@
+# utils/frame_recorder.py
+# カメラ・中間画像をチャンク単位のメモリマップファイルへ追記する記録器と、その読み出し
+import json
+import os
+import threading
+import numpy as np
+
+FRAMES_PER_CHUNK = 512
+INDEX_FLUSH_FRAMES = 16   # 索引をファイルへ追記する間隔（フレーム数）。強制終了で失う索引はこれ未満
+INDEX_DTYPE = np.dtype([('sim_time', '<f8'), ('step', '<i8'), ('offset', '<i8')])
+
+
+def frames_dir_for_log(log_file_path):
+    """LogManager のCSVと対応するフレーム保存ディレクトリ（logs/log_..._frames）。"""
+    return os.path.splitext(log_file_path)[0] + "_frames"
+
+
+def _time_key(sim_time):
+    # ログの timestamp（小数4桁）と突き合わせられるよう ms 単位の整数にする
+    return int(round(sim_time * 1000.0))
+
+
+class _StreamWriter:
+    def __init__(self, root, name, shape, dtype, frames_per_chunk, index_flush_frames=INDEX_FLUSH_FRAMES):
+        self.root, self.name = root, name
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        self.frames_per_chunk = frames_per_chunk
+        self.frame_nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.count = 0
+        self.chunk = None
+        self.chunk_id = -1
+        # 索引は追記専用のファイルへ index_flush_frames ごとに書き足す（実行が途中で
+        # 止まっても、それまでに書いた分のフレームは読み出せる）
+        self._pending = np.empty(index_flush_frames, dtype=INDEX_DTYPE)
+        self._pending_count = 0
+        self._index_file = open(os.path.join(root, f"{name}_index.bin"), 'wb')
+        with open(os.path.join(root, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump({'shape': list(self.shape), 'dtype': self.dtype.str,
+                       'frames_per_chunk': frames_per_chunk}, f)
+
+    def chunk_path(self, chunk_id):
+        return os.path.join(self.root, f"{self.name}_{chunk_id:05d}.bin")
+
+    def append(self, sim_time, step, image):
+        chunk_id, slot = divmod(self.count, self.frames_per_chunk)
+        if chunk_id != self.chunk_id:
+            # 次のチャンクを事前確保してマップする（直前のチャンクは索引と一緒に書き出す）
+            self._close_chunk()
+            self.chunk = np.memmap(self.chunk_path(chunk_id), dtype=self.dtype, mode='w+',
+                                   shape=(self.frames_per_chunk,) + self.shape)
+            self.chunk_id = chunk_id
+        self.chunk[slot] = image
+        self._pending[self._pending_count] = (sim_time, step, self.count * self.frame_nbytes)
+        self._pending_count += 1
+        self.count += 1
+        if self._pending_count == len(self._pending):
+            self.flush_index()
+
+    def _close_chunk(self):
+        if self.chunk is None:
+            return
+        self.chunk.flush()
+        del self.chunk
+        self.chunk = None
+        used = self.count - self.chunk_id * self.frames_per_chunk
+        if used < self.frames_per_chunk:
+            os.truncate(self.chunk_path(self.chunk_id), used * self.frame_nbytes)
+        self.flush_index()
+
+    def flush_index(self):
+        # 画像はメモリマップへ書き込み済みなので、索引が画像より先に進むことはない
+        if self._pending_count:
+            self._index_file.write(self._pending[:self._pending_count].tobytes())
+            self._pending_count = 0
+        self._index_file.flush()
+
+    def close(self):
+        self._close_chunk()
+        self.flush_index()
+        self._index_file.close()
+
+
+class FrameRecorder:
+    """画像をストリームごとのチャンクファイル（np.memmap）へ生のまま追記する。
+
+    1ファイル1画像のPNG保存と違いエンコードがなく、制御スレッドのコストは
+    メモリコピー1回で済む。各ストリームには (sim_time, step, offset) の索引を
+    サイドカー（{stream}_index.bin）へ index_flush_frames ごとに追記し、FrameArchive で
+    時刻から O(1) で読み出せる。close() されなかった記録も書けた分までは読める。
+    """
+
+    def __init__(self, root_dir, frames_per_chunk=FRAMES_PER_CHUNK, index_flush_frames=INDEX_FLUSH_FRAMES):
+        self.root_dir = root_dir
+        self.frames_per_chunk = frames_per_chunk
+        self.index_flush_frames = index_flush_frames
+        self.streams = {}
+        self._lock = threading.Lock()  # Geminiワーカーからも記録されるため
+        os.makedirs(root_dir, exist_ok=True)
+
+    def record(self, stream, sim_time, step, image):
+        with self._lock:
+            writer = self.streams.get(stream)
+            if writer is None:
+                writer = _StreamWriter(self.root_dir, stream, image.shape, image.dtype, self.frames_per_chunk,
+                                       self.index_flush_frames)
+                self.streams[stream] = writer
+            elif image.shape != writer.shape:
+                raise ValueError(f"ストリーム '{stream}' の画像サイズが変わりました: {writer.shape} → {image.shape}")
+            writer.append(np.nan if sim_time is None else sim_time, step, image)
+
+    def record_frame(self, stream, frame, image):
+        """FrameEntry の時刻・ステップ番号で image を記録する。"""
+        self.record(stream, frame.sim_time, frame.step, image)
+
+    def close(self):
+        with self._lock:
+            for writer in self.streams.values():
+                writer.close()
+
+    def summary(self):
+        return ", ".join(f"{name}={w.count}枚" for name, w in self.streams.items()) or "記録なし"
+
+
+def _load_index(root, name):
+    path = os.path.join(root, f"{name}_index.bin")
+    # 書きかけのレコードが末尾に残っていれば捨てる
+    count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+    return np.fromfile(path, dtype=INDEX_DTYPE, count=count)
+
+
+class FrameStream:
+    """記録済みストリームの読み出し。画像はメモリマップのビューとして返す。"""
+
+    def __init__(self, root, name):
+        with open(os.path.join(root, f"{name}.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.root, self.name = root, name
+        self.shape, self.dtype = tuple(meta['shape']), np.dtype(meta['dtype'])
+        self.frames_per_chunk = meta['frames_per_chunk']
+        self.frame_nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.index = _load_index(root, name)
+        self._by_time = {_time_key(t): i for i, t in enumerate(self.index['sim_time']) if not np.isnan(t)}
+        self._by_step = {int(s): i for i, s in enumerate(self.index['step'])}
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _chunk(self, chunk_id):
+        chunk = self._chunks.get(chunk_id)
+        if chunk is None:
+            path = os.path.join(self.root, f"{self.name}_{chunk_id:05d}.bin")
+            frames = os.path.getsize(path) // self.frame_nbytes
+            chunk = np.memmap(path, dtype=self.dtype, mode='r', shape=(frames,) + self.shape)
+            self._chunks[chunk_id] = chunk
+        return chunk
+
+    def frame(self, i):
+        frame_no = int(self.index['offset'][i]) // self.frame_nbytes
+        chunk_id, slot = divmod(frame_no, self.frames_per_chunk)
+        return self._chunk(chunk_id)[slot]
+
+    def at_time(self, sim_time):
+        """シミュレーション時刻（秒）ちょうどのフレーム。なければ None。"""
+        i = self._by_time.get(_time_key(sim_time))
+        return None if i is None else self.frame(i)
+
+    def at_step(self, step):
+        i = self._by_step.get(int(step))
+        return None if i is None else self.frame(i)
+
+    def nearest(self, sim_time):
+        """sim_time 以前で最も新しいフレームの番号（ログ行との結合用）。なければ -1。"""
+        return int(np.searchsorted(self.index['sim_time'], sim_time, side='right')) - 1
+
+
+class FrameArchive:
+    """FrameRecorder の出力ディレクトリを開く。"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.streams = sorted(os.path.splitext(n)[0] for n in os.listdir(root_dir) if n.endswith('.json'))
+
+    def stream(self, name):
+        return FrameStream(self.root_dir, name)
@@ -0,0 +1,120 @@
+# utils/gemini_client.py
+# asyncio ベースのGeminiクライアント（期限・古い要求の取り消し・同時実行数の上限）
+import asyncio
+import collections
+import itertools
+import threading
+import time
+
+
+class GeminiResult:
+    __slots__ = ('request_id', 'sim_time', 'status', 'text', 'error', 'round_trip_ms', 'context')
+
+    def __init__(self, request_id, sim_time, status, text=None, error=None, round_trip_ms=0.0, context=None):
+        self.request_id = request_id
+        self.sim_time = sim_time          # リクエストの元フレームのシミュレーション時刻
+        self.status = status              # 'ok', 'timeout', 'cancelled', 'error', 'stale'
+        self.text = text
+        self.error = error
+        self.round_trip_ms = round_trip_ms
+        self.context = context
+
+
+class AsyncGeminiClient:
+    """専用スレッドのイベントループでモデルを呼び出すクライアント。
+
+    submit() はどのスレッドからでも呼べ、結果は on_result(GeminiResult) で
+    イベントループのスレッドから通知される。各リクエストには deadline_sec の
+    期限があり、同時実行数が max_concurrency に達していると最も古いリクエストを
+    取り消す（新しいフレームの要求で置き換えられたとみなす）。後から届いた古い
+    フレームの結果は 'stale' として通知する。
+
+    model は generate_content_async（なければ generate_content をスレッドプールで
+    実行）を持つ GenerativeModel 互換のオブジェクト。
+    """
+
+    def __init__(self, model, max_concurrency=2, deadline_sec=5.0, on_result=None):
+        self.model = model
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.deadline_sec = deadline_sec
+        self.on_result = on_result
+        self.counts = collections.Counter()
+        self._ids = itertools.count(1)
+        self._inflight = collections.OrderedDict()  # request_id -> asyncio.Task（ループのスレッドのみで操作）
+        self._latest_delivered = float('-inf')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='gemini-client', daemon=True)
+        self._thread.start()
+
+    def submit(self, contents, sim_time=None, context=None):
+        request_id = next(self._ids)
+        self._loop.call_soon_threadsafe(self._start, request_id, contents, sim_time, context)
+        return request_id
+
+    def _start(self, request_id, contents, sim_time, context):
+        while len(self._inflight) >= self.max_concurrency:
+            _, task = self._inflight.popitem(last=False)
+            task.cancel()
+        self.counts['submitted'] += 1
+        task = self._loop.create_task(self._call(request_id, contents, sim_time, context))
+        # 開始前に取り消されたタスクは _call の本体が実行されないので、ここで通知する
+        task.add_done_callback(lambda t: t.cancelled() and self._deliver(
+            GeminiResult(request_id, sim_time, 'cancelled', context=context)))
+        self._inflight[request_id] = task
+
+    async def _generate(self, contents):
+        if hasattr(self.model, 'generate_content_async'):
+            response = await self.model.generate_content_async(contents)
+        else:
+            response = await self._loop.run_in_executor(None, self.model.generate_content, contents)
+        return response.text
+
+    async def _call(self, request_id, contents, sim_time, context):
+        t0 = time.perf_counter()
+        text, error = None, None
+        try:
+            text = await asyncio.wait_for(self._generate(contents), self.deadline_sec)
+            status = 'ok'
+        except asyncio.TimeoutError:
+            status = 'timeout'
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        except Exception as e:
+            status, error = 'error', e
+        self._inflight.pop(request_id, None)
+
+        if status == 'ok' and sim_time is not None:
+            # 新しいフレームの結果をすでに通知していれば、古い結果は使わない
+            if sim_time < self._latest_delivered:
+                status = 'stale'
+            else:
+                self._latest_delivered = sim_time
+        self._deliver(GeminiResult(request_id, sim_time, status, text, error, (time.perf_counter() - t0) * 1000.0, context))
+
+    def _deliver(self, result):
+        self.counts[result.status] += 1
+        if self.on_result is not None:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                print(f"🚨 Gemini結果の処理に失敗: {e}")
+
+    def inflight(self):
+        return len(self._inflight)
+
+    def close(self, timeout=1.0):
+        async def cancel_all():
+            tasks = list(self._inflight.values())
+            for task in tasks:
+                task.cancel()
+            # 取り消したタスクが終わるのを待ってからループを止める
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop.stop()
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.create_task, cancel_all())
+            self._thread.join(timeout)
+
+    def summary(self):
+        c = self.counts
+        return (f"Geminiクライアント: 送信 {c['submitted']}, 成功 {c['ok']}, 期限切れ {c['timeout']}, "
+                f"取り消し {c['cancelled']}, 古い結果 {c['stale']}, エラー {c['error']}")
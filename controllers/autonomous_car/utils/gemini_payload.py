@@ -0,0 +1,57 @@
+# utils/gemini_payload.py
+# Geminiへ送る画像の切り出し・縮小・エンコード
+import math
+import time
+import cv2
+from PIL import Image
+
+PAYLOAD_FORMATS = ('jpeg', 'png', 'pil')
+
+
+class PayloadEncoder:
+    """カメラ画像（BGRA）をGeminiのリクエストに載せる形へ変換する。
+
+    crop_top は画像上側（空）を捨てる割合、max_pixels は縮小後の画素数の上限
+    （None なら縮小しない）。format='jpeg'/'png' ではエンコード済みのバイト列を
+    {'mime_type', 'data'} の形で返し、'pil' は従来どおり PIL 画像を返す
+    （エンコードはSDK側で行われ、バイト数は計測できない）。
+    """
+
+    def __init__(self, crop_top=0.0, max_pixels=None, format='jpeg', jpeg_quality=85):
+        if format not in PAYLOAD_FORMATS:
+            raise ValueError(f"未対応の形式です: {format}（{', '.join(PAYLOAD_FORMATS)}）")
+        self.crop_top = crop_top
+        self.max_pixels = max_pixels
+        self.format = format
+        self.jpeg_quality = jpeg_quality
+
+    def _compact(self, bgra):
+        h, w = bgra.shape[:2]
+        image = bgra[int(h * self.crop_top):]
+        h = image.shape[0]
+        if self.max_pixels and h * w > self.max_pixels:
+            scale = math.sqrt(self.max_pixels / (h * w))
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def encode(self, bgra):
+        """(リクエストに渡す画像, 計測値 dict) を返す。"""
+        t0 = time.perf_counter()
+        image = self._compact(bgra)
+        h, w = image.shape[:2]
+        if self.format == 'pil':
+            part, nbytes = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)), None
+        else:
+            bgr = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+            if self.format == 'jpeg':
+                ok, buf = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality)])
+            else:
+                ok, buf = cv2.imencode('.png', bgr)
+            if not ok:
+                raise RuntimeError(f"画像のエンコードに失敗しました（{self.format}）")
+            data = buf.tobytes()
+            part, nbytes = {'mime_type': f'image/{self.format}', 'data': data}, len(data)
+        stats = {'payload_width': w, 'payload_height': h, 'payload_bytes': nbytes,
+                 'encode_ms': (time.perf_counter() - t0) * 1000.0}
+        return part, stats
@@ -0,0 +1,99 @@
+# utils/lane_pipeline.py
+# CVレーン検出の前処理（ROI切り出し → グレー化 → ぼかし → Canny → 鳥瞰変換 → ヒストグラム）
+import hashlib
+import os
+import numpy as np
+import cv2
+from .buffer_pool import FrameBufferPool
+
+CACHE_DIR = './cache'
+CACHE_VERSION = 2
+ROI_MARGIN_ROWS = 8                # ぼかし・Canny の境界影響を避けるための余白行数
+
+
+def calculate_perspective_transform(width, height):
+    w, h = width, height
+    src = np.float32([[w * 0.15, h * 0.7], [w * 0.85, h * 0.7], [w, h], [0, h]])
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    return cv2.getPerspectiveTransform(src, dst), cv2.getPerspectiveTransform(dst, src)
+
+
+def build_remap_maps(M, width, height, row_start):
+    """鳥瞰画像の行 [row_start, height) に対する float32 の remap マップ (map_x, map_y) を作る。
+
+    逆変換は倍精度で計算する。固定小数点（CV_16SC2）に丸めたマップは warpPerspective
+    と丸め方が違い、1割前後の画素がずれるため使わない。float マップでの remap は
+    warpPerspective(INTER_LINEAR) の該当行と数画素が 1 階調違う程度に一致する。
+    """
+    inv = np.linalg.inv(M.astype(np.float64))
+    xs = np.arange(width, dtype=np.float64)[None, :]
+    ys = np.arange(row_start, height, dtype=np.float64)[:, None]
+    X0 = inv[0, 0] * xs + inv[0, 1] * ys + inv[0, 2]
+    Y0 = inv[1, 0] * xs + inv[1, 1] * ys + inv[1, 2]
+    W = inv[2, 0] * xs + inv[2, 1] * ys + inv[2, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        W = np.where(W != 0, 1.0 / W, 0.0)
+    return (X0 * W).astype(np.float32), (Y0 * W).astype(np.float32)
+
+
+class LanePipeline:
+    """ROIを先に切り出して処理するレーン検出パイプライン。
+
+    鳥瞰変換の元領域は画像の下30%だけなので、BGRA から直接その行だけをグレー化し、
+    Canny の結果をキャッシュ済みの remap マップで鳥瞰画像の下半分へ remap する。
+    """
+
+    def __init__(self, width, height, cache_dir=CACHE_DIR, pool=None):
+        self.width, self.height = width, height
+        self.M, self.invM = calculate_perspective_transform(width, height)
+        self.warp_row_start = height // 2  # ヒストグラムは鳥瞰画像の下半分のみ使用
+        self.map_x, self.map_y, self.roi_start = self._load_or_build_maps(cache_dir)
+
+        # 中間画像はすべて事前確保したバッファへ書き込む
+        self.pool = pool if pool is not None else FrameBufferPool(width, height)
+        roi_shape = (height - self.roi_start, width)
+        self.gray = self.pool.allocate('lane_gray', roi_shape)
+        self.blurred = self.pool.allocate('lane_blurred', roi_shape)
+        self.edges = self.pool.allocate('lane_edges', roi_shape)                 # ROI内のエッジ画像
+        self.warped = self.pool.allocate('lane_warped', self.map_x.shape)     # 鳥瞰画像の下半分
+        self.histogram = self.pool.allocate('lane_histogram', (width,), np.uint64)
+        print(f"✅ レーン前処理: ROI={self.roi_start}-{height}行, remapマップ {self.map_x.shape[1]}x{self.map_x.shape[0]}")
+
+    def _cache_path(self, cache_dir):
+        key = hashlib.sha1(np.ascontiguousarray(self.M).tobytes()
+                           + f"{CACHE_VERSION}:{ROI_MARGIN_ROWS}".encode()).hexdigest()[:12]
+        return os.path.join(cache_dir, f"lane_remap_{self.width}x{self.height}_{key}.npz")
+
+    def _load_or_build_maps(self, cache_dir):
+        path = self._cache_path(cache_dir) if cache_dir else None
+        if path and os.path.isfile(path):
+            try:
+                with np.load(path) as data:
+                    return data['map_x'], data['map_y'], int(data['roi_start'])
+            except Exception as e:
+                print(f"⚠️ remapキャッシュの読み込みに失敗したため再生成します: {e}")
+
+        map_x, map_y = build_remap_maps(self.M, self.width, self.height, self.warp_row_start)
+        # 参照される最上行から余白を取ってROIの開始行とし、マップをROI座標へずらす
+        valid_rows = map_y[(map_y > -1) & (map_y < self.height)]
+        roi_start = max(0, int(np.floor(valid_rows.min())) - ROI_MARGIN_ROWS) if valid_rows.size else 0
+        map_y -= roi_start
+
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(path, map_x=map_x, map_y=map_y, roi_start=roi_start)
+        return map_x, map_y, roi_start
+
+    def process(self, image_array):
+        """BGRA画像から鳥瞰エッジ画像の下半分を作って返す。"""
+        pool = self.pool
+        roi = image_array[self.roi_start:]
+        pool.track(cv2.cvtColor(roi, cv2.COLOR_BGRA2GRAY, dst=self.gray), self.gray)
+        pool.track(cv2.GaussianBlur(self.gray, (5, 5), 0, dst=self.blurred), self.blurred)
+        pool.track(cv2.Canny(self.blurred, 50, 150, edges=self.edges), self.edges)
+        pool.track(cv2.remap(self.edges, self.map_x, self.map_y, cv2.INTER_LINEAR, dst=self.warped), self.warped)
+        return self.warped
+
+    def compute_histogram(self):
+        """直近の鳥瞰エッジ画像の列ヒストグラム（全探索時のみ必要）。"""
+        return np.sum(self.warped, axis=0, out=self.histogram)
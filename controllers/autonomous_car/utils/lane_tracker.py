@@ -0,0 +1,221 @@
+# utils/lane_tracker.py
+# 鳥瞰エッジ画像上のスライディングウィンドウ式レーントラッカー
+import math
+import numpy as np
+from numba import njit
+
+NWINDOWS = 4                 # 縦方向のウィンドウ数
+WINDOW_MARGIN = 20           # ウィンドウの片側幅（画素）
+MIN_PIXELS = 15              # ウィンドウを「検出あり」とみなす最小画素数
+CONFIDENCE_THRESHOLD = 0.5   # これ未満になったら全探索に戻る
+HISTOGRAM_THRESHOLD = 300    # 全探索時の初期位置の検出閾値（旧実装と同じ）
+MAX_COAST_FRAMES = 2         # 両側を見失っても直前のフィットで予測を続けるフレーム数
+LANE_WIDTH_SMOOTHING = 0.1   # レーン幅の指数移動平均の係数
+
+N_MOMENTS = 8  # Σw, Σwy, Σwy², Σwy³, Σwy⁴, Σwx, Σwxy, Σwxy²
+
+
+@njit(nogil=True, fastmath=True)
+def _search_lane(warped, nwindows, margin, minpix, base_x, fit, use_fit, moments):
+    """下から上へウィンドウを滑らせ、ウィンドウ内のエッジ画素のモーメントを集計する。
+
+    use_fit が真なら各ウィンドウの中心を前フレームの多項式から求め、偽なら
+    base_x から開始して検出した画素の平均位置へウィンドウを追従させる。
+    行座標は s = y / rows に正規化して集計する。検出ありのウィンドウ数を返す。
+    """
+    rows, width = warped.shape
+    y_scale = 1.0 / rows
+    win_h = rows // nwindows
+    for i in range(N_MOMENTS):
+        moments[i] = 0.0
+    x_current = base_x
+    hits = 0
+    for win in range(nwindows):
+        y_hi = rows - win * win_h
+        y_lo = 0 if win == nwindows - 1 else y_hi - win_h
+        if use_fit:
+            yc = 0.5 * (y_lo + y_hi - 1) * y_scale
+            x_center = fit[0] * yc * yc + fit[1] * yc + fit[2]
+        else:
+            x_center = x_current
+        x_lo = max(0, int(x_center - margin))
+        x_hi = min(width, int(x_center + margin) + 1)
+        count, sum_x = 0, 0.0
+        for y in range(y_lo, y_hi):
+            fy = y * y_scale
+            for x in range(x_lo, x_hi):
+                if warped[y, x] > 0:
+                    fx = float(x)
+                    count += 1
+                    sum_x += fx
+                    moments[0] += 1.0
+                    moments[1] += fy
+                    moments[2] += fy * fy
+                    moments[3] += fy * fy * fy
+                    moments[4] += fy * fy * fy * fy
+                    moments[5] += fx
+                    moments[6] += fx * fy
+                    moments[7] += fx * fy * fy
+        if count >= minpix:
+            hits += 1
+            if not use_fit:
+                x_current = sum_x / count
+    return hits
+
+
+@njit(nogil=True, fastmath=True)
+def _fit_from_moments(m, fit):
+    """集計済みモーメントから x = a·s² + b·s + c を最小二乗で求め fit に書き込む。
+
+    正規方程式が退化している場合は1次、0次へ次数を下げる。画素がなければ False。
+    """
+    n = m[0]
+    if n == 0:
+        return False
+    # 3x3 正規方程式をクラメルの公式で解く
+    a11, a12, a13 = m[4], m[3], m[2]
+    a22, a23, a33 = m[2], m[1], n
+    b1, b2, b3 = m[7], m[6], m[5]
+    c11 = a22 * a33 - a23 * a23
+    c12 = a13 * a23 - a12 * a33
+    c13 = a12 * a23 - a13 * a22
+    det = a11 * c11 + a12 * c12 + a13 * c13
+    if det > 1e-9 * n * n * n:
+        fit[0] = (b1 * c11 + b2 * c12 + b3 * c13) / det
+        fit[1] = (a11 * (b2 * a33 - a23 * b3) - b1 * (a12 * a33 - a23 * a13) + a13 * (a12 * b3 - b2 * a13)) / det
+        fit[2] = (a11 * (a22 * b3 - b2 * a23) - a12 * (a12 * b3 - b2 * a13) + b1 * (a12 * a23 - a22 * a13)) / det
+        return True
+    det = a22 * a33 - a23 * a23
+    if det > 1e-9 * n * n:
+        fit[0] = 0.0
+        fit[1] = (b2 * a33 - b3 * a23) / det
+        fit[2] = (b3 - fit[1] * a23) / n
+        return True
+    fit[0], fit[1], fit[2] = 0.0, 0.0, b3 / n
+    return True
+
+
+def _eval(fit, s):
+    return (fit[0] * s + fit[1]) * s + fit[2]
+
+
+class LaneSide:
+    def __init__(self, name):
+        self.name = name
+        self.fit = None          # x = fit[0]·s² + fit[1]·s + fit[2]（s = 行 / 行数）
+        self.confidence = 0.0
+        self.detected = False
+        self.base = None         # 最下行での x 座標
+        self.coast = 0
+
+
+class LaneTrackResult:
+    __slots__ = ('left_detected', 'right_detected', 'left_base', 'right_base',
+                 'lane_width', 'heading', 'curvature', 'full_search', 'confidence')
+
+
+class SlidingWindowLaneTracker:
+    """前フレームのレーン多項式を再利用し、その周辺だけを探索するトラッカー。
+
+    信頼度（検出ありのウィンドウの割合）が閾値を下回った側だけヒストグラムによる
+    全探索に戻る。両側の多項式からレーン中心の向き（heading）と曲率を求める。
+    """
+
+    def __init__(self, width, rows, lane_width_px=350, nwindows=NWINDOWS, margin=WINDOW_MARGIN,
+                 minpix=MIN_PIXELS, confidence_threshold=CONFIDENCE_THRESHOLD):
+        self.width, self.rows = width, rows
+        self.nwindows, self.margin, self.minpix = nwindows, margin, minpix
+        self.confidence_threshold = confidence_threshold
+        self.lane_width = float(lane_width_px)
+        self.left, self.right = LaneSide('left'), LaneSide('right')
+        self._moments = np.zeros(N_MOMENTS, dtype=np.float64)
+        self._fit = np.zeros(3, dtype=np.float64)
+        self.full_searches = 0
+        self.frames = 0
+
+    def _search(self, warped, base_x, fit):
+        use_fit = fit is not None
+        hits = _search_lane(warped, self.nwindows, self.margin, self.minpix, float(base_x),
+                            fit if use_fit else self._fit, use_fit, self._moments)
+        if not _fit_from_moments(self._moments, self._fit):
+            return 0.0, None
+        return hits / self.nwindows, self._fit.copy()
+
+    def _update_side(self, side, warped, histogram_fn, lo, hi):
+        bottom = (self.rows - 1) / self.rows
+        tracked = side.fit is not None and side.confidence >= self.confidence_threshold
+        confidence, fit, full = 0.0, None, False
+        if tracked:
+            confidence, fit = self._search(warped, 0.0, side.fit)
+        if not tracked or confidence < self.confidence_threshold:
+            # 全探索: ヒストグラムのピークを初期位置にしてウィンドウを追従させる
+            full = True
+            histogram = histogram_fn()
+            peak = lo + int(np.argmax(histogram[lo:hi]))
+            if histogram[peak] > HISTOGRAM_THRESHOLD:
+                confidence, fit = self._search(warped, peak, None)
+            else:
+                confidence, fit = 0.0, None
+
+        if fit is not None and confidence >= self.confidence_threshold:
+            side.fit, side.confidence, side.detected, side.coast = fit, confidence, True, 0
+            side.base = _eval(fit, bottom)
+        elif side.fit is not None and side.coast < MAX_COAST_FRAMES:
+            # 一時的な欠損: 直前のフィットで予測を続け、信頼度を減衰させる
+            side.coast += 1
+            side.confidence *= 0.5
+            side.detected = True
+        else:
+            side.fit, side.confidence, side.detected, side.base, side.coast = None, 0.0, False, None, 0
+        return full
+
+    def update(self, warped, histogram_fn):
+        """鳥瞰エッジ画像を処理してレーン位置を返す。histogram_fn は全探索時のみ呼ばれる。"""
+        self.frames += 1
+        midpoint = self.width // 2
+        cached = []
+
+        def histogram():
+            if not cached:
+                cached.append(histogram_fn())
+            return cached[0]
+
+        full_left = self._update_side(self.left, warped, histogram, 0, midpoint)
+        full_right = self._update_side(self.right, warped, histogram, midpoint, self.width)
+        if full_left or full_right:
+            self.full_searches += 1
+
+        left, right = self.left, self.right
+        if left.detected and right.detected and right.base - left.base < 2 * self.margin:
+            # 両側が同じ線を捉えている: 信頼度の低い側（同じなら全探索した側）を捨てる
+            drop = left if (left.confidence, not full_left) < (right.confidence, not full_right) else right
+            drop.fit, drop.confidence, drop.detected, drop.base, drop.coast = None, 0.0, False, None, 0
+        if left.detected and right.detected and left.coast == 0 and right.coast == 0:
+            measured = right.base - left.base
+            if measured > 0:
+                self.lane_width += LANE_WIDTH_SMOOTHING * (measured - self.lane_width)
+
+        result = LaneTrackResult()
+        result.left_detected, result.right_detected = left.detected, right.detected
+        result.left_base, result.right_base = left.base, right.base
+        result.lane_width = self.lane_width
+        result.full_search = full_left or full_right
+        result.confidence = 0.5 * (left.confidence + right.confidence)  # 両側の平均（見失った側は0）
+        result.heading, result.curvature = self._center_geometry()
+        return result
+
+    def _center_geometry(self):
+        # レーン中心の多項式（片側のみならその側）から最下行での向きと曲率を求める
+        fits = [side.fit.tolist() for side in (self.left, self.right) if side.fit is not None]
+        if not fits:
+            return 0.0, 0.0
+        a = sum(f[0] for f in fits) / len(fits)
+        b = sum(f[1] for f in fits) / len(fits)
+        s = (self.rows - 1) / self.rows
+        # 正規化した行座標から画素単位の dx/dy, d²x/dy² へ戻す
+        dxdy = (2.0 * a * s + b) / self.rows
+        d2xdy2 = 2.0 * a / (self.rows * self.rows)
+        # 画像の上方向（y減少）が前方なので、前方へ進むときの横ずれの向きは -dx/dy
+        heading = math.atan(-dxdy)
+        curvature = d2xdy2 / (1.0 + dxdy * dxdy) ** 1.5
+        return heading, curvature
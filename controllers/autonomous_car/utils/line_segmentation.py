@@ -0,0 +1,179 @@
+# utils/line_segmentation.py
+# 黄線の色セグメンテーション（重心角の算出）を複数バックエンドで提供する
+import time
+import numpy as np
+import cv2
+from numba import njit, prange
+from .buffer_pool import FrameBufferPool
+
+# --- セグメンテーション定数（mode_line_follow.py の旧実装と同一） ---
+UNKNOWN = 99999.99
+REF_COLOR = (95, 187, 203)   # 画像配列のチャネル0,1,2と比較する参照色
+COLOR_THRESHOLD = 30         # 3チャネルの差の絶対値の合計がこれ未満なら黄線
+ROI_START_RATIO = 0.6        # 下40%に限定
+
+BACKENDS = ('numba_serial', 'numba_prange', 'lut', 'opencv')
+
+
+@njit(nogil=True, fastmath=True)
+def _centroid_serial(image_array, start_y, x0, x1):
+    sum_x, pixel_count = 0, 0
+    for y in range(start_y, image_array.shape[0]):
+        for x in range(x0, x1):
+            diff = (abs(np.int32(image_array[y, x, 0]) - REF_COLOR[0])
+                    + abs(np.int32(image_array[y, x, 1]) - REF_COLOR[1])
+                    + abs(np.int32(image_array[y, x, 2]) - REF_COLOR[2]))
+            if diff < COLOR_THRESHOLD:
+                sum_x += x
+                pixel_count += 1
+    return sum_x, pixel_count
+
+
+@njit(parallel=True, nogil=True, fastmath=True)
+def _centroid_prange(image_array, start_y, x0, x1):
+    # 行単位で並列化し、sum_x / pixel_count はNumbaのリダクションで集約
+    sum_x, pixel_count = 0, 0
+    for y in prange(start_y, image_array.shape[0]):
+        for x in range(x0, x1):
+            diff = (abs(np.int32(image_array[y, x, 0]) - REF_COLOR[0])
+                    + abs(np.int32(image_array[y, x, 1]) - REF_COLOR[1])
+                    + abs(np.int32(image_array[y, x, 2]) - REF_COLOR[2]))
+            if diff < COLOR_THRESHOLD:
+                sum_x += x
+                pixel_count += 1
+    return sum_x, pixel_count
+
+
+def _build_channel_luts():
+    # チャネルごとの |v - ref| を閾値で飽和させたテーブル。
+    # 3つの和は最大 3*閾値 で uint8 に収まり、判定結果は元の式と完全に一致する。
+    values = np.arange(256, dtype=np.int32)
+    return [np.minimum(np.abs(values - ref), COLOR_THRESHOLD).astype(np.uint8) for ref in REF_COLOR]
+
+
+def centroid_to_angle(sum_x, pixel_count, width, fov):
+    if pixel_count == 0:
+        return UNKNOWN
+    return (float(sum_x) / pixel_count / width - 0.5) * fov
+
+
+class LineSegmenter:
+    """黄線の重心角を求めるセグメンテーションエンジン。
+
+    backend='auto' の場合は起動時のマイクロベンチマークで最速のバックエンドを選ぶ。
+    どのバックエンドも (sum_x, pixel_count) を厳密に同じ値で返すため、重心角は一致する。
+    """
+
+    def __init__(self, width, height, fov, backend='auto', benchmark_repeats=20, pool=None):
+        self.width, self.height, self.fov = width, height, fov
+        self.start_y = int(height * ROI_START_RATIO)
+        self._luts = _build_channel_luts()
+
+        # LUT / OpenCV バックエンドの作業バッファ（追跡窓ではこの先頭列をビューで使う）
+        self.pool = pool if pool is not None else FrameBufferPool(width, height)
+        rows = height - self.start_y
+        self.pool.allocate('seg_diff', (rows, width))
+        self.pool.allocate('seg_tmp', (rows, width))
+        self.pool.allocate('seg_mask', (rows, width), np.bool_)
+        self.pool.allocate('seg_counts', (width,), np.int64)
+        self.pool.allocate('seg_absdiff', (rows, width, 4))
+        self.pool.allocate('seg_sum', (rows, width))
+        self.pool.allocate('seg_inrange', (rows, width))
+        self._x_coords = np.arange(width, dtype=np.int64)
+        self._channel_sum = np.array([[1.0, 1.0, 1.0, 0.0]], dtype=np.float32)
+        self._kernels = {
+            'numba_serial': self._run_numba_serial,
+            'numba_prange': self._run_numba_prange,
+            'lut': self._run_lut,
+            'opencv': self._run_opencv,
+        }
+        self.benchmark_results = {}
+
+        if backend == 'auto':
+            backend = self.benchmark(benchmark_repeats)
+        elif backend not in self._kernels:
+            raise ValueError(f"無効なセグメンテーションバックエンドです: {backend}")
+        self.backend = backend
+        self._kernel = self._kernels[backend]
+        print(f"✅ 黄線セグメンテーション: backend='{self.backend}' ({width}x{height})")
+
+    # --- 各バックエンド: ROI (start_y:, x0:x1) の (sum_x, pixel_count) を返す ---
+    def _run_numba_serial(self, image_array, x0, x1):
+        return _centroid_serial(image_array, self.start_y, x0, x1)
+
+    def _run_numba_prange(self, image_array, x0, x1):
+        return _centroid_prange(image_array, self.start_y, x0, x1)
+
+    def _run_lut(self, image_array, x0, x1):
+        n, pool = x1 - x0, self.pool
+        roi = image_array[self.start_y:, x0:x1]
+        diff, tmp = pool['seg_diff'][:, :n], pool['seg_tmp'][:, :n]
+        mask, column_counts = pool['seg_mask'][:, :n], pool['seg_counts'][:n]
+        np.take(self._luts[0], roi[:, :, 0], out=diff, mode='clip')
+        np.take(self._luts[1], roi[:, :, 1], out=tmp, mode='clip')
+        np.add(diff, tmp, out=diff)
+        np.take(self._luts[2], roi[:, :, 2], out=tmp, mode='clip')
+        np.add(diff, tmp, out=diff)
+        np.less(diff, COLOR_THRESHOLD, out=mask)
+        np.sum(mask, axis=0, out=column_counts)
+        return int(np.dot(column_counts, self._x_coords[x0:x1])), int(column_counts.sum())
+
+    def _run_opencv(self, image_array, x0, x1):
+        n, pool = x1 - x0, self.pool
+        roi = image_array[self.start_y:, x0:x1]
+        diff = pool['seg_absdiff'][:, :n]
+        diff_sum, mask = pool['seg_sum'][:, :n], pool['seg_inrange'][:, :n]
+        pool.track(cv2.absdiff(roi, REF_COLOR + (0,), dst=diff), diff)
+        # アルファを除く3チャネルの和（uint8で飽和するが閾値判定には影響しない）
+        pool.track(cv2.transform(diff, self._channel_sum, dst=diff_sum), diff_sum)
+        pool.track(cv2.inRange(diff_sum, 0, COLOR_THRESHOLD - 1, dst=mask), mask)
+        moments = cv2.moments(mask, binaryImage=True)
+        pixel_count = int(round(moments['m00']))
+        return int(round(moments['m10'])) + x0 * pixel_count, pixel_count
+
+    def benchmark(self, repeats=20):
+        """合成フレームで全バックエンドを計測し、結果が一致する中で最速のものを返す。"""
+        frame = _make_benchmark_frame(self.width, self.height)
+        reference = None
+        for name, kernel in self._kernels.items():
+            try:
+                result = kernel(frame, 0, self.width)  # Numbaのコンパイルを含むウォームアップ
+            except Exception as e:
+                print(f"⚠️ セグメンテーションバックエンド '{name}' を利用できません: {e}")
+                continue
+            if reference is None:
+                reference = result
+            elif result != reference:
+                print(f"⚠️ バックエンド '{name}' の結果が不一致のため除外します: {result} != {reference}")
+                continue
+            start = time.perf_counter()
+            for _ in range(repeats):
+                kernel(frame, 0, self.width)
+            self.benchmark_results[name] = (time.perf_counter() - start) / repeats
+
+        if not self.benchmark_results:
+            raise RuntimeError("利用可能なセグメンテーションバックエンドがありません。")
+        summary = ", ".join(f"{k}={v * 1e6:.1f}us" for k, v in self.benchmark_results.items())
+        print(f"⏱️ セグメンテーションベンチマーク: {summary}")
+        return min(self.benchmark_results, key=self.benchmark_results.get)
+
+    def scan(self, image_array, x0=0, x1=None):
+        """ROI内の列範囲 [x0, x1) を走査し (sum_x, pixel_count) を返す。"""
+        if x1 is None:
+            x1 = self.width
+        return self._kernel(image_array, x0, x1)
+
+    def measure(self, image_array, x0=0, x1=None):
+        """ROI内の黄線の重心角を返す。見つからなければ UNKNOWN。"""
+        sum_x, pixel_count = self.scan(image_array, x0, x1)
+        return centroid_to_angle(sum_x, pixel_count, self.width, self.fov)
+
+
+def _make_benchmark_frame(width, height, seed=0):
+    # ランダム背景に、やや傾いた黄線を描いたBGRAフレーム
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+    for y in range(height):
+        x = int(width * 0.45 + (y - height) * 0.2)
+        frame[y, max(0, x):max(0, x + max(2, width // 40)), :3] = REF_COLOR
+    return frame
@@ -0,0 +1,95 @@
+# utils/log_loader.py
+# 分析用に多数の走行ログを並列に、列と型を絞って読み込む
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .columnar_log import STEP_FIELDS, is_columnar_log, load_log
+
+# 読み込み時の型（モード名はカテゴリ、フラグは int8、計測値は float32）
+LOG_DTYPES = dict(STEP_FIELDS)
+LOG_DTYPES.update({"mode_name": "category", "run_id": "int32"})
+CATEGORY_COLUMNS = ("mode_name",)
+PARALLEL_MIN_FILES = 8   # これ未満のファイル数ならプロセスを起動せずに読む
+
+
+def read_run(path, columns=None):
+    """1ファイルを読み、LOG_DTYPES の型にそろえる（プロセスプールのワーカーからも呼ぶ）。"""
+    if is_columnar_log(path):
+        df = load_log(path, columns)
+    else:
+        dtypes = {c: t for c, t in LOG_DTYPES.items() if columns is None or c in columns}
+        # 古いCSVにない列は指定されていても無視する
+        df = pd.read_csv(path, usecols=None if columns is None else (lambda c: c in columns),
+                         dtype=dtypes, engine='c')
+    for column, dtype in LOG_DTYPES.items():
+        if column in df.columns and df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _peak_rss_mb():
+    """このプロセスの最大常駐メモリ（MB）。取得できない環境では None。"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 if os.uname().sysname != 'Darwin' else peak / (1024.0 * 1024.0)
+    except (ImportError, AttributeError):
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024.0 * 1024.0)
+    except ImportError:
+        return None
+
+
+def _concat(frames, category_columns=CATEGORY_COLUMNS):
+    # カテゴリ列はカテゴリをそろえてから結合しないと object 列に戻ってしまう
+    for column in category_columns:
+        present = [f for f in frames if column in f.columns]
+        if not present:
+            continue
+        categories = sorted(set().union(*(f[column].cat.categories for f in present)))
+        for f in present:
+            f[column] = f[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_runs(paths, columns=None, workers=None, report=True, source_column=None):
+    """走行ログ（CSV・列形式）をまとめて1つの DataFrame にする。
+
+    columns で読む列を絞れる（None なら全列）。workers はプロセス数（None なら
+    CPU数、1 なら直列）。report=True なら読み込み時間・メモリ使用量を表示する。
+    source_column を指定すると、その名前のカテゴリ列に各行の読み込み元のパスを入れる。
+    """
+    paths = list(paths)
+    if not paths:
+        return pd.DataFrame(columns=columns)
+    t0 = time.perf_counter()
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if len(paths) < PARALLEL_MIN_FILES:
+        workers = 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(read_run, paths, [columns] * len(paths),
+                                   chunksize=max(1, len(paths) // (workers * 4))))
+    else:
+        frames = [read_run(p, columns) for p in paths]
+    category_columns = CATEGORY_COLUMNS
+    if source_column:
+        for path, frame in zip(paths, frames):
+            frame[source_column] = pd.Categorical.from_codes(np.zeros(len(frame), np.int8), [path])
+        category_columns += (source_column,)
+    df = _concat(frames, category_columns)
+    if report:
+        elapsed = time.perf_counter() - t0
+        mem_mb = df.memory_usage(deep=True).sum() / (1024.0 * 1024.0)
+        peak = _peak_rss_mb()
+        peak_text = f", 親プロセスのピークメモリ {peak:.0f} MB" if peak is not None else ""
+        print(f"📥 {len(paths)}ファイル・{len(df)}行・{len(df.columns)}列を {elapsed:.2f} 秒で読み込み "
+              f"（DataFrame {mem_mb:.1f} MB{peak_text}、{workers}プロセス）")
+    return df
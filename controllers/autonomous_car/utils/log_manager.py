@@ -1,13 +1,147 @@
 # utils/log_manager.py
+import collections
 import datetime
 import os
+import threading
+from .columnar_log import ColumnarLogWriter, COLUMNAR_SUFFIX, CSV_HEADER, export_csv
+
+LOG_FORMATS = ('csv', 'columnar')
+
+
+def _csv_field(value):
+    # 値のない指標（None・NaN）は従来どおり空欄にする
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "" if value != value else f"{value:.4f}"
+    return str(value)
+
+
+class CsvLogWriter:
+    """従来形式のCSVに1ステップ1行を書く（append / flush / close は ColumnarLogWriter と同じ）。"""
+
+    def __init__(self, path, header, constants):
+        self.path = path
+        self.header = header
+        self.constants = constants   # mode_name・run_id など毎行同じ値の列
+        self.rows = 0
+        self.log_file = open(path, 'w', newline='', encoding='utf-8')
+        self.log_file.write(",".join(header) + "\n")
+
+    def append(self, data):
+        data = dict(data, **self.constants)
+        row = [_csv_field(data.get(h)) for h in self.header]
+        self.log_file.write(",".join(row) + "\n")
+        self.rows += 1
+
+    def flush(self):
+        self.log_file.flush()
+
+    def close(self):
+        self.log_file.close()
+
+
+class BatchLogWriter:
+    """ログの書き込みを専用スレッドにまとめて任せる。
+
+    append() は有界キューに行を積むだけで制御スレッドをブロックしない（満杯なら
+    その行を捨てて dropped に数える）。書き込みスレッドは flush_interval 秒ごと、
+    または flush_rows 行たまるたびに、たまった行をまとめて書いてファイルへ flush する。
+    drain() は呼び出し時点までの行がファイルに書かれるまで待つ。
+    """
+
+    def __init__(self, writer, flush_interval=1.0, flush_rows=1024, max_queue=100000):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_queue = max_queue
+        self.enqueued = 0
+        self.flushed = 0       # ファイルへ flush 済みの行数（enqueued と同じ数え方）
+        self.dropped = 0
+        self.batches = 0
+        self.max_batch = 0
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def rows(self):
+        return self.writer.rows
+
+    def append(self, data):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return False
+        self._queue.append(data)
+        self.enqueued += 1
+        if len(self._queue) >= self.flush_rows:
+            self._wake.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closing
+            batch = 0
+            try:
+                while self._queue:
+                    batch += 1
+                    self.writer.append(self._queue.popleft())
+                if batch:
+                    self.writer.flush()
+            except Exception as e:
+                print(f"⚠️ ログの書き込みに失敗しました: {e}")
+            with self._cond:
+                self.flushed += batch
+                self.batches += bool(batch)
+                self.max_batch = max(self.max_batch, batch)
+                self._cond.notify_all()
+            if closing and not self._queue:
+                return
+
+    def flush(self):
+        return self.drain()
+
+    def drain(self, timeout=5.0):
+        """ここまでに積んだ行がファイルへ書かれるまで待つ。間に合えば True。"""
+        target = self.enqueued
+        self._wake.set()
+        with self._cond:
+            return self._cond.wait_for(lambda: self.flushed >= target, timeout)
+
+    def close(self, timeout=5.0):
+        self.drain(timeout)
+        self._closing = True
+        self._wake.set()
+        self._thread.join(timeout)
+        self.writer.close()
+
+    def summary(self):
+        return (f"ログ書き込み: {self.flushed}行を{self.batches}回に分けて書き込み（最大 {self.max_batch}行/回）, "
+                f"破棄 {self.dropped}")
+
 
 class LogManager:
-    def __init__(self, mode: str, run_id: int = 0, log_dir: str = "logs"):
+    def __init__(self, mode: str, run_id: int = 0, log_dir: str = "logs", format: str = 'csv',
+                 export_csv: bool = False, chunk_rows: int = 4096, async_flush: bool = False,
+                 flush_interval: float = 1.0, flush_rows: int = 1024):
+        # format='columnar' は列形式のバイナリログ（log_..runlog ディレクトリ）。export_csv で終了時に従来のCSVも書く
+        # async_flush=True なら書き込みスレッドが flush_interval 秒 / flush_rows 行ごとにまとめて書く
+        if format not in LOG_FORMATS:
+            raise ValueError(f"未対応のログ形式です: {format}（{', '.join(LOG_FORMATS)}）")
         os.makedirs(log_dir, exist_ok=True)
         timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-        self.log_file_path = os.path.join(log_dir, f"log_{mode}_run{run_id}_{timestamp}.csv")
+        self.mode, self.run_id = mode, run_id
+        self.format, self.export_csv, self.chunk_rows = format, export_csv, chunk_rows
+        self.async_flush, self.flush_interval, self.flush_rows = async_flush, flush_interval, flush_rows
+        suffix = COLUMNAR_SUFFIX if format == 'columnar' else ".csv"
+        self.log_file_path = os.path.join(log_dir, f"log_{mode}_run{run_id}_{timestamp}{suffix}")
         self.log_file = None
+        self.writer = None
 
     def start_logging2(self):
         self.log_file = open(self.log_file_path, 'w', newline='')
@@ -19,24 +153,75 @@ class LogManager:
 
 
     def start_logging(self):
-        self.log_file = open(self.log_file_path, 'w', newline='', encoding='utf-8')
-        self.header = [
-            "timestamp", "lap_time", "pos_x", "pos_y", "speed_kmh", 
-            "target_speed_kmh", "steering_angle", "target_steering_angle", 
-            "acceleration", "mode_name", "run_id", "is_goal", 
-            "is_logging_active", "error_angle"
-        ]
-        self.log_file.write(",".join(self.header) + "\n")
-        print(f"📄 ログファイルを '{self.log_file_path}' に作成し、記録を開始します。")
+        # mode_name・run_id は列形式ではメタデータに1度だけ、CSVでは毎行に書く
+        constants = {"mode_name": self.mode, "run_id": self.run_id}
+        if self.format == 'columnar':
+            self.writer = ColumnarLogWriter(self.log_file_path, constants, self.chunk_rows)
+            print(f"📄 列形式ログ（{self.writer.format}）を '{self.log_file_path}' に作成し、記録を開始します。")
+        else:
+            self.header = CSV_HEADER
+            self.writer = CsvLogWriter(self.log_file_path, self.header, constants)
+            print(f"📄 ログファイルを '{self.log_file_path}' に作成し、記録を開始します。")
+        if self.async_flush:
+            self.writer = BatchLogWriter(self.writer, self.flush_interval, self.flush_rows)
 
 
     def log_step(self, data: dict):
-        if not self.log_file:
-            return
-        row = [f"{data.get(h, ''):.4f}" if isinstance(data.get(h), float) else str(data.get(h, "")) for h in self.header]
-        self.log_file.write(",".join(row) + "\n")
+        if self.writer:
+            self.writer.append(data)
+
+    def drain(self):
+        """ここまでのログをファイルへ確実に書く（ゴール・タイムアウト時に呼ぶ）。"""
+        if self.writer:
+            return self.writer.flush() is not False
+        return True
 
     def close(self):
+        if self.writer:
+            self.writer.close()
+            if isinstance(self.writer, BatchLogWriter):
+                print(f"📝 {self.writer.summary()}")
+            print(f"🛑 ログ '{self.log_file_path}' を閉じました（{self.writer.rows}行）。")
+            if self.format == 'columnar' and self.export_csv:
+                print(f"📄 CSVを書き出しました: {export_csv(self.log_file_path)}")
+            self.writer = None
         if self.log_file:
             self.log_file.close()
             print(f"🛑 ログファイル '{self.log_file_path}' を閉じました。")
+
+
+class RequestLog:
+    """Geminiへのリクエスト1件ごとの記録（ペイロードサイズ・エンコード時間・往復時間）。"""
+
+    HEADER = ["sim_time", "wall_time", "source", "trigger", "payload_width", "payload_height",
+              "payload_bytes", "encode_ms", "round_trip_ms", "status", "ok"]
+
+    def __init__(self, log_file_path: str):
+        # 走行ログ（log_..csv）と同じ名前に _gemini を付ける
+        self.log_file_path = os.path.splitext(log_file_path)[0] + "_gemini.csv"
+        self.log_file = None
+        self.count = 0
+        # キャッシュヒットは _api_worker、API応答は AsyncGeminiClient のスレッドから記録される
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def log_request(self, data: dict):
+        row = ",".join(_csv_field(data.get(h)) for h in self.HEADER) + "\n"
+        with self._lock:
+            if self._closed:
+                return  # 終了後に届いた応答は記録しない（ファイルを開き直して消さないように）
+            if not self.log_file:
+                self.log_file = open(self.log_file_path, 'w', newline='', encoding='utf-8')
+                self.log_file.write(",".join(self.HEADER) + "\n")
+            self.log_file.write(row)
+            self.log_file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if not self.log_file:
+                return
+            self.log_file.close()
+            self.log_file = None
+            print(f"🛑 Geminiリクエストログ '{self.log_file_path}' を閉じました（{self.count}件）。")
@@ -0,0 +1,166 @@
+# utils/model_backends.py
+# ハイブリッドモードが使うモデルのバックエンド（Gemini本体と、オフライン用のローカル代替）
+# ローカル代替はサーバーではなく、同じプロセス内で Gemini の応答と遅延を模擬するモデル
+import abc
+import asyncio
+import itertools
+import json
+import os
+import random
+
+LATENCY_KINDS = ('fixed', 'lognormal', 'spiky')
+STAND_IN_TIMEOUT_SEC = 30.0   # 応答しないリクエストを代替モデル自身が TimeoutError にするまでの時間
+
+
+class ModelBackend(abc.ABC):
+    """GenerativeModel 互換のオブジェクト（generate_content[_async]）を作るインターフェース。"""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    def create_model(self):
+        """generate_content[_async] を持つモデルを返す。"""
+
+    def describe(self):
+        return self.name
+
+
+class GeminiBackend(ModelBackend):
+    name = 'gemini'
+
+    def __init__(self, api_key_filename, model_name='gemini-2.5-flash'):
+        self.api_key_filename = api_key_filename
+        self.model_name = model_name
+
+    def create_model(self):
+        import google.generativeai as genai  # SDK はこのバックエンドを使う場合だけ必要
+        key_file_path = os.path.join(os.path.dirname(__file__), "..", self.api_key_filename)
+        with open(key_file_path, 'r') as f:
+            api_key = f.read().strip()
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(self.model_name)
+
+    def describe(self):
+        return f"gemini({self.model_name})"
+
+
+class LatencyProfile:
+    """応答遅延の分布。
+
+    fixed: 常に ms、lognormal: 中央値 ms・対数標準偏差 sigma、spiky: lognormal に
+    確率 spike_prob で spike_ms の裾の遅延を加える。error_rate でエラー、
+    timeout_rate で応答しない（期限切れになる）リクエストを混ぜる。
+    """
+
+    def __init__(self, kind='fixed', ms=800.0, sigma=0.3, spike_prob=0.0, spike_ms=5000.0,
+                 error_rate=0.0, timeout_rate=0.0, seed=None):
+        if kind not in LATENCY_KINDS:
+            raise ValueError(f"未対応の遅延分布です: {kind}（{', '.join(LATENCY_KINDS)}）")
+        self.kind, self.ms, self.sigma = kind, ms, sigma
+        self.spike_prob, self.spike_ms = spike_prob, spike_ms
+        self.error_rate, self.timeout_rate = error_rate, timeout_rate
+        self.rng = random.Random(seed)
+
+    def sample_ms(self):
+        if self.kind == 'fixed':
+            return self.ms
+        latency = self.ms * self.rng.lognormvariate(0.0, self.sigma)
+        if self.kind == 'spiky' and self.rng.random() < self.spike_prob:
+            latency += self.spike_ms
+        return latency
+
+    def sample_outcome(self):
+        r = self.rng.random()
+        if r < self.error_rate:
+            return 'error'
+        if r < self.error_rate + self.timeout_rate:
+            return 'timeout'
+        return 'ok'
+
+    def describe(self):
+        text = f"{self.kind}:{self.ms:.0f}ms"
+        if self.kind != 'fixed':
+            text += f"/σ{self.sigma}"
+        if self.kind == 'spiky':
+            text += f"/spike{self.spike_prob:.0%}+{self.spike_ms:.0f}ms"
+        if self.error_rate or self.timeout_rate:
+            text += f"/err{self.error_rate:.0%}/to{self.timeout_rate:.0%}"
+        return text
+
+
+# よく使う遅延プロファイル（ベンチマークの既定の掃引対象）
+LATENCY_PRESETS = {
+    'instant': dict(kind='fixed', ms=0.0),
+    'fast': dict(kind='fixed', ms=300.0),
+    'typical': dict(kind='lognormal', ms=900.0, sigma=0.35),
+    'slow': dict(kind='lognormal', ms=2500.0, sigma=0.4),
+    'spiky': dict(kind='spiky', ms=900.0, sigma=0.35, spike_prob=0.1, spike_ms=6000.0),
+    'flaky': dict(kind='lognormal', ms=900.0, sigma=0.35, error_rate=0.1, timeout_rate=0.1),
+}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class LocalStandInModel:
+    """Gemini の代わりに、台本またはルールで JSON 指令を返すローカルモデル。"""
+
+    def __init__(self, profile, max_speed=30.0, script=None, rule=None, timeout_sec=STAND_IN_TIMEOUT_SEC):
+        self.profile = profile
+        self.max_speed = max_speed
+        self.timeout_sec = timeout_sec
+        self._script = itertools.cycle(script) if script else None
+        self.rule = rule
+        self.calls = 0
+
+    def _command(self, contents):
+        if self._script is not None:
+            return next(self._script)
+        if self.rule is not None:
+            return self.rule(contents)
+        # 既定のルール: 交差点は直進し、速度を落として通過する
+        return {"steering_angle": 0.0, "speed_kmh": round(self.max_speed * 0.6, 1)}
+
+    async def generate_content_async(self, contents):
+        self.calls += 1
+        outcome = self.profile.sample_outcome()
+        if outcome == 'timeout':
+            # 応答しない。非同期クライアントでは先にその期限で打ち切られ、期限のない同期呼び出しでも
+            # timeout_sec 後に TimeoutError になる（永久には待たない）
+            await asyncio.sleep(self.timeout_sec)
+            raise TimeoutError(f"ローカル代替モデル: {self.timeout_sec:.1f} 秒以内に応答しませんでした")
+        await asyncio.sleep(self.profile.sample_ms() / 1000.0)
+        if outcome == 'error':
+            raise RuntimeError("ローカル代替モデル: 注入されたエラー")
+        return _Response("```json\n" + json.dumps(self._command(contents)) + "\n```")
+
+    def generate_content(self, contents):
+        return asyncio.run(self.generate_content_async(contents))
+
+
+class LocalBackend(ModelBackend):
+    name = 'local'
+
+    def __init__(self, profile=None, max_speed=30.0, script=None, rule=None, timeout_sec=STAND_IN_TIMEOUT_SEC):
+        self.profile = profile if profile is not None else LatencyProfile(**LATENCY_PRESETS['typical'])
+        self.max_speed, self.script, self.rule = max_speed, script, rule
+        self.timeout_sec = timeout_sec
+
+    def create_model(self):
+        return LocalStandInModel(self.profile, self.max_speed, self.script, self.rule, self.timeout_sec)
+
+    def describe(self):
+        return f"local({self.profile.describe()})"
+
+
+def create_backend(name, api_key_filename=None, latency_preset='typical', max_speed=30.0, seed=None):
+    """設定値からバックエンドを作る。name は 'gemini' または 'local'。"""
+    if name == 'gemini':
+        return GeminiBackend(api_key_filename)
+    if name == 'local':
+        if latency_preset not in LATENCY_PRESETS:
+            raise ValueError(f"未対応の遅延プリセットです: {latency_preset}（{', '.join(LATENCY_PRESETS)}）")
+        return LocalBackend(LatencyProfile(seed=seed, **LATENCY_PRESETS[latency_preset]), max_speed)
+    raise ValueError(f"未対応のモデルバックエンドです: {name}")
@@ -0,0 +1,121 @@
+# utils/perception_cache.py
+# 1制御ステップ分の知覚結果を共有するキャッシュ（driver.getTime() をキーにする）
+import threading
+import numpy as np
+import cv2
+
+
+class FrameEntry:
+    """1フレーム分のカメラ画像とそこから計算した結果。
+
+    get(key, compute) は同じフレームで compute を一度しか実行しない。
+    Geminiワーカーなど別スレッドからも参照されるためロックで保護する。
+
+    put_buffer(key, buffer) で置いたバッファプールの配列（'gray'・'edges'・'warped'）は
+    次のフレームの処理で上書きされるため、寿命はこのフレームの1制御ステップだけ。
+    フレームを作ったスレッドからはコピーせずに置き、次のフレームが作られた時点で
+    release() により参照できなくなる（参照すると RuntimeError）。知覚ワーカーなど
+    別スレッドから置いた場合はコピーを置くので、ステップをまたいで参照してよい。
+    """
+
+    def __init__(self, sim_time, step, camera):
+        self.sim_time = sim_time
+        self.step = step
+        self.width, self.height = camera.getWidth(), camera.getHeight()
+        self._camera = camera
+        self._values = {}
+        self._lock = threading.RLock()
+        self._owner = threading.get_ident()
+        self._borrowed = set()   # コピーせずに置いたプールの配列のキー
+        self._released = set()
+        self.compute_counts = {}
+
+    @property
+    def image_bytes(self):
+        return self.get('image_bytes', lambda f: f._camera.getImage())
+
+    def _check(self, key):
+        if key in self._released:
+            raise RuntimeError(f"フレーム {self.step} の '{key}' はバッファプールに返却済みです（次のフレームで上書きされます）")
+
+    def get(self, key, compute):
+        with self._lock:
+            self._check(key)
+            if key not in self._values:
+                self._values[key] = compute(self)
+                self.compute_counts[key] = self.compute_counts.get(key, 0) + 1
+            return self._values[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def put_buffer(self, key, buffer):
+        """バッファプールの配列を置く。別スレッドからはコピーを置く。"""
+        with self._lock:
+            if threading.get_ident() == self._owner:
+                self._values[key] = buffer
+                self._borrowed.add(key)
+            else:
+                self._values[key] = buffer.copy()
+                self._borrowed.discard(key)
+            self._released.discard(key)
+
+    def peek(self, key, default=None):
+        with self._lock:
+            self._check(key)
+            return self._values.get(key, default)
+
+    def release(self):
+        """コピーせずに置いたプールの配列を手放す（次のフレームを作るときに呼ばれる）。"""
+        with self._lock:
+            for key in self._borrowed:
+                del self._values[key]
+            self._released |= self._borrowed
+            self._borrowed = set()
+
+    # --- よく使う派生画像 ---
+    def bgra(self):
+        return self.get('bgra', lambda f: np.frombuffer(f.image_bytes, np.uint8).reshape((f.height, f.width, 4)))
+
+    def bgr(self):
+        return self.get('bgr', lambda f: cv2.cvtColor(f.bgra(), cv2.COLOR_BGRA2BGR))
+
+    def rgb(self):
+        return self.get('rgb', lambda f: cv2.cvtColor(f.bgra(), cv2.COLOR_BGRA2RGB))
+
+
+class PerceptionCache:
+    """制御ステップごとの FrameEntry を管理する。
+
+    VehicleController が毎ステップ begin_frame(driver.getTime()) を呼ぶと、その
+    ステップ内の frame(camera) は同じ FrameEntry を返す。begin_frame が呼ばれない
+    場合（単体実行やリプレイ）は frame(camera) の呼び出しごとに新しいフレームになる。
+    新しいフレームを作るときに前のフレームのプールの配列を release() する。
+    """
+
+    def __init__(self):
+        self.current = None
+        self.step = 0
+        self._pending_time = None
+        self._explicit = False
+
+    def begin_frame(self, sim_time):
+        self._explicit = True
+        if self.current is not None and self.current.sim_time == sim_time:
+            return
+        self._pending_time = sim_time
+        self._release_current()
+
+    def frame(self, camera):
+        if self.current is None or not self._explicit:
+            self.step += 1
+            sim_time = self._pending_time if self._explicit else None
+            self._release_current()
+            self.current = FrameEntry(sim_time, self.step, camera)
+        return self.current
+
+    def _release_current(self):
+        if self.current is not None:
+            self.current.release()
+            self.current = None
@@ -0,0 +1,114 @@
+# utils/perception_worker.py
+# 知覚処理を別スレッドで実行し、driver.step() と重ねるためのパイプライン（1フレーム遅延）
+import queue
+import threading
+import time
+
+
+class PerceptionResult:
+    __slots__ = ('seq', 'frame', 'value', 'compute_ms', 'error')
+
+    def __init__(self, seq, frame, value, compute_ms, error=None):
+        self.seq = seq
+        self.frame = frame
+        self.value = value
+        self.compute_ms = compute_ms
+        self.error = error
+
+
+class PerceptionWorker:
+    """フレーム N の知覚処理をワーカースレッドで行い、その間にシミュレーションを進める。
+
+    exchange() はフレーム N を投入し、フレーム N-1 の結果を返す。投入・結果の
+    受け渡しはどちらも容量1のキューで、処理中のフレームは常に高々1枚。OpenCV と
+    nogil の Numba カーネルは GIL を解放するので、Webots のステップと並行に動く。
+    最初のフレームではまだ結果がないので (None, None) を返す（呼び出し側は直前の
+    指令を予測で保持する）。各結果は一度だけ返す。
+    """
+
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+        self._requests = queue.Queue(maxsize=1)
+        self._results = queue.Queue(maxsize=1)
+        self._seq = 0
+        self._pending = False
+        # 計測値（直近と累計）
+        self.last_seq = None
+        self.last_saved_ms = 0.0     # 直列実行と比べて短縮できたウォールクロック時間
+        self.last_latency_ms = 0.0   # 結果の元フレームから適用までのシミュレーション時間
+        self.frames = 0
+        self.total_compute_ms = 0.0
+        self.total_wait_ms = 0.0
+        self.total_latency_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name='perception-worker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            seq, frame, key, compute = item
+            t0 = time.perf_counter()
+            try:
+                value, error = frame.get(key, compute), None
+            except Exception as e:
+                value, error = None, e
+            self._results.put(PerceptionResult(seq, frame, value, (time.perf_counter() - t0) * 1000.0, error))
+
+    def _collect(self):
+        t0 = time.perf_counter()
+        try:
+            result = self._results.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"知覚ワーカーが {self.timeout:.1f} 秒以内に応答しませんでした")
+        self._pending = False
+        if result.error is not None:
+            raise result.error
+        return result, (time.perf_counter() - t0) * 1000.0
+
+    def exchange(self, frame, key, compute):
+        """frame を投入し、1フレーム前の (結果の元フレーム, 結果) を返す。"""
+        frame.image_bytes  # カメラ画像の取得はメインスレッドで行う
+        latest = None
+        if self._pending:
+            latest, wait_ms = self._collect()
+
+        self._seq += 1
+        self._requests.put_nowait((self._seq, frame, key, compute))
+        self._pending = True
+
+        if latest is None:
+            # パイプラインが空（最初のフレーム）: 返す結果はまだない
+            self.last_saved_ms = self.last_latency_ms = 0.0
+            return None, None
+        if frame.sim_time is not None and latest.frame.sim_time is not None:
+            self.last_latency_ms = (frame.sim_time - latest.frame.sim_time) * 1000.0
+        else:
+            self.last_latency_ms = 0.0
+        self.frames += 1
+        self.last_saved_ms = latest.compute_ms - wait_ms
+        self.total_compute_ms += latest.compute_ms
+        self.total_wait_ms += wait_ms
+        self.total_latency_ms += self.last_latency_ms
+
+        self.last_seq = latest.seq
+        return latest.frame, latest.value
+
+    def stop(self):
+        if self._pending:
+            try:
+                self._collect()
+            except Exception:
+                pass
+        self._requests.put(None)
+        self._thread.join(timeout=self.timeout)
+
+    def summary(self):
+        if not self.frames:
+            return "知覚パイプライン: 計測なし"
+        n = self.frames
+        saved = (self.total_compute_ms - self.total_wait_ms) / n
+        return (f"知覚パイプライン: {n}フレーム, 処理 {self.total_compute_ms / n:.2f}ms, "
+                f"待ち {self.total_wait_ms / n:.2f}ms, 短縮 {saved:.2f}ms/フレーム, "
+                f"追加遅延 {self.total_latency_ms / n:.1f}ms")
@@ -0,0 +1,154 @@
+# utils/plot_pipeline.py
+# 分析グラフを独立した図ごとにプロセスプールで描き、入力が変わっていない図は描き直さない
+import collections
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+MANIFEST_FILE = ".plot_manifest.json"   # 出力ディレクトリに置く（ファイル名 -> 入力のハッシュ）
+PLOT_PACKAGES = ('matplotlib', 'seaborn')   # 版が変わると見た目が変わりうるので入力に含める
+# 描画関数から参照されるモジュール変数のうち、見た目の設定としてハッシュに入れる型
+_STYLE_TYPES = (str, int, float, bool, tuple, list, dict)
+
+# 1枚の図: filename に render(data, params, path) で描く。data は DataFrame、params は
+# タイトル・色・サイズなどの見た目の設定（JSON にできる値）。render はプロセスプールへ
+# 渡すのでモジュールの最上位で定義した関数にする。
+PlotJob = collections.namedtuple('PlotJob', ['filename', 'render', 'data', 'params'])
+
+
+def _code_digest(code, h):
+    # marshal.dumps(code) は定数の参照数などで実行ごとに変わるので使わない。
+    # バイトコード・参照する名前・定数（入れ子の関数も）だけを、実行によらない形で入れる
+    h.update(code.co_code)
+    h.update(repr((code.co_names, code.co_varnames, code.co_freevars)).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_digest(const, h)
+        else:
+            h.update(_const_repr(const).encode('utf-8'))
+
+
+def _const_repr(value):
+    # frozenset の repr の順序はハッシュのランダム化で変わるので並べ替える
+    if isinstance(value, frozenset):
+        return 'frozenset(' + repr(sorted(map(_const_repr, value))) + ')'
+    if isinstance(value, tuple):
+        return '(' + ','.join(map(_const_repr, value)) + ')'
+    return repr(value)
+
+
+def _names(code):
+    yield from code.co_names
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _names(const)
+
+
+def _function_digest(func, h, seen):
+    """func のコードと、func が呼ぶ同じモジュールの関数・参照するモジュール変数のハッシュ。"""
+    if func in seen:
+        return
+    seen.add(func)
+    _code_digest(func.__code__, h)
+    for name in sorted(set(_names(func.__code__))):
+        value = func.__globals__.get(name)
+        if isinstance(value, types.FunctionType) and value.__module__ == func.__module__:
+            h.update(name.encode('utf-8'))
+            _function_digest(value, h, seen)   # 共有の描画ヘルパーの変更も検出する
+        elif isinstance(value, _STYLE_TYPES):
+            h.update(json.dumps([name, value], sort_keys=True, default=repr).encode('utf-8'))
+
+
+@functools.lru_cache(maxsize=None)
+def _package_versions():
+    versions = []
+    for name in PLOT_PACKAGES:
+        try:
+            versions.append((name, importlib.metadata.version(name)))
+        except importlib.metadata.PackageNotFoundError:
+            versions.append((name, None))
+    return json.dumps(versions)
+
+
+def job_digest(job, setup=None):
+    """図の入力のハッシュ。
+
+    データ・見た目の設定に加え、描画関数と setup（テーマ設定）のコード、それらが呼ぶ
+    同じモジュールの関数と参照するモジュール変数、matplotlib・seaborn の版を含む。
+    """
+    h = hashlib.sha1()
+    h.update(_package_versions().encode('utf-8'))
+    _function_digest(job.render, h, set())
+    if setup is not None:
+        h.update(b'setup')
+        _function_digest(setup, h, set())
+    h.update(json.dumps(job.params, sort_keys=True, default=str).encode('utf-8'))
+    data = job.data
+    h.update(json.dumps([list(map(str, data.columns)), list(map(str, data.dtypes))]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _init_worker(setup=None):
+    import matplotlib
+    matplotlib.use('Agg')   # 画面のない非対話型バックエンドで描く
+    if setup is not None:
+        setup()   # テーマなど、プロセスごとに1度だけ行う設定
+
+
+def _render(job, path):
+    job.render(job.data, job.params, path)
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_plots(jobs, output_dir, setup=None, workers=None, force=False):
+    """jobs を output_dir に描く。前回と入力が同じで画像が残っている図は飛ばす。
+
+    setup は描く前に各プロセスで1度呼ぶ関数（seaborn のテーマ設定など。モジュールの
+    最上位で定義する）。workers はプロセス数（None なら CPU数、1 なら直列）。
+    描いた枚数を返す。
+    """
+    t0 = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = _load_manifest(manifest_path)
+    pending, digests = [], {}
+    for job in jobs:
+        digest = digests[job.filename] = job_digest(job, setup)
+        path = os.path.join(output_dir, job.filename)
+        if force or manifest.get(job.filename) != digest or not os.path.isfile(path):
+            pending.append(job)
+
+    paths = [os.path.join(output_dir, job.filename) for job in pending]
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(setup,)) as pool:
+            list(pool.map(_render, pending, paths))
+    elif pending:
+        _init_worker(setup)
+        for job, path in zip(pending, paths):
+            _render(job, path)
+
+    for job in pending:
+        manifest[job.filename] = digests[job.filename]
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    print(f"🖼️ グラフ {len(jobs)}枚中 {len(pending)}枚を描画、{len(jobs) - len(pending)}枚は変更なしのため省略"
+          f"（{time.perf_counter() - t0:.2f} 秒、{max(workers, 1)}プロセス）")
+    return len(pending)
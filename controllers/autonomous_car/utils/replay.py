@@ -0,0 +1,87 @@
+# utils/replay.py
+# 記録済みフレームを Webots なしで各モードの get_command に流すためのカメラとローダー
+import glob
+import os
+import numpy as np
+import cv2
+from .frame_recorder import FrameArchive
+
+CAMERA_FOV = 1.0  # worlds/city.wbt のカメラ fieldOfView
+REPLAY_STREAMS = ('original', 'gemini_input')  # カメラ画像全体を記録しているストリーム
+
+
+class ReplayFrame:
+    __slots__ = ('sim_time', 'step', 'image')
+
+    def __init__(self, sim_time, step, image):
+        self.sim_time = sim_time
+        self.step = step
+        self.image = image  # BGRA (H, W, 4) uint8
+
+
+class ReplayCamera:
+    """Webots の Camera と同じ getImage/getWidth/getHeight/getFov を持つ偽カメラ。"""
+
+    def __init__(self, width, height, fov=CAMERA_FOV):
+        self.width, self.height, self.fov = width, height, fov
+        self._image_bytes = b''
+
+    def set_frame(self, image):
+        if image.shape != (self.height, self.width, 4):
+            raise ValueError(f"画像サイズがカメラと一致しません: {image.shape}")
+        self._image_bytes = np.ascontiguousarray(image).tobytes()
+
+    def getImage(self):
+        return self._image_bytes
+
+    def getWidth(self):
+        return self.width
+
+    def getHeight(self):
+        return self.height
+
+    def getFov(self):
+        return self.fov
+
+
+def _load_archive(path, period):
+    archive = FrameArchive(path)
+    names = [n for n in REPLAY_STREAMS if n in archive.streams]
+    if not names:
+        raise ValueError(f"カメラ画像全体のストリーム（{', '.join(REPLAY_STREAMS)}）がありません: {path}")
+    stream = archive.stream(names[0])
+    for i in range(len(stream)):
+        sim_time, step = float(stream.index['sim_time'][i]), int(stream.index['step'][i])
+        if np.isnan(sim_time):
+            sim_time = i * period
+        yield ReplayFrame(sim_time, step, stream.frame(i))
+
+
+def _load_images(paths, period):
+    for i, path in enumerate(paths):
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"画像を読み込めません: {path}")
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+        elif image.shape[2] == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+        yield ReplayFrame(i * period, i + 1, image)
+
+
+def load_recording(path, period=0.05):
+    """記録を ReplayFrame のリストとして読み込む。
+
+    path は FrameRecorder の出力ディレクトリ（*_frames）、PNGなどの画像ディレクトリ
+    （*_original.png / *_input.png をファイル名順に使用）、または glob パターン。
+    時刻が記録されていない場合は period 秒間隔とみなす。
+    """
+    if os.path.isdir(path) and any(n.endswith('.json') for n in os.listdir(path)):
+        return list(_load_archive(path, period))
+    if os.path.isdir(path):
+        paths = sorted(glob.glob(os.path.join(path, '*_original.png')) + glob.glob(os.path.join(path, '*_input.png')))
+    else:
+        paths = sorted(glob.glob(path))
+    if not paths:
+        raise ValueError(f"再生できるフレームがありません: {path}")
+    return list(_load_images(paths, period))
@@ -0,0 +1,123 @@
+# utils/response_cache.py
+# ほぼ同じ画像に対するGeminiの応答を再利用する知覚ハッシュ付きキャッシュ
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+import cv2
+
+HASH_SIZE = 8              # dHash の一辺（64ビット）
+MAX_DISTANCE = 6           # 同一視するハミング距離の上限
+SPEED_BUCKET_KMH = 10.0    # 速度をこの幅で区切ってキーに含める
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """縮小したグレー画像の横方向の輝度差から64ビットの知覚ハッシュを作る。"""
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        image = cv2.cvtColor(image, code)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ResponseCache:
+    """(知覚ハッシュ, 速度区分) をキーにした LRU + TTL キャッシュ。
+
+    同じ速度区分でハミング距離が max_distance 以下の画像を同一視する。path を
+    指定すると起動時に読み込み、close() で保存して実行をまたいで再利用する。
+    TTL は実行をまたぐため壁時計（time.time）で判定する。
+    """
+
+    def __init__(self, max_entries=256, ttl_sec=3600.0, max_distance=MAX_DISTANCE,
+                 speed_bucket_kmh=SPEED_BUCKET_KMH, path=None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.max_distance = max_distance
+        self.speed_bucket_kmh = speed_bucket_kmh
+        self.path = path
+        self.entries = collections.OrderedDict()  # (hash, bucket) -> (command, created)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self._load()
+
+    def _bucket(self, speed_kmh):
+        return int(max(0.0, speed_kmh) // self.speed_bucket_kmh)
+
+    def lookup(self, image_hash, speed_kmh):
+        """キャッシュ済みの指令（dict）を返す。なければ None。"""
+        bucket = self._bucket(speed_kmh)
+        now = time.time()
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key in list(self.entries):
+                command, created = self.entries[key]
+                if now - created > self.ttl_sec:
+                    del self.entries[key]
+                    self.expired += 1
+                    continue
+                if key[1] != bucket:
+                    continue
+                distance = hamming(key[0], image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return dict(self.entries[best_key][0])
+
+    def put(self, image_hash, speed_kmh, command):
+        with self._lock:
+            key = (image_hash, self._bucket(speed_kmh))
+            self.entries[key] = (dict(command), time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for item in data.get('entries', []):
+                if now - item['created'] <= self.ttl_sec:
+                    self.entries[(int(item['hash'], 16), item['bucket'])] = (item['command'], item['created'])
+            print(f"✅ Gemini応答キャッシュを読み込みました: {len(self.entries)}件 ({self.path})")
+        except Exception as e:
+            print(f"⚠️ Gemini応答キャッシュの読み込みに失敗しました: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'entries': [{'hash': f"{h:016x}", 'bucket': b, 'command': c, 'created': t}
+                                for (h, b), (c, t) in self.entries.items()]}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.save()
+
+    def summary(self):
+        return (f"Gemini応答キャッシュ: ヒット {self.hits}, ミス {self.misses} "
+                f"(ヒット率 {self.hit_rate():.1%}), 期限切れ {self.expired}, 保持 {len(self.entries)}件")
@@ -0,0 +1,192 @@
+# utils/run_registry.py
+# 走行の記録（モード・目標速度・結果・ログの場所）をまとめる SQLite の台帳
+import contextlib
+import csv
+import datetime
+import os
+import sqlite3
+
+REGISTRY_FILENAME = "runs.sqlite"   # logs ディレクトリに置く
+STATUSES = ('running', 'goal', 'timeout', 'aborted', 'incomplete')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_file TEXT NOT NULL UNIQUE,      -- logs ディレクトリからの相対パス（区切りは /）
+    mode_name TEXT NOT NULL,
+    run_id INTEGER,
+    target_speed_kmh REAL,
+    time_step_ms INTEGER,
+    base_initial_speed REAL,            -- ランダム化後の初期速度
+    initial_steering REAL,
+    status TEXT NOT NULL DEFAULT 'running',
+    is_goal INTEGER NOT NULL DEFAULT 0,
+    lap_time REAL,
+    started_at TEXT,
+    finished_at TEXT,
+    source TEXT NOT NULL DEFAULT 'controller'   -- 'controller' または 'import'
+);
+CREATE INDEX IF NOT EXISTS idx_runs_mode_speed ON runs (mode_name, target_speed_kmh, started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_speed_started ON runs (target_speed_kmh, started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_status ON runs (status);
+"""
+
+
+def _now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RunRegistry:
+    """logs/runs.sqlite の走行台帳。
+
+    ログのパスは台帳ファイルのあるディレクトリからの相対パス（区切りは /）で
+    持つので、Windows で記録した台帳を別の環境で読んでもそのまま使える。
+    書き込みのたびに接続を開閉し、複数のコントローラーから順に書いても衝突しない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(self.base_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:  # 正常終了でコミット、例外でロールバック
+                yield conn
+        finally:
+            conn.close()
+
+    def relative(self, log_path):
+        """ログのパス（Windows形式の区切りも可）を台帳内の相対パスにする。"""
+        # 相対パスはカレントディレクトリ（コントローラーのディレクトリ）からのものとして扱う
+        log_path = log_path.replace('\\', '/')
+        return os.path.relpath(os.path.abspath(log_path), self.base_dir).replace(os.sep, '/')
+
+    def resolve(self, log_file):
+        return os.path.join(self.base_dir, *log_file.split('/'))
+
+    def start_run(self, log_path, mode_name, run_id, target_speed_kmh=None, time_step_ms=None,
+                  base_initial_speed=None, initial_steering=None):
+        """走行開始時に1行追加し、その行の id を返す。"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR REPLACE INTO runs (log_file, mode_name, run_id, target_speed_kmh, time_step_ms, "
+                "base_initial_speed, initial_steering, status, started_at, source) VALUES (?, ?, ?, ?, ?, ?, ?, 'running', ?, 'controller')",
+                (self.relative(log_path), mode_name, run_id, target_speed_kmh, time_step_ms,
+                 base_initial_speed, initial_steering, _now()))
+            return cur.lastrowid
+
+    def finish_run(self, row_id, status, lap_time=None):
+        if status not in STATUSES:
+            raise ValueError(f"未対応の状態です: {status}")
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET status = ?, is_goal = ?, lap_time = ?, finished_at = ? WHERE id = ?",
+                         (status, int(status == 'goal'), lap_time, _now(), row_id))
+
+    def select_runs(self, mode_name=None, target_speeds=None, status=None, since=None, limit=None):
+        """条件に合う走行を新しい順に返す（dict のリスト。'path' に実際のログのパスを入れる）。"""
+        where, args = [], []
+        if mode_name is not None:
+            where.append("mode_name = ?"); args.append(mode_name)
+        if target_speeds is not None:
+            where.append(f"target_speed_kmh IN ({','.join('?' * len(target_speeds))})"); args += list(target_speeds)
+        if status is not None:
+            where.append("status = ?"); args.append(status)
+        if since is not None:
+            where.append("started_at >= ?"); args.append(since)
+        sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY started_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"; args.append(int(limit))
+        with self._connect() as conn:
+            rows = [dict(r) for r in conn.execute(sql, args)]
+        for r in rows:
+            r['path'] = self.resolve(r['log_file'])
+        return rows
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    # --- 既存ログの取り込み ---
+    def import_logs(self, logs_dir, config_log_path=None, time_step_ms=None):
+        """experiment_config_log.csv と logs_dir 以下の走行ログから台帳を作り直す（既存の行は上書き）。
+
+        設定ログの log_file はファイル名で突き合わせるので、後からサブディレクトリ
+        （logs/60 など）へ移したログも見つかる。設定ログにないログはログの中身から
+        モード・目標速度を推定する。取り込んだ件数を返す。
+        """
+        from .columnar_log import find_run_logs, load_log
+
+        logs = {}
+        for dirpath, dirnames, _ in os.walk(logs_dir):
+            dirnames[:] = [d for d in dirnames if not d.endswith(('_frames', '.runlog'))]
+            for path in find_run_logs(dirpath):
+                logs[os.path.basename(path)] = path
+
+        configs = {}
+        if config_log_path and os.path.isfile(config_log_path):
+            with open(config_log_path, newline='', encoding='utf-8') as f:
+                for row in csv.reader(f):
+                    # 先頭行がヘッダーの場合とない場合（古い設定ログ）の両方を扱う
+                    if len(row) < 7 or row[0] == 'timestamp':
+                        continue
+                    started_at, run_id, mode, initial, base, steering, log_file = row[:7]
+                    configs[os.path.basename(log_file.replace('\\', '/'))] = dict(
+                        started_at=started_at, run_id=int(run_id), mode_name=mode, target_speed_kmh=_float(initial),
+                        base_initial_speed=_float(base), initial_steering=_float(steering))
+
+        rows = []
+        for name, path in sorted(logs.items()):
+            df = load_log(path, columns=['lap_time', 'is_goal', 'target_speed_kmh', 'mode_name', 'run_id'])
+            goal = df[df['is_goal'] == 1]
+            status = 'goal' if len(goal) else 'incomplete'
+            lap_time = float(goal['lap_time'].iloc[-1]) if len(goal) else None
+            info = configs.get(name)
+            if info is None:
+                target = df['target_speed_kmh'].round().mode()
+                info = dict(started_at=_started_from_name(name), run_id=int(df['run_id'].iloc[0]) if len(df) else None,
+                            mode_name=str(df['mode_name'].iloc[0]) if len(df) else name.split('_run')[0][4:],
+                            target_speed_kmh=float(target.iloc[0]) if len(target) else None,
+                            base_initial_speed=None, initial_steering=None)
+            rows.append((self.relative(path), info['mode_name'], info['run_id'], info['target_speed_kmh'], time_step_ms,
+                         info['base_initial_speed'], info['initial_steering'], status, int(status == 'goal'),
+                         lap_time, info['started_at']))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO runs (log_file, mode_name, run_id, target_speed_kmh, time_step_ms, base_initial_speed, "
+                "initial_steering, status, is_goal, lap_time, started_at, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'import')",
+                rows)
+        return len(rows)
+
+
+def _float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def _started_from_name(name):
+    # log_<MODE>_run<N>_<YYYYmmdd-HHMMSS>.csv の時刻部分
+    stamp = os.path.splitext(name)[0].rsplit('_', 1)[-1]
+    try:
+        return datetime.datetime.strptime(stamp, "%Y%m%d-%H%M%S").strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def select_log_paths(logs_dir, target_speeds=None, limit=None):
+    """台帳があれば索引付きの問い合わせで、なければ従来どおり更新時刻の新しい順でログを選ぶ。"""
+    registry_path = os.path.join(logs_dir, REGISTRY_FILENAME)
+    if os.path.isfile(registry_path):
+        runs = RunRegistry(registry_path).select_runs(target_speeds=target_speeds, limit=limit)
+        return [r['path'] for r in runs if os.path.exists(r['path'])]
+    from .columnar_log import find_run_logs
+    paths = [p for p in find_run_logs(logs_dir) if os.path.exists(p)]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    return paths[:limit] if limit is not None else paths
@@ -0,0 +1,141 @@
+# utils/run_summary.py
+# 走行ログごとの集計結果（ゴール・ラップタイム・平均速度・操舵のばらつき）のキャッシュ
+import json
+import os
+import time
+
+import pandas as pd
+
+from .log_loader import load_runs
+
+SUMMARY_CACHE_FILENAME = "run_summaries.json"   # logs ディレクトリに置く
+SUMMARY_VERSION = 2   # 集計の中身を変えたら上げる（古いキャッシュは作り直す）
+# 1走行の単位。同じ run_id でも別のログ（別の実行）なら別の走行として扱う
+RUN_KEY = ['log_file', 'mode_name', 'target_speed_kmh', 'run_id']
+
+# 走行ごとの指標: 名前 -> (必要な列, 行ごとの値を作る関数, 走行ごとの集約方法)
+# 集約は pandas の groupby().agg() の名前（'max'・'last'・'mean'・'std' など）。
+# NaN の行は集約で無視されるので、対象外の行は NaN にしておく。
+RUN_METRICS = {}
+
+
+def register_metric(name, columns, values, how):
+    RUN_METRICS[name] = (tuple(columns), values, how)
+
+
+def _goal(df):
+    return df['is_goal'] == 1
+
+
+def _active(df):
+    return df['is_logging_active'] == 1
+
+
+register_metric('is_goal', ['is_goal'], _goal, 'max')   # bool の max = どれか1行でもゴール
+register_metric('lap_time', ['lap_time', 'is_goal'], lambda df: df['lap_time'].where(_goal(df)), 'last')
+register_metric('avg_speed_kmh', ['speed_kmh', 'is_logging_active'],
+                lambda df: df['speed_kmh'].where(_active(df)), 'mean')
+register_metric('steering_stability', ['steering_angle', 'is_logging_active'],
+                lambda df: df['steering_angle'].where(_active(df)), 'std')
+
+
+def summary_columns():
+    """指標の計算に必要なログの列。"""
+    columns = {c for c in RUN_KEY if c != 'log_file'}
+    for needed, _, _ in RUN_METRICS.values():
+        columns.update(needed)
+    return sorted(columns)
+
+
+def summarize_frame(df):
+    """ログの行（log_file 列付き）を走行ごとに1行へまとめる。
+
+    各指標の行ごとの値を並べた表を1回の groupby で集約する（走行ごとの Python の
+    ループはしない）。
+    """
+    per_row = pd.DataFrame({name: values(df) for name, (_, values, _) in RUN_METRICS.items()})
+    keys = [df[c] for c in RUN_KEY]
+    summary = per_row.groupby(keys, observed=True, sort=False).agg(
+        **{name: (name, how) for name, (_, _, how) in RUN_METRICS.items()})
+    return summary.reset_index()
+
+
+def _file_key(path):
+    # 列形式ログはディレクトリ。チャンク・パートファイルを書くたびにディレクトリの更新時刻が変わる
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class RunSummaryCache:
+    """走行ログのパス・サイズ・更新時刻をキーに、ログごとの集計結果を保存する。
+
+    書き終わったログは変わらないので、再実行時は新しいログと書き換わったログだけを
+    読み直し、残りはキャッシュした行から集計表を作る。キーのパスは logs ディレクトリ
+    からの相対パス（区切りは /）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.entries = {}   # 相対パス -> {'key': [size, mtime_ns], 'rows': [...]}
+        self.hits = 0
+        self.misses = 0
+        if os.path.isfile(path):
+            self._load()
+
+    def _relative(self, log_path):
+        return os.path.relpath(os.path.abspath(log_path), self.base_dir).replace(os.sep, '/')
+
+    def summarize(self, paths, workers=None):
+        """paths の走行ごとの集計を DataFrame で返す（列 log_file に相対パス）。"""
+        t0 = time.perf_counter()
+        stale = []
+        for path in paths:
+            entry = self.entries.get(self._relative(path))
+            if entry is not None and entry['key'] == _file_key(path):
+                self.hits += 1
+            else:
+                stale.append(path)
+        self.misses += len(stale)
+        if stale:
+            # 読み直すログはまとめて（並列に）読み、全走行を一度に集計する
+            df = load_runs(stale, summary_columns(), workers, report=False, source_column='log_file')
+            summary = summarize_frame(df)
+            rows = {path: [] for path in stale}
+            for record in summary.to_dict('records'):
+                path = record.pop('log_file')
+                # JSON に書けるよう Python の値にする（NaN は null）
+                rows[path].append({k: None if pd.isna(v) else v.item() if hasattr(v, 'item') else v
+                                   for k, v in record.items()})
+            for path in stale:
+                self.entries[self._relative(path)] = {'key': _file_key(path), 'rows': rows[path]}
+            self.save()
+        records = [dict(row, log_file=name) for name in map(self._relative, paths)
+                   for row in self.entries[name]['rows']]
+        print(f"📋 走行集計: {len(paths)}ファイル中 {len(paths) - len(stale)}件はキャッシュ、"
+              f"{len(stale)}件を読み直し（{time.perf_counter() - t0:.2f} 秒）")
+        return pd.DataFrame(records, columns=RUN_KEY + list(RUN_METRICS))
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == SUMMARY_VERSION:
+                self.entries = data.get('entries', {})
+        except Exception as e:
+            print(f"⚠️ 走行集計キャッシュの読み込みに失敗しました: {e}")
+
+    def save(self):
+        # 消えたログの分は捨てる
+        entries = {name: entry for name, entry in self.entries.items()
+                   if os.path.exists(os.path.join(self.base_dir, *name.split('/')))}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SUMMARY_VERSION, 'entries': entries}, f)
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+
+
+def summarize_runs(logs_dir, paths, workers=None):
+    """logs_dir/run_summaries.json を使って paths の走行ごとの集計を返す。"""
+    return RunSummaryCache(os.path.join(logs_dir, SUMMARY_CACHE_FILENAME)).summarize(paths, workers)
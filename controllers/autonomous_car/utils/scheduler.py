@@ -0,0 +1,35 @@
+# utils/scheduler.py
+# 知覚・制御・ログ・表示をそれぞれの周期で実行するためのマルチレートスケジューラ
+
+
+class MultiRateScheduler:
+    """シミュレーション時刻（ms）からタスクごとの実行タイミングを判定する。
+
+    周期は basicTimeStep の倍数に切り上げ、実行時刻は周期の格子（0, P, 2P, ...）に
+    揃える。カメラのサンプリング周期を知覚の周期と同じにすれば、新しい画像が届いた
+    ステップでだけ知覚処理が走る。
+    """
+
+    def __init__(self, base_step_ms):
+        self.base_step_ms = int(base_step_ms)
+        self.periods = {}
+        self.next_ms = {}
+        self.runs = {}
+
+    def add(self, name, period_ms):
+        steps = max(1, -(-int(period_ms) // self.base_step_ms))
+        self.periods[name] = steps * self.base_step_ms
+        self.next_ms[name] = 0
+        self.runs[name] = 0
+        return self.periods[name]
+
+    def due(self, name, now_ms):
+        if now_ms < self.next_ms[name]:
+            return False
+        period = self.periods[name]
+        self.next_ms[name] = (now_ms // period + 1) * period
+        self.runs[name] += 1
+        return True
+
+    def summary(self):
+        return ", ".join(f"{name}={self.periods[name]}ms×{self.runs[name]}" for name in self.periods)